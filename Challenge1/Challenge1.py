@@ -1,110 +1,95 @@
+import asyncio
 import hashlib
 import hmac
 import itertools
-import json
+import math
 import os
-import threading
 import time
 from datetime import datetime
 
-import requests
+from alerts import DEFAULT_THRESHOLDS, AlertEngine
+from collector import collect_order_books
+from data_lake import generate_file_name, generate_path_to_folder
+from depth import DepthEngine
+from fetcher import (OrderBookCache, OrderBookFetcher, create_session,
+                     fetch_with_retries)
+from journal import Journal
+from latest_spreads import RING_SIZE, LatestSpreads, start_query_server
+from metrics import collector_metrics, export_metrics, start_metrics_server
+from order_book_stream import WS_URL, OrderBookStream
+from partitions import partition_allocator
+from rollups import RollupWriter, floor_timestamp
+from scheduler import TickScheduler
+from storage import get_storage, use_storage
+from supervisor import Supervisor, report_health, stop_on_sigterm
+from top_of_book import get_top_price, read_top_of_book
+from window_writer import WINDOW_DURATION, WindowWriter
+from writer_queue import BookWriters
 
 API_VERSION = 'api/v3'
-BASE_URL = f'https://sandbox.bitso.com'
-API_KEY = os.environ['API_KEY']
-API_SECRET = os.environ['API_SECRET']
+# Point it to a local replay_server.py to run without network
+BASE_URL = os.environ.get('BASE_URL', 'https://sandbox.bitso.com')
+# Diff-orders stream of INGESTION = 'stream', see order_book_stream.py
+WS_URL = os.environ.get('WS_URL', WS_URL)
+# poll: order_book every second. stream: local books kept with the diffs
+INGESTION = os.environ.get('INGESTION', 'poll')
+STREAM_INTERVAL = 1.0  # Seconds between stream spreads. None: every update
+# Only the private endpoints need them, order_book is public
+API_KEY = os.environ.get('API_KEY')
+API_SECRET = os.environ.get('API_SECRET')
 OBSERVATION_FREQUENCY = 600
-
-
-def generate_path_to_folder(book, timestamp):
-    """Generate the path where the files will be saved
-
-    :param book: name of the order book to save.
-    :type book: str
-
-    :param timestamp: value for create the folder structure.
-    :type timestamp: datetime
-    """
-
-    # to get the current working directory
-    directory = os.getcwd()
-
-    # Get the current date and time for the folder structure
-    year_month_day = timestamp.strftime('%Y%m%d')
-    hour = timestamp.strftime('%H')
-    minute = timestamp.strftime('%M')
-
-    # Join values and build de path
-    full_path = os.path.join(
-        directory,
-        'data_lake',
-        'markets',
-        book,
-        'bid_ask_spread',
-        f'{year_month_day}',
-        f'{hour}'
-    )
-
-    # full_path = os.path.join(
-    #     'data_lake',
-    #     'markets',
-    #     book,
-    #     'bid_ask_spread',
-    #     f'date_{year_month_day}',
-    #     f'hour_{hour}',
-    #     f"minute_{minute}"
-    # )
-
-    return full_path
-
-
-def generate_file_name(timestamp, prefix='spread-'):
-    """Generate the filename to be saved
-
-    :param timestamp: value for file name.
-    :type timestamp: datetime
-
-    :param prefix: file name prefix
-    :type prefix: str
-    """
-    _timestamp = timestamp.strftime('%Y%m%d-%H')
-    # time = timestamp.strftime('%H_%M')
-
-    file_name = f'{prefix}{_timestamp}-part-'
-
-    return file_name
-
-
-def get_last_file_partition(folder, file_name):
-    """ Get the last partition file number
-
-    :param folder: URL resource part.
-    :type folder: str
-
-    :param file_name: URL resource part.
-    :type file_name: str
-    """
-    last_partition = None
-
-    files = os.listdir(folder)
-
-    files = list(
-        filter(lambda f:
-               f.startswith(file_name) and f.endswith('.csv'), files
-               )
-    )
-
-    files = list(
-        map(lambda f:
-            int(f.replace('.csv', '').split('part-').pop()), files
-            )
-    )
-
-    if files is not None and len(files) > 0:
-        files = sorted(files)
-        last_partition = files.pop()
-
-    return last_partition
+BOOKS = ['usd_mxn', 'btc_mxn']
+FILE_FORMAT = 'csv'  # csv, parquet or arrow
+ALERT_THRESHOLDS = DEFAULT_THRESHOLDS  # Spread percent. Ex. [1.0, 0.5, 0.1]
+DEPTH_ANALYTICS = False  # Save depth metrics after the spread, see depth.py
+ROLLUPS = ['1m', '10m', '1h']  # Spread rollup tiers to save, see rollups.py
+METRICS = False  # Time the stages of every tick, see metrics.py
+WRITER_QUEUE_SIZE = 600  # Observations waiting to be written, per book
+WRITER_QUEUE_POLICY = 'block'  # Full queue: block, drop_newest, drop_oldest
+METRICS_FILE = 'collector_metrics.prom'  # Exported every 10 s. None: off
+METRICS_PORT = None  # Serve http://127.0.0.1:<port>/metrics. None: off
+WORKERS = 1  # Processes that share the books. Ex. os.cpu_count()
+JOURNAL = True  # Journal the windows in progress, recovered after a crash
+LATEST_SPREADS = RING_SIZE  # Last observations kept in memory, per book
+QUERY_PORT = None  # Serve http://127.0.0.1:<port>/spreads. None: off
+QUERY_SOCKET = None  # Serve them on this Unix socket instead. None: off
+
+# Keep-alive HTTP session and last responses for fetch_order_book
+http_session = create_session()
+order_book_cache = OrderBookCache()
+
+# Spread alerts, evaluated with every observation
+alert_engine = AlertEngine()
+
+for alert_book in BOOKS:
+    for alert_threshold in ALERT_THRESHOLDS:
+        alert_engine.add_rule(alert_book, alert_threshold)
+
+# Spread at N levels, volume imbalance and effective spread of every book
+depth_engine = DepthEngine() if DEPTH_ANALYTICS else None
+
+# The files are saved locally and, with STORAGE=s3, uploaded in the
+# background. Set by the STORAGE and S3_* variables, see storage.py
+data_lake_storage = get_storage()
+
+use_storage(data_lake_storage)
+
+# Write-ahead journal of the windows in progress, fsynced every 50 ms
+journal = Journal() if JOURNAL else None
+
+# One window (and one file) per book every 10 minutes of wall clock
+spread_windows = WindowWriter(
+    size=OBSERVATION_FREQUENCY,
+    file_format=FILE_FORMAT,
+    metric_columns=depth_engine.columns if depth_engine else (),
+    journal=journal
+)
+
+# Count, mean, min/max, last and p50/p99 of the spread of every book
+rollup_writer = RollupWriter(ROLLUPS)
+
+# The last 24 hours of every book, queried without the Data Lake
+latest_spreads = LatestSpreads(LATEST_SPREADS)
 
 
 def sign_request(request_endpoint):
@@ -115,6 +100,10 @@ def sign_request(request_endpoint):
     :type request_endpoint: str
     """
 
+    # Without credentials the request goes unsigned
+    if not API_KEY or not API_SECRET:
+        return {}
+
     secs = int(time.time())
     dnonce = secs * 1000
     http_method = 'GET'
@@ -143,17 +132,13 @@ def fetch_order_book(book='usd_mxn'):
     """
 
     url_endpoint = f'order_book/?book={book}'
-    headers = sign_request(url_endpoint)
 
     url = f'{BASE_URL}/{API_VERSION}/{url_endpoint}'
 
-    response = requests.get(url, headers=headers)
+    # Reuse the pooled connection, and don't parse unchanged books again
+    content = fetch_with_retries(http_session, url, sign_request, url_endpoint)
 
-    if response.status_code == 200:
-        data = json.loads(response.content)
-        return data
-    else:
-        raise Exception(f'Error getting order books: {response.status_code}')
+    return order_book_cache.load(book, content)
 
 
 def get_best_bid(bid_data):
@@ -193,11 +178,14 @@ def generate_spread_data(bid_data, ask_data):
     :param ask_data: ask orders.
     :type ask_data: list
     """
-    best_bid = get_best_bid(bid_data)
-    best_ask = get_best_ask(ask_data)
+    # The orders come sorted by the API, the best price is the first one
+    best_bid = get_top_price(bid_data)
+    best_ask = get_top_price(ask_data)
 
     spread = (best_ask - best_bid) * 100 / best_ask
 
+    return best_bid, best_ask, spread
+
 
 def save_order_book_data(book, bid_data, ask_data, timestamp, new_partition):
     """ Save the order book data to the Data Lake
@@ -217,67 +205,156 @@ def save_order_book_data(book, bid_data, ask_data, timestamp, new_partition):
     :param new_partition: create a new file partition or append the data.
     :type new_partition: bool
     """
+    best_bid, best_ask, spread = generate_spread_data(bid_data, ask_data)
 
-    path_to_folder = generate_path_to_folder(book, timestamp)
+    save_spread_data(
+        book, best_bid, best_ask, spread, timestamp, new_partition
+    )
 
-    os.makedirs(path_to_folder, exist_ok=True)
 
-    file_name = generate_file_name(timestamp, f'bid_ask_spread-{book}-')
+def save_spread_data(book, best_bid, best_ask, spread, timestamp,
+                     new_partition):
+    """ Save an already computed spread to the Data Lake
 
-    last_partition = get_last_file_partition(path_to_folder, file_name)
+    :param book: name of the order book to save.
+    :type book: str
 
-    # Start partition in 0 if not exists any partitions
-    if new_partition and last_partition is None:
-        file_partition = 0
+    :param best_bid: highest bid price.
+    :type best_bid: float
 
-    # Start new partitions in 1 if directory has partition 0
-    if new_partition and last_partition is not None and last_partition == 0:
-        file_partition = 1
+    :param best_ask: lowest ask price.
+    :type best_ask: float
 
-    # Start new partitions in last+1 if directory has partitions
-    elif new_partition and last_partition is not None and last_partition > 0:
-        file_partition = last_partition + 1
+    :param spread: bid-ask spread in percent.
+    :type spread: float
 
-    # If not exists any partitions:
-    # Start new partitions in 0 or
-    # Use the partition 0
-    elif last_partition is None:
-        file_partition = 0
+    :param timestamp: batch datetime for folder structure and file name.
+    :type timestamp: datetime
+
+    :param new_partition: create a new file partition or append the data.
+    :type new_partition: bool
+    """
+    save_spread_batch(
+        book, [(best_bid, best_ask, spread, timestamp, new_partition)]
+    )
 
-    # Force to use the current partition
-    # Just append the data
-    else:
-        file_partition = last_partition
 
-    full_file_name = file_name + str(file_partition) + ".csv"
+def save_spread_batch(book, observations):
+    """ Save several computed spreads of a book to the Data Lake, in order
 
-    path_to_file = os.path.join(path_to_folder, full_file_name)
+    The consecutive observations of the same file are written at once.
 
+    :param book: name of the order book to save.
+    :type book: str
+
+    :param observations: ``(best_bid, best_ask, spread, timestamp,
+        new_partition)`` tuples, see ``save_spread_data``.
+    :type observations: list
+    """
     file_headers = 'timestamp,book,bid,ask,spread'
 
-    best_bid = get_best_bid(bid_data)
-    best_ask = get_best_ask(ask_data)
+    # [path_to_file, new_partition, lines] of every file to write
+    writes = []
 
-    spread = (best_ask - best_bid) * 100 / best_ask
+    for best_bid, best_ask, spread, timestamp, new_partition in observations:
+        path_to_folder = generate_path_to_folder(book, timestamp)
+
+        file_name = generate_file_name(timestamp, f'bid_ask_spread-{book}-')
+
+        file_content = (
+            f'"{timestamp}","{book}",{best_bid},{best_ask},{spread}\n'
+        )
+
+        # Same file as the previous observation: just append the data
+        if (writes and not new_partition and
+                os.path.basename(writes[-1][0]).startswith(file_name) and
+                os.path.dirname(writes[-1][0]) == path_to_folder):
+            writes[-1][2].append(file_content)
+            continue
+
+        os.makedirs(path_to_folder, exist_ok=True)
+
+        # Start a new partition (0 if the hour has no partitions) or
+        # just append the data to the current one
+        file_partition = None
+
+        if not new_partition:
+            file_partition = partition_allocator.last_partition(
+                path_to_folder, file_name
+            )
+
+        if file_partition is None:
+            file_partition = partition_allocator.next_partition(
+                path_to_folder, file_name
+            )
+
+            # Nothing to append to: a new file, with its headers
+            new_partition = True
+
+        full_file_name = file_name + str(file_partition) + ".csv"
+
+        path_to_file = os.path.join(path_to_folder, full_file_name)
+
+        writes.append([path_to_file, new_partition, [file_content]])
+
+    for path_to_file, new_partition, lines in writes:
+        # A new partition is always a new file: never truncate one
+        # x: create (fails if the file exists)
+        # a: append (or create if file exists)
+        file_open_option = 'x' if new_partition else 'a'
+
+        with open(path_to_file, file_open_option) as file:
+            if new_partition:
+                file.write(file_headers+'\n')
+
+            file.writelines(lines)
 
-    file_content = f'"{timestamp}","{book}",{best_bid},{best_ask},{spread}\n'
+        print(
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            f'- Processed {len(lines)} {book} spread data. File:',
+            os.path.basename(path_to_file))
 
-    # Partition 0 may be interrupted
-    # Overwrite file if new_partiion is True
-    # w: write/create (or overwrite if file exists)
-    # a: append (or create if file exists)
-    file_open_option = "w" if new_partition else 'a'
 
-    with open(path_to_file, file_open_option) as file:
-        if new_partition:
-            file.write(file_headers+'\n')
+# Window of the last observation written of every book, only used by the
+# writer thread of the book
+spread_window_starts = {}
+
+
+def save_spread_ticks(book, observations):
+    """ Save the ticks queued by ``process_order_book_data``, in order
+
+    The writer starts a new file when the tick time of an observation falls
+    in a new 10 minute window of the wall clock. It's decided here and not
+    when queued: a dropped observation never leaves the next ones in the
+    file of the previous window.
+
+    :param book: name of the order book to save.
+    :type book: str
+
+    :param observations: ``(best_bid, best_ask, spread, timestamp,
+        tick_time)`` tuples.
+    :type observations: list
+    """
+    batch = []
+
+    for best_bid, best_ask, spread, timestamp, tick_time in observations:
+        tick_window = floor_timestamp(tick_time, WINDOW_DURATION)
+        new_partition = tick_window != spread_window_starts.get(book)
+        spread_window_starts[book] = tick_window
 
-        file.write(file_content)
+        batch.append((best_bid, best_ask, spread, timestamp, new_partition))
 
-    print(
-        datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        f'- Processed {book} spread data. File:',
-        full_file_name)
+    save_spread_batch(book, batch)
+
+
+# One writer thread per book for process_order_book_data, fed by a bounded
+# queue: the fetcher never waits for the disk, and a book is never written
+# by two threads at the same time
+spread_writers = BookWriters(
+    save_spread_ticks,
+    queue_size=WRITER_QUEUE_SIZE,
+    policy=WRITER_QUEUE_POLICY
+)
 
 
 def process_order_book_data(book='usd_mxn', requests_number=1):
@@ -301,40 +378,60 @@ def process_order_book_data(book='usd_mxn', requests_number=1):
     # print(datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
     #       f'- Process {book} spread data')
 
+    # Ticks on the whole seconds of the wall clock, without drift
+    scheduler = TickScheduler()
+    tick = scheduler.first_tick()
+
+    def queue_spread(best_bid, best_ask, spread, observed_at, tick_time):
+        # The writer of the book saves it in parallel, in a new file on
+        # every 10 minute boundary of the tick times. With the BLOCK
+        # policy, this waits while the queue is full
+        spread_writers.put(book, (
+            best_bid, best_ask, spread, observed_at, tick_time
+        ))
+
     # Get the order books every second
     # while True: # uncomment when delete the _temp_*
     while _temp_should_stop is False:
+        scheduler.wait_sync(tick)
+
+        tick_time = scheduler.tick_time(tick)
+
         # Check if the data has reached the target records (requests_number)
         if requests_number > requests_counter:
-            data = fetch_order_book(book)
-
-            updated_at = data['payload']['updated_at']
-            sequence = data['payload']['sequence']
-            bids = data['payload']['bids']
-            asks = data['payload']['asks']
-
-            timestamp = datetime.fromisoformat(updated_at)
-
-            # Use a new thread to process and save in parallel.
-            thread_save_order_book_data = threading.Thread(
-                target=save_order_book_data,
-                kwargs={
-                    'book': book,
-                    'bid_data': bids.copy(),
-                    'ask_data': asks.copy(),
-                    'timestamp': timestamp,
-                    'new_partition': requests_counter == 1
-                }
-            )
-
-            thread_save_order_book_data.start()
+            try:
+                data = fetch_order_book(book)
+            except Exception as error:
+                print(
+                    datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    f'- Error fetching {book}: {error}'
+                )
+                data = None
+
+            if data is None:
+                # Record the gap
+                queue_spread(
+                    math.nan, math.nan, math.nan, tick_time, tick_time
+                )
+            else:
+                updated_at = data['payload']['updated_at']
+                sequence = data['payload']['sequence']
+                bids = data['payload']['bids']
+                asks = data['payload']['asks']
+
+                timestamp = datetime.fromisoformat(updated_at)
+
+                # Only the spread is queued, not the whole book
+                best_bid, best_ask, spread = generate_spread_data(bids, asks)
+
+                queue_spread(best_bid, best_ask, spread, timestamp, tick_time)
 
             requests_counter = requests_counter + 1
         else:
             # break  # don't break. Just for test
 
             print(
-                timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+                tick_time.strftime('%Y-%m-%d %H:%M:%S'),
                 f'- Processing {book} order book data'
             )
 
@@ -344,40 +441,273 @@ def process_order_book_data(book='usd_mxn', requests_number=1):
 
             # Clean control and util variables
             requests_counter = 0
-            thread_save_order_book_data = None
 
-        # Sleep for 1 second (0.5 second to compensate any delay)
-        time.sleep(0.5)
+        # The ticks already over are recorded as gaps
+        tick, skipped_ticks = scheduler.next_tick(tick)
 
+        for skipped in skipped_ticks:
+            skipped_time = scheduler.tick_time(skipped)
 
-def main():
-    # # # # # process_order_book_data(book='usd_mxn', requests_number=10) # just for Test
-    # # # # # process_order_book_data(book='btc_mxn', requests_number=10) # just for Test
+            queue_spread(
+                math.nan, math.nan, math.nan, skipped_time, skipped_time
+            )
 
-    # while datetime.now().minute not in [0, 10, 20, 30, 40, 50]:
-    while datetime.now().minute not in [0]:
-        time.sleep(1)
+    # Write the queued observations before returning
+    spread_writers.close(book)
 
-    thread_usd_mxn = threading.Thread(
-        target=process_order_book_data, kwargs={
-            'book': 'usd_mxn',
-            'requests_number': OBSERVATION_FREQUENCY
-        }
-    )
-    thread_usd_mxn.start()
-    thread_usd_mxn.join()
 
-    time.sleep(60)
+async def save_order_book_tick(book, data, tick_time):
+    """ Save one tick of the concurrent collector to the Data Lake
+
+    :param book: name of the order book to save.
+    :type book: str
+
+    :param data: best bid and ask of the order book. None for a gap: the
+        tick was missed or its request failed.
+    :type data: top_of_book.TopOfBook
+
+    :param tick_time: wall clock time of the tick, in UTC.
+    :type tick_time: datetime
+    """
+    if data is not None and (data.bid is None or data.ask is None):
+        print(
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            f'- Skipped {book}: the order book has an empty side'
+        )
+        data = None
+
+    with collector_metrics.timer('compute_seconds'):
+        if data is None:
+            # Record the gap, the window keeps one row per tick
+            full_files = spread_windows.add_gap(book, tick_time)
+
+            latest_spreads.add_gap(book, tick_time)
+        else:
+            best_bid = data.bid
+            best_ask = data.ask
+
+            timestamp = datetime.fromisoformat(data.updated_at)
+
+            spread = (best_ask - best_bid) * 100 / best_ask
+
+            alert_engine.evaluate(book, spread, timestamp)
+
+            latest_spreads.add(book, tick_time, best_bid, best_ask, spread)
+
+            # Keep the observation in memory until its window is closed
+            full_files = spread_windows.add(
+                book, timestamp, best_bid, best_ask, spread, data.metrics,
+                tick_time
+            )
+
+            # The rollups of an interval are closed with the first
+            # observation of the next one
+            full_files.extend(rollup_writer.add(book, timestamp, spread))
+
+    loop = asyncio.get_running_loop()
+
+    for full_file in full_files:
+        collector_metrics.add_to_gauge('write_queue_depth', 1)
+
+        try:
+            # The file write is blocking, keep it out of the event loop
+            await loop.run_in_executor(None, flush_file, full_file)
+        finally:
+            collector_metrics.add_to_gauge('write_queue_depth', -1)
+
+
+def flush_file(full_file):
+    """ Save a full window or rollup file, timing the write
+
+    :param full_file: window or rollup file to save.
+    :type full_file: window_writer.SpreadWindow or rollups.RollupFile
+    """
+    with collector_metrics.timer('write_seconds'):
+        return full_file.flush()
+
+
+async def run_collector(fetcher, books=None, reports=None, worker=None,
+                        alignment=None):
+    """ Collect the order books and export the metrics, if enabled
+
+    :param fetcher: fetcher shared by all the books.
+    :type fetcher: fetcher.OrderBookFetcher
+
+    :param books: names of the order books to collect.
+        Default: ``BOOKS``
+    :type books: list
 
-    thread_btc_mxn = threading.Thread(
-        target=process_order_book_data, kwargs={
-            'book': 'btc_mxn',
-            'requests_number': OBSERVATION_FREQUENCY
-        }
+    :param reports: queue of the supervisor, when running as a worker. The
+        metrics are reported to it instead of exported.
+        Default: not a worker
+    :type reports: multiprocessing.Queue
+
+    :param worker: number of the worker.
+    :type worker: int
+
+    :param alignment: start on a multiple of these seconds of wall clock.
+        Default: start right away
+    :type alignment: float
+    """
+    if books is None:
+        books = BOOKS
+
+    exporter = None
+    metrics_server = None
+
+    if reports is not None:
+        exporter = asyncio.create_task(
+            report_health(reports, worker, collector_metrics)
+        )
+    elif METRICS and METRICS_FILE:
+        exporter = asyncio.create_task(
+            export_metrics(collector_metrics, METRICS_FILE)
+        )
+
+    if reports is None and METRICS and METRICS_PORT:
+        metrics_server = await start_metrics_server(
+            collector_metrics, port=METRICS_PORT
+        )
+
+    # Uploads the files spooled by this process (and the ones left before)
+    uploader = asyncio.create_task(data_lake_storage.run())
+
+    # The books are known to the queries before their first observation
+    for book in books:
+        latest_spreads.get_ring(book)
+
+    query_server = None
+
+    # Every worker has the rings of its books: its own port or socket
+    if QUERY_SOCKET:
+        query_server = await start_query_server(
+            latest_spreads,
+            path=QUERY_SOCKET if worker is None else f'{QUERY_SOCKET}.{worker}'
+        )
+    elif QUERY_PORT:
+        query_server = await start_query_server(
+            latest_spreads, port=QUERY_PORT + (worker or 0)
+        )
+
+    try:
+        if INGESTION == 'stream':
+            stream = OrderBookStream(
+                books, fetcher, save_order_book_tick, WS_URL,
+                STREAM_INTERVAL, depth_engine
+            )
+
+            await stream.run(alignment=alignment)
+        else:
+            await collect_order_books(
+                books, fetcher, save_order_book_tick, alignment=alignment
+            )
+    finally:
+        if exporter is not None:
+            # The exporter saves the file (or reports) one last time when
+            # cancelled
+            exporter.cancel()
+            await asyncio.gather(exporter, return_exceptions=True)
+
+        if metrics_server is not None:
+            await metrics_server.cleanup()
+
+        if query_server is not None:
+            await query_server.cleanup()
+
+        uploader.cancel()
+        await asyncio.gather(uploader, return_exceptions=True)
+
+
+def collect(books=None, reports=None, worker=None, alignment=None):
+    """ Collect the order books until interrupted, in this process
+
+    :param books: names of the order books to collect.
+        Default: ``BOOKS``
+    :type books: list
+
+    :param reports: queue of the supervisor, when running as a worker.
+        Default: not a worker
+    :type reports: multiprocessing.Queue
+
+    :param worker: number of the worker.
+    :type worker: int
+
+    :param alignment: start on a multiple of these seconds of wall clock.
+        Default: start right away
+    :type alignment: float
+    """
+    # All the books are polled at the same time from a single event loop
+    # Only the best bid and ask (and the levels for the depth metrics)
+    # are read from the responses
+    parse = depth_engine.read if depth_engine else read_top_of_book
+
+    fetcher = OrderBookFetcher(
+        f'{BASE_URL}/{API_VERSION}', sign_request, parse=parse
     )
 
-    thread_btc_mxn.start()
-    thread_btc_mxn.join()
+    collector_metrics.enabled = METRICS
+
+    # Save the windows left by a crash, and go on with the current ones
+    for window in spread_windows.recover(books):
+        window.flush()
+
+    try:
+        asyncio.run(
+            run_collector(fetcher, books, reports, worker, alignment)
+        )
+    finally:
+        # Don't lose the observations of the windows in progress
+        for window in spread_windows.pop_all():
+            window.flush()
+
+        for rollup_file in rollup_writer.pop_all():
+            rollup_file.flush()
+
+        if journal is not None:
+            journal.close()
+
+        # Upload the last files, for a while
+        data_lake_storage.close()
+
+
+def run_worker(worker, books, reports):
+    """ Collect a shard of the books in a worker process of the supervisor
+
+    :param worker: number of the worker.
+    :type worker: int
+
+    :param books: names of the order books of the worker.
+    :type books: list
+
+    :param reports: queue of the supervisor.
+    :type reports: multiprocessing.Queue
+    """
+    # The supervisor stops the workers with SIGTERM
+    stop_on_sigterm()
+
+    # Start right away, a restarted worker must not wait for the next
+    # window: the windows are cut on their boundaries anyway
+    try:
+        collect(books, reports, worker)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+
+
+def main():
+    # # # # # process_order_book_data(book='usd_mxn', requests_number=10) # just for Test
+    # # # # # process_order_book_data(book='btc_mxn', requests_number=10) # just for Test
+
+    if WORKERS > 1:
+        # The books are sharded across processes, each with its own loop
+        supervisor = Supervisor(BOOKS, run_worker, WORKERS)
+
+        asyncio.run(supervisor.run(
+            METRICS_FILE if METRICS else None,
+            METRICS_PORT if METRICS else None
+        ))
+    else:
+        # Start with a whole window: on the next 10 minute boundary
+        collect(alignment=WINDOW_DURATION.total_seconds())
 
 
 # Run the main function
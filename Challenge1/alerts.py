@@ -0,0 +1,311 @@
+import bisect
+import json
+from collections import deque, namedtuple
+from datetime import datetime
+
+ABOVE = 'above'
+BELOW = 'below'
+
+# Spread thresholds (percent) of the Markets team
+DEFAULT_THRESHOLDS = [1.0, 0.5, 0.1]
+
+# Percent points the spread must come back before a rule fires again
+HYSTERESIS = 0.01
+
+# Consecutive observations that must cross a threshold to fire or resolve
+DEBOUNCE = 1
+
+TRIGGERED = 'triggered'
+RESOLVED = 'resolved'
+
+Rule = namedtuple('Rule', ['rule_id', 'book', 'threshold', 'direction'])
+
+Alert = namedtuple(
+    'Alert', ['rule', 'state', 'spread', 'timestamp']
+)
+
+
+def print_sink(alert):
+    """ Print an alert, the default sink
+
+    :param alert: alert to report.
+    :type alert: Alert
+    """
+    rule = alert.rule
+
+    print(
+        datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        f'- Alert {alert.state}: {rule.book} spread {alert.spread:.6f}%',
+        f'{rule.direction} {rule.threshold}%',
+        f'at {alert.timestamp}'
+    )
+
+
+class JsonLinesSink:
+    """ Append every alert as a JSON line to a file
+
+    :param path_to_file: file where the alerts are appended.
+    :type path_to_file: str
+    """
+
+    def __init__(self, path_to_file):
+        self.path_to_file = path_to_file
+
+    def __call__(self, alert):
+        rule = alert.rule
+
+        line = json.dumps({
+            'rule_id': rule.rule_id,
+            'book': rule.book,
+            'threshold': rule.threshold,
+            'direction': rule.direction,
+            'state': alert.state,
+            'spread': alert.spread,
+            'timestamp': str(alert.timestamp),
+        })
+
+        with open(self.path_to_file, 'a') as file:
+            file.write(line + '\n')
+
+
+class RuleGroup:
+    """ Rules of one (book, direction), sorted by threshold
+
+    The rules are kept as "spread above threshold". A ``below`` rule is
+    stored with both threshold and spread negated.
+
+    With a shared hysteresis, the triggered rules are always the ones with
+    the lowest thresholds, so the state of the whole group is a single
+    number: ``triggered``, the rules ``[0, triggered)`` are firing.
+    """
+
+    def __init__(self):
+        self.thresholds = []
+        self.rules = []
+        self.triggered = 0
+
+    def add(self, key, rule):
+        """ Add a rule. Return True if it's added as triggered """
+        position = bisect.bisect_right(self.thresholds, key)
+
+        self.thresholds.insert(position, key)
+        self.rules.insert(position, rule)
+
+        # A new rule among the triggered ones is triggered too: the spread
+        # is over its threshold, or inside its hysteresis band
+        if position < self.triggered:
+            self.triggered = self.triggered + 1
+            return True
+
+        return False
+
+    def remove(self, key, rule):
+        position = bisect.bisect_left(self.thresholds, key)
+
+        while self.rules[position] != rule:
+            position = position + 1
+
+        del self.thresholds[position]
+        del self.rules[position]
+
+        if position < self.triggered:
+            self.triggered = self.triggered - 1
+
+    def evaluate(self, lowest, highest, hysteresis):
+        """ Update the state. Return the fired and the resolved rules
+
+        :param lowest: lowest value of the debounce window.
+        :type lowest: float
+
+        :param highest: highest value of the debounce window.
+        :type highest: float
+
+        :param hysteresis: band under a threshold to resolve its rule.
+        :type hysteresis: float
+        """
+        fired = []
+        resolved = []
+
+        # Every value of the window is bigger than these thresholds
+        crossed = bisect.bisect_left(self.thresholds, lowest)
+
+        if crossed > self.triggered:
+            fired = self.rules[self.triggered:crossed]
+            self.triggered = crossed
+
+        # Every value of the window is below these thresholds - hysteresis
+        cleared = bisect.bisect_right(self.thresholds, highest + hysteresis)
+
+        if cleared < self.triggered:
+            resolved = self.rules[cleared:self.triggered]
+            self.triggered = cleared
+
+        return fired, resolved
+
+
+class AlertEngine:
+    """ Evaluate spread alert rules with every observation
+
+    The rules are indexed by book and direction, and sorted by threshold,
+    so each observation costs O(log n) plus the alerts it produces, no
+    matter how many rules are registered.
+
+    :param sinks: functions called with every ``Alert``.
+        Default: ``[print_sink]``
+    :type sinks: list
+
+    :param hysteresis: percent points the spread must come back under
+        (or over, for ``below`` rules) a threshold to resolve its alert.
+        Default: ``HYSTERESIS``
+    :type hysteresis: float
+
+    :param debounce: consecutive observations that must cross a threshold
+        to fire or resolve an alert.
+        Default: ``DEBOUNCE``
+    :type debounce: int
+    """
+
+    def __init__(self, sinks=None, hysteresis=HYSTERESIS, debounce=DEBOUNCE):
+        self.sinks = [print_sink] if sinks is None else sinks
+        self.hysteresis = hysteresis
+        self.debounce = debounce
+        self.groups = {}
+        self.rules = {}
+        self.spreads = {}
+        self.next_rule_id = 0
+
+        # Last (spread, timestamp) of every book, to evaluate the new rules
+        self.observations = {}
+
+    def add_rule(self, book, threshold, direction=ABOVE):
+        """ Register a rule. Return it, its ``rule_id`` removes it
+
+        The rule is evaluated with the last observations of the book, so a
+        threshold already crossed fires right away.
+
+        :param book: name of the order book.
+        :type book: str
+
+        :param threshold: spread in percent. Example: ``0.5``
+        :type threshold: float
+
+        :param direction: ``above`` or ``below`` the threshold.
+            Default: ``above``
+        :type direction: str
+        """
+        if direction not in (ABOVE, BELOW):
+            raise ValueError(f'Unknown alert direction: {direction}')
+
+        rule = Rule(self.next_rule_id, book, threshold, direction)
+        self.next_rule_id = self.next_rule_id + 1
+
+        key = threshold if direction == ABOVE else -threshold
+
+        group = self.groups.setdefault((book, direction), RuleGroup())
+        triggered = group.add(key, rule)
+
+        self.rules[rule.rule_id] = rule
+
+        observation = self.observations.get(book)
+
+        if observation is not None:
+            spread, timestamp = observation
+
+            if triggered:
+                self.notify(Alert(rule, TRIGGERED, spread, timestamp))
+
+            self.evaluate_group(book, direction, spread, timestamp)
+
+        return rule
+
+    def remove_rule(self, rule_id):
+        """ Unregister a rule
+
+        :param rule_id: id of the rule returned by ``add_rule``.
+        :type rule_id: int
+        """
+        rule = self.rules.pop(rule_id)
+
+        key = rule.threshold if rule.direction == ABOVE else -rule.threshold
+
+        self.groups[(rule.book, rule.direction)].remove(key, rule)
+
+    def evaluate(self, book, spread, timestamp):
+        """ Evaluate the rules of a book with a new observation
+
+        :param book: name of the order book.
+        :type book: str
+
+        :param spread: bid-ask spread in percent.
+        :type spread: float
+
+        :param timestamp: order book timestamp.
+        :type timestamp: datetime
+        """
+        spreads = self.spreads.get(book)
+
+        if spreads is None:
+            spreads = deque(maxlen=self.debounce)
+            self.spreads[book] = spreads
+
+        spreads.append(spread)
+        self.observations[book] = (spread, timestamp)
+
+        for direction in (ABOVE, BELOW):
+            self.evaluate_group(book, direction, spread, timestamp)
+
+    def evaluate_group(self, book, direction, spread, timestamp):
+        """ Evaluate the rules of a (book, direction) with the debounce
+        window of the book, and send the alerts
+
+        :param book: name of the order book.
+        :type book: str
+
+        :param direction: ``above`` or ``below``.
+        :type direction: str
+
+        :param spread: last spread of the book, in percent.
+        :type spread: float
+
+        :param timestamp: order book timestamp of the last spread.
+        :type timestamp: datetime
+        """
+        group = self.groups.get((book, direction))
+        spreads = self.spreads.get(book)
+
+        # Not enough observations yet to fire or resolve anything
+        if group is None or spreads is None or len(spreads) < self.debounce:
+            return
+
+        lowest = min(spreads)
+        highest = max(spreads)
+
+        if direction == ABOVE:
+            fired, resolved = group.evaluate(
+                lowest, highest, self.hysteresis
+            )
+        else:
+            fired, resolved = group.evaluate(
+                -highest, -lowest, self.hysteresis
+            )
+
+        for rule in fired:
+            self.notify(Alert(rule, TRIGGERED, spread, timestamp))
+
+        for rule in resolved:
+            self.notify(Alert(rule, RESOLVED, spread, timestamp))
+
+    def notify(self, alert):
+        """ Send an alert to every sink. A failing sink doesn't stop others
+
+        :param alert: alert to report.
+        :type alert: Alert
+        """
+        for sink in self.sinks:
+            try:
+                sink(alert)
+            except Exception as error:
+                print(
+                    datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    f'- Error sending alert: {error}'
+                )
@@ -0,0 +1,358 @@
+""" Archive the closed days of the Data Lake in block compressed files
+
+The spread files of a closed day of a book are merged (sorted by tick time
+and without the copies of the same tick, see ``compaction.merge_rows``) in
+a single file, ``<DATE>/bid_ask_spread-<PAIR>-<DATE>.csv.zblocks``: blocks
+of ``BLOCK_ROWS`` rows, each one a CSV compressed on its own. A hidden
+index next to it has the offset, the size and the statistics (see
+``zone_maps.py``) of every block, so the readers decompress only the
+blocks of the requested time range. Then the hour folders are removed.
+
+Usage: python archive.py [--book btc_mxn] [--day 20231001]
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import shutil
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from compaction import (COMPACTION_DELAY, list_book_hours, merge_rows,
+                        rows_to_window)
+from data_lake import (generate_file_name, generate_path_to_folder,
+                       list_partition_files)
+from file_formats import SPREAD_COLUMNS, parse_csv_with_metrics
+from storage import get_storage, remove_file, save_file, use_storage
+from zone_maps import (may_have_rows, remove_statistics, window_statistics,
+                       write_statistics)
+
+ARCHIVE_EXTENSION = '.zblocks'
+
+# Index of an archive, kept next to it as a small hidden file:
+# .<archive name>.index.json
+INDEX_SUFFIX = '.index.json'
+
+# Rows per compressed block: about 17 minutes of one observation per
+# second, the smallest piece of the day a reader decompresses
+BLOCK_ROWS = 1024
+
+# zlib level of the blocks: a day is archived once and read many times
+COMPRESSION_LEVEL = 9
+
+# A day is archived once this time has passed since its end, when its
+# last hour can be compacted
+ARCHIVE_DELAY = COMPACTION_DELAY
+
+
+def get_archive_path(book, day, directory=None):
+    """ Get the path of the archive of a day of a book
+
+    :param book: name of the order book.
+    :type book: str
+
+    :param day: day of the archive.
+    :type day: datetime
+
+    :param directory: folder that contains the ``data_lake``.
+        Default: the current working directory
+    :type directory: str
+    """
+    day_folder = os.path.dirname(generate_path_to_folder(book, day, directory))
+
+    return os.path.join(
+        day_folder,
+        f'bid_ask_spread-{book}-{day.strftime("%Y%m%d")}.csv'
+        f'{ARCHIVE_EXTENSION}'
+    )
+
+
+def get_index_path(path_to_archive):
+    """ Get the path of the index of an archive
+
+    :param path_to_archive: path of the archive.
+    :type path_to_archive: str
+    """
+    folder, file_name = os.path.split(path_to_archive)
+
+    return os.path.join(folder, f'.{file_name}{INDEX_SUFFIX}')
+
+
+def is_archive(path_to_file):
+    return path_to_file.endswith(ARCHIVE_EXTENSION)
+
+
+def read_index(path_to_archive):
+    """ Get the index of an archive, None if the day is not archived
+
+    The index is written after the archive, so an archive without index
+    is incomplete and ignored.
+
+    :param path_to_archive: path of the archive.
+    :type path_to_archive: str
+    """
+    try:
+        with open(get_index_path(path_to_archive)) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def compress_blocks(book, metric_columns, rows, block_rows=BLOCK_ROWS):
+    """ Compress sorted rows in blocks
+
+    Return the content of the archive and the index entry of every block:
+    its statistics, ``offset`` and ``size``.
+
+    :param book: name of the order book.
+    :type book: str
+
+    :param metric_columns: names of the extra metrics.
+    :type metric_columns: list
+
+    :param rows: rows of all the columns, sorted by tick time.
+    :type rows: list
+
+    :param block_rows: rows per block.
+        Default: ``BLOCK_ROWS``
+    :type block_rows: int
+    """
+    content = io.BytesIO()
+    blocks = []
+
+    for position in range(0, len(rows), block_rows):
+        window = rows_to_window(
+            book, metric_columns, rows[position:position + block_rows], 'csv'
+        )
+
+        data = zlib.compress(window.to_csv().encode(), COMPRESSION_LEVEL)
+
+        block = window_statistics(window)
+        block['offset'] = content.tell()
+        block['size'] = len(data)
+
+        content.write(data)
+        blocks.append(block)
+
+    return content.getvalue(), blocks
+
+
+def select_blocks(index, start, end, min_spread=None, max_spread=None):
+    """ Get the blocks of an archive that may have rows matching the filters
+
+    See ``zone_maps.may_have_rows`` for the parameters.
+    """
+    return [
+        block for block in index['blocks']
+        if may_have_rows(block, start, end, min_spread, max_spread)
+    ]
+
+
+def read_blocks(path_to_archive, blocks):
+    """ Decompress some blocks of an archive, reading only their bytes
+
+    Return the metric names and the rows of all the columns.
+
+    :param path_to_archive: path of the archive.
+    :type path_to_archive: str
+
+    :param blocks: index entries of the blocks, see ``select_blocks``.
+    :type blocks: list
+    """
+    metric_columns = []
+    rows = []
+
+    with open(path_to_archive, 'rb') as file:
+        for block in blocks:
+            file.seek(block['offset'])
+            content = zlib.decompress(file.read(block['size'])).decode()
+
+            metric_columns, block_rows = parse_csv_with_metrics(
+                io.StringIO(content, newline='')
+            )
+            rows.extend(block_rows)
+
+    return metric_columns, rows
+
+
+def read_archive(path_to_archive, start, end, min_spread=None,
+                 max_spread=None):
+    """ Read the ``(orderbook_timestamp, book, bid, ask, spread,
+    tick_time)`` rows of the blocks of an archive that may match the
+    filters
+
+    The rows are not filtered, only the blocks. See
+    ``zone_maps.may_have_rows`` for the parameters.
+    """
+    index = read_index(path_to_archive)
+    blocks = select_blocks(index, start, end, min_spread, max_spread)
+
+    _, rows = read_blocks(path_to_archive, blocks)
+
+    return [row[:len(SPREAD_COLUMNS)] for row in rows]
+
+
+def archive_day(book, day, hours, directory=None):
+    """ Archive the spread files of a day of a book and remove its hours
+
+    A day already archived is archived again with the files found in its
+    hours (left by a crash before they were removed). The archive and its
+    index are saved durably before the hours are removed.
+
+    Return ``(files_before, bytes_before, blocks, bytes_after)``, or None
+    if there is nothing to archive.
+
+    :param book: name of the order book.
+    :type book: str
+
+    :param day: day to archive.
+    :type day: datetime
+
+    :param hours: ``(hour, folder)`` of the day.
+    :type hours: list
+
+    :param directory: folder that contains the ``data_lake``.
+        Default: the current working directory
+    :type directory: str
+    """
+    path_to_archive = get_archive_path(book, day, directory)
+    index = read_index(path_to_archive)
+
+    files = [
+        path_to_file
+        for hour, folder in hours
+        for _, path_to_file in list_partition_files(
+            folder, generate_file_name(hour, f'bid_ask_spread-{book}-')
+        )
+    ]
+
+    read_rows = []
+    bytes_before = sum(os.path.getsize(path) for path in files)
+
+    if index is not None:
+        read_rows.append(read_blocks(path_to_archive, index['blocks']))
+        bytes_before = bytes_before + os.path.getsize(path_to_archive)
+
+    if files:
+        metric_columns, rows = merge_rows(files, read_rows)
+        content, blocks = compress_blocks(book, metric_columns, rows)
+
+        save_file(path_to_archive, content, 'wb', durable=True)
+
+        write_statistics(path_to_archive, window_statistics(
+            rows_to_window(book, metric_columns, rows, 'csv')
+        ))
+
+        # The day is archived once its index is saved
+        save_file(
+            get_index_path(path_to_archive),
+            json.dumps({
+                'book': book,
+                'day': day.strftime('%Y%m%d'),
+                'metric_columns': metric_columns,
+                'blocks': blocks,
+            }),
+            durable=True
+        )
+
+    # The spread files and their statistics go through the storage, the
+    # rest of the hours (never uploaded) is removed as it is
+    for path_to_file in files:
+        remove_file(path_to_file)
+        remove_statistics(path_to_file)
+
+    for _, folder in hours:
+        shutil.rmtree(folder)
+
+    if not files:
+        return None
+
+    return (
+        len(files), bytes_before, len(blocks),
+        os.path.getsize(path_to_archive)
+    )
+
+
+def archive_data_lake(books=None, day=None, directory=None,
+                      delay=ARCHIVE_DELAY):
+    """ Archive the closed days of the Data Lake and report the savings
+
+    Return ``(files_before, bytes_before, blocks, bytes_after)`` of the
+    archived days.
+
+    :param books: names of the order books. Default: all of them
+    :type books: list
+
+    :param day: only this day. Example: ``20231001``
+        Default: all the days
+    :type day: str
+
+    :param directory: folder that contains the ``data_lake``.
+        Default: the current working directory
+    :type directory: str
+
+    :param delay: time after the end of a day before archiving it.
+        Default: ``ARCHIVE_DELAY``
+    :type delay: timedelta
+    """
+    closed_before = datetime.now(timezone.utc) - delay
+    totals = [0, 0, 0, 0]
+
+    book_hours = list_book_hours(books, day, directory)
+
+    for (book, day_start), hours in itertools.groupby(
+        book_hours,
+        key=lambda item: (item[0], item[1].replace(hour=0))
+    ):
+        # The collector (or the compaction) may still save files of this day
+        if day_start + timedelta(days=1) > closed_before:
+            continue
+
+        hours = [(hour, folder) for _, hour, folder in hours]
+
+        result = archive_day(book, day_start, hours, directory)
+
+        if result is None:
+            continue
+
+        files_before, bytes_before, blocks, bytes_after = result
+
+        print(
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            f'- Archived {book} {day_start.strftime("%Y%m%d")}:',
+            f'{files_before} files ({bytes_before} bytes) ->',
+            f'{blocks} blocks ({bytes_after} bytes)'
+        )
+
+        totals = [total + value for total, value in zip(totals, result)]
+
+    print(
+        datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        f'- Archive done: {totals[0]} files ({totals[1]} bytes) ->',
+        f'{totals[2]} blocks ({totals[3]} bytes)'
+    )
+
+    return tuple(totals)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--book', action='append', dest='books',
+                        help='order book to archive, can be repeated. '
+                             'Default: all of them')
+    parser.add_argument('--day', help='only this day, as YYYYMMDD')
+    parser.add_argument('--directory',
+                        help='folder that contains the data_lake. '
+                             'Default: the current working directory')
+    args = parser.parse_args()
+
+    # With s3, the archives and the removals are spooled for the collector
+    # to upload
+    use_storage(get_storage(args.directory))
+
+    archive_data_lake(args.books, args.day, args.directory)
+
+
+if __name__ == '__main__':
+    main()
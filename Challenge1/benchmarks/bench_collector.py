@@ -0,0 +1,236 @@
+""" Throughput of the collector against the local replay server: achieved
+ticks per second, tick-to-disk latency and missed ticks, from 1 to 200 books.
+
+The replay server runs in its own process, the collector saves the windows
+in a temporary Data Lake with the same callback as ``Challenge1.py``.
+
+Usage: python benchmarks/bench_collector.py [--books 1,10,50,100,200]
+           [--duration 10] [--depth 100] [--latency-ms 20] [--jitter-ms 10]
+           [--metrics]
+"""
+import argparse
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import Challenge1  # noqa: E402
+from collector import collect_order_books  # noqa: E402
+from fetcher import MAX_CONNECTIONS, OrderBookFetcher  # noqa: E402
+from metrics import collector_metrics  # noqa: E402
+from replay_server import (SyntheticOrderBooks, create_app,  # noqa: E402
+                           web)
+from rollups import RollupWriter  # noqa: E402
+from top_of_book import read_top_of_book  # noqa: E402
+from window_writer import WindowWriter  # noqa: E402
+
+BOOKS_NUMBERS = (1, 10, 50, 100, 200)
+DURATION = 10
+
+# Small windows, so several files per book are written during the run
+WINDOW_SIZE = 5
+
+
+def serve(port, depth, latency, jitter, error_rate):
+    """ Run the replay server with synthetic books (in a child process) """
+    app = create_app(
+        SyntheticOrderBooks(depth), latency, jitter, error_rate
+    )
+
+    web.run_app(app, host='127.0.0.1', port=port, print=None)
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        with contextlib.suppress(OSError):
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+
+        time.sleep(0.05)
+
+    raise TimeoutError(f'Replay server not listening on port {port}')
+
+
+def percentile(values, percent):
+    if not values:
+        return float('nan')
+
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+async def measure(base_url, books, duration, window_size, max_connections,
+                  interval=1.0):
+    """ Collect the books during ``duration`` seconds and time every tick
+
+    :param base_url: API root of the replay server.
+    :type base_url: str
+
+    :param books: names of the order books.
+    :type books: list
+
+    :param duration: seconds to collect.
+    :type duration: float
+
+    :param window_size: observations per file.
+    :type window_size: int
+
+    :param max_connections: connections shared by all the books.
+    :type max_connections: int
+
+    :param interval: seconds between two requests of the same book.
+    :type interval: float
+    """
+    tick_latencies = []
+    disk_latencies = []
+
+    async def on_order_book(book, data, tick_time):
+        window = Challenge1.spread_windows.windows.get(book)
+        writes_file = window is not None and len(window) == window_size - 1
+
+        await Challenge1.save_order_book_tick(book, data, tick_time)
+
+        # The gaps are missed ticks
+        if data is None:
+            return
+
+        # Delay from the moment the tick was due until it's handled
+        latency = time.time() - tick_time.timestamp()
+
+        tick_latencies.append(latency)
+
+        if writes_file:
+            disk_latencies.append(latency)
+
+    fetcher = OrderBookFetcher(
+        base_url, Challenge1.sign_request,
+        max_connections=max_connections, parse=read_top_of_book
+    )
+
+    with contextlib.suppress(asyncio.TimeoutError):
+        await asyncio.wait_for(
+            collect_order_books(books, fetcher, on_order_book, interval),
+            timeout=duration
+        )
+
+    expected = len(books) * int(duration / interval)
+    on_time = sum(latency <= interval for latency in tick_latencies)
+
+    return {
+        'books': len(books),
+        'ticks_per_second': len(tick_latencies) / duration,
+        'expected_per_second': len(books) / interval,
+        'missed': max(0, expected - on_time),
+        'expected': expected,
+        'tick_p50': percentile(tick_latencies, 50),
+        'tick_p99': percentile(tick_latencies, 99),
+        'disk_p50': percentile(disk_latencies, 50),
+        'disk_p99': percentile(disk_latencies, 99),
+        'files': len(disk_latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', default=','.join(map(str, BOOKS_NUMBERS)),
+                        help='comma separated numbers of books to try')
+    parser.add_argument('--duration', type=float, default=DURATION)
+    parser.add_argument('--depth', type=int, default=100)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--jitter-ms', type=float, default=10.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--window-size', type=int, default=WINDOW_SIZE)
+    parser.add_argument('--file-format', default='csv')
+    parser.add_argument('--max-connections', type=int,
+                        default=MAX_CONNECTIONS)
+    parser.add_argument('--no-journal', action='store_true',
+                        help="don't journal the windows in progress")
+    parser.add_argument('--metrics', action='store_true',
+                        help='time the stages and print the metrics')
+    args = parser.parse_args()
+
+    port = get_free_port()
+    server = multiprocessing.Process(
+        target=serve,
+        args=(port, args.depth, args.latency_ms / 1000,
+              args.jitter_ms / 1000, args.error_rate),
+        daemon=True
+    )
+    server.start()
+
+    results = []
+    working_directory = os.getcwd()
+
+    collector_metrics.enabled = args.metrics
+
+    try:
+        wait_for_port(port)
+
+        for books_number in map(int, args.books.split(',')):
+            books = [f'bench_{index:03d}' for index in range(books_number)]
+
+            Challenge1.spread_windows = WindowWriter(
+                size=args.window_size, file_format=args.file_format,
+                journal=None if args.no_journal else Challenge1.journal
+            )
+            Challenge1.rollup_writer = RollupWriter(Challenge1.ROLLUPS)
+
+            # Temporary Data Lake, and no log lines per file
+            with tempfile.TemporaryDirectory() as directory, \
+                    open(os.devnull, 'w') as devnull, \
+                    contextlib.redirect_stdout(devnull):
+                os.chdir(directory)
+
+                try:
+                    results.append(asyncio.run(measure(
+                        f'http://127.0.0.1:{port}/api/v3', books,
+                        args.duration, args.window_size,
+                        args.max_connections
+                    )))
+                finally:
+                    if Challenge1.journal is not None:
+                        Challenge1.journal.close()
+
+                    os.chdir(working_directory)
+    finally:
+        server.terminate()
+
+    print(f'depth {args.depth}, latency {args.latency_ms} ms '
+          f'(+{args.jitter_ms} ms jitter), {args.duration:g} s per run')
+    print(f'{"books":>6} {"ticks/s":>9} {"missed":>12} '
+          f'{"tick p50":>9} {"tick p99":>9} {"disk p50":>9} {"disk p99":>9} '
+          f'{"files":>6}')
+
+    for result in results:
+        print(
+            f'{result["books"]:>6} '
+            f'{result["ticks_per_second"]:>5.1f}/'
+            f'{result["expected_per_second"]:<3g} '
+            f'{result["missed"]:>5}/{result["expected"]:<6} '
+            f'{result["tick_p50"] * 1000:>6.1f} ms '
+            f'{result["tick_p99"] * 1000:>6.1f} ms '
+            f'{result["disk_p50"] * 1000:>6.1f} ms '
+            f'{result["disk_p99"] * 1000:>6.1f} ms '
+            f'{result["files"]:>6}'
+        )
+
+    if args.metrics:
+        print(collector_metrics.to_prometheus(), end='')
+
+
+if __name__ == '__main__':
+    main()
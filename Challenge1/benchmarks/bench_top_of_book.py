@@ -0,0 +1,138 @@
+""" Per-tick CPU and memory of the spread computation, before and after the
+top-of-book fast path, on a synthetic deep order book. The cost of the depth
+metrics (bounded to their first levels) is measured too.
+
+Usage: python benchmarks/bench_top_of_book.py [levels] [ticks]
+"""
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from depth import DepthEngine  # noqa: E402
+from top_of_book import read_top_of_book  # noqa: E402
+
+# Levels per side, btc_mxn usually has thousands
+LEVELS = 5000
+TICKS = 200
+
+
+def build_order_book(book='btc_mxn', levels=LEVELS):
+    """ Build a raw order book response like the API one, sorted by price
+
+    :param book: name of the order book.
+    :type book: str
+
+    :param levels: orders per side.
+    :type levels: int
+    """
+    bids = [
+        {'book': book, 'price': f'{457240.00 - level * 0.5:.2f}',
+         'amount': '0.01500000'}
+        for level in range(levels)
+    ]
+    asks = [
+        {'book': book, 'price': f'{457240.02 + level * 0.5:.2f}',
+         'amount': '0.01500000'}
+        for level in range(levels)
+    ]
+
+    return json.dumps({
+        'success': True,
+        'payload': {
+            'updated_at': '2023-10-02T00:10:24+00:00',
+            'bids': bids,
+            'asks': asks,
+            'sequence': '27214',
+        }
+    }).encode()
+
+
+def full_book_tick(content):
+    """ Spread as computed before: full parse, copies and a scan per side """
+    payload = json.loads(content)['payload']
+
+    bids = payload['bids'].copy()
+    asks = payload['asks'].copy()
+
+    best_bid = None
+    for order in bids:
+        price = float(order['price'])
+        if best_bid is None or price > best_bid:
+            best_bid = price
+
+    best_ask = None
+    for order in asks:
+        price = float(order['price'])
+        if best_ask is None or price < best_ask:
+            best_ask = price
+
+    return (best_ask - best_bid) * 100 / best_ask
+
+
+def top_of_book_tick(content):
+    """ Spread with the fast path: only the best levels are parsed """
+    top = read_top_of_book(content)
+
+    return (top.ask - top.bid) * 100 / top.ask
+
+
+depth_engine = DepthEngine()
+
+
+def depth_tick(content):
+    """ Spread and depth metrics of the first levels (depth.py) """
+    top = depth_engine.read(content)
+
+    return (top.ask - top.bid) * 100 / top.ask
+
+
+def measure(tick, content, ticks):
+    """ Get the CPU microseconds and the peak allocated KiB of a tick
+
+    :param tick: function that computes the spread of a raw response.
+    :type tick: callable
+
+    :param content: raw response.
+    :type content: bytes
+
+    :param ticks: repetitions for the CPU time.
+    :type ticks: int
+    """
+    start = time.process_time()
+
+    for _ in range(ticks):
+        tick(content)
+
+    cpu = (time.process_time() - start) * 1_000_000 / ticks
+
+    tracemalloc.start()
+    tick(content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return cpu, peak / 1024
+
+
+def main():
+    levels = int(sys.argv[1]) if len(sys.argv) > 1 else LEVELS
+    ticks = int(sys.argv[2]) if len(sys.argv) > 2 else TICKS
+
+    content = build_order_book(levels=levels)
+
+    assert full_book_tick(content) == top_of_book_tick(content)
+
+    print(f'{levels} levels per side, {len(content) / 1024:.0f} KiB response')
+    print(f'{"path":<14}{"CPU us/tick":>14}{"peak KiB/tick":>16}')
+
+    for name, tick in [('full book', full_book_tick),
+                       ('top of book', top_of_book_tick),
+                       ('depth metrics', depth_tick)]:
+        cpu, peak = measure(tick, content, ticks)
+        print(f'{name:<14}{cpu:>14.1f}{peak:>16.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import asyncio
+import time
+from datetime import datetime
+
+from metrics import collector_metrics
+from scheduler import TICK_INTERVAL, TickScheduler
+
+
+async def poll_order_book(fetcher, book, on_order_book, scheduler,
+                          first_tick, requests_number=None):
+    """ Poll an order book on every tick and hand each response over
+
+    A tick whose request fails, or that is skipped because the previous
+    one took too long, is handed over as a gap: ``data`` is None.
+
+    :param fetcher: open fetcher shared by all the order books.
+    :type fetcher: fetcher.OrderBookFetcher
+
+    :param book: name of the order book to poll.
+        Examples: ``usd_mxn`` or ``btc_mxn``.
+    :type book: str
+
+    :param on_order_book: coroutine function
+        ``on_order_book(book, data, tick_time)`` called on every tick.
+    :type on_order_book: callable
+
+    :param scheduler: ticks shared by all the order books.
+    :type scheduler: scheduler.TickScheduler
+
+    :param first_tick: number of the first tick to poll.
+    :type first_tick: int
+
+    :param requests_number: Maximum number of ticks. Poll forever if None.
+        Default: None
+    :type requests_number: int
+    """
+    tick = first_tick
+    last_tick = None
+
+    if requests_number is not None:
+        last_tick = first_tick + requests_number
+
+    while last_tick is None or tick < last_tick:
+        await scheduler.wait(tick)
+
+        started = time.monotonic()
+        data = None
+
+        try:
+            data = await fetcher.fetch(book)
+        except Exception as error:
+            collector_metrics.increment('ticks_missed_total')
+
+            # A failing book must not stop the rest of the books
+            print(
+                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                f'- Error polling {book}: {error}'
+            )
+        else:
+            collector_metrics.increment('ticks_total')
+
+        await on_order_book(book, data, scheduler.tick_time(tick))
+
+        finished = time.monotonic()
+        collector_metrics.observe('tick_seconds', finished - started)
+
+        # The tick ended after its interval
+        if finished > scheduler.due_time(tick + 1):
+            collector_metrics.increment('ticks_late_total')
+
+        tick, skipped_ticks = scheduler.next_tick(tick)
+
+        if last_tick is not None:
+            skipped_ticks = [
+                skipped for skipped in skipped_ticks if skipped < last_tick
+            ]
+
+        for skipped in skipped_ticks:
+            collector_metrics.increment('ticks_missed_total')
+
+            # Record the gap, the tick can't be observed anymore
+            await on_order_book(book, None, scheduler.tick_time(skipped))
+
+
+async def collect_order_books(books, fetcher, on_order_book,
+                              interval=TICK_INTERVAL, requests_number=None,
+                              alignment=None):
+    """ Poll all the order books concurrently from a single event loop
+
+    The ticks are on whole intervals of the wall clock, the same for all
+    the books.
+
+    :param books: names of the order books to poll.
+        Examples: ``['usd_mxn', 'btc_mxn', 'btc_usd', 'xrp_usd']``
+    :type books: list
+
+    :param fetcher: fetcher whose connection pool is shared by all the books.
+    :type fetcher: fetcher.OrderBookFetcher
+
+    :param on_order_book: coroutine function
+        ``on_order_book(book, data, tick_time)`` called on every tick, with
+        None as ``data`` for the gaps.
+    :type on_order_book: callable
+
+    :param interval: seconds between two requests of the same book.
+        Default: ``TICK_INTERVAL``
+    :type interval: float
+
+    :param requests_number: Maximum number of ticks per book.
+        Poll forever if None.
+        Default: None
+    :type requests_number: int
+
+    :param alignment: start on a multiple of these seconds of wall clock.
+        Example: 600 to start with a whole 10 minute window.
+        Default: start on the next tick
+    :type alignment: float
+    """
+    scheduler = TickScheduler(interval)
+    first_tick = scheduler.first_tick(alignment)
+
+    async with fetcher:
+        await asyncio.gather(*[
+            poll_order_book(
+                fetcher, book, on_order_book, scheduler, first_tick,
+                requests_number=requests_number
+            )
+            for book in books
+        ])
@@ -0,0 +1,341 @@
+""" Merge the small ``part-N`` files of the closed hours of the Data Lake
+
+Every hour of a book ends in a single file, sorted by tick time and without
+the copies of the same tick saved again, with its statistics (see
+``zone_maps.py``). The hours that the collector may still write are
+skipped.
+
+Usage: python compaction.py [--book btc_mxn] [--day 20231001]
+           [--file-format parquet]
+"""
+import argparse
+import math
+import os
+from datetime import datetime, timedelta, timezone
+
+from data_lake import generate_file_name, list_partition_files
+from file_formats import (FILE_FORMATS, FILE_FORMATS_BY_EXTENSION,
+                          SPREAD_COLUMNS, get_row_time)
+from storage import get_storage, remove_file, save_file, use_storage
+from window_writer import SpreadWindow
+from zone_maps import (read_statistics, remove_statistics, window_statistics,
+                       write_statistics)
+
+# An hour is compacted once this time has passed since its end. A window
+# is saved in the hour of its first observation, so the files of an hour
+# keep coming until its last window is full
+COMPACTION_DELAY = timedelta(hours=1)
+
+
+def list_book_hours(books=None, day=None, directory=None):
+    """ List the ``(book, hour, folder)`` of the Data Lake, oldest first
+
+    :param books: names of the order books. Default: all of them
+    :type books: list
+
+    :param day: only the hours of this day. Example: ``20231001``
+        Default: all the days
+    :type day: str
+
+    :param directory: folder that contains the ``data_lake``.
+        Default: the current working directory
+    :type directory: str
+    """
+    if directory is None:
+        directory = os.getcwd()
+
+    markets = os.path.join(directory, 'data_lake', 'markets')
+
+    if books is None:
+        books = sorted(os.listdir(markets)) if os.path.isdir(markets) else []
+
+    for book in books:
+        book_folder = os.path.join(markets, book, 'bid_ask_spread')
+
+        if not os.path.isdir(book_folder):
+            continue
+
+        days = [day] if day else sorted(os.listdir(book_folder))
+
+        for day_name in days:
+            day_folder = os.path.join(book_folder, day_name)
+
+            if not os.path.isdir(day_folder):
+                continue
+
+            for hour_name in sorted(os.listdir(day_folder)):
+                folder = os.path.join(day_folder, hour_name)
+
+                try:
+                    hour = datetime.strptime(
+                        f'{day_name}{hour_name}', '%Y%m%d%H'
+                    ).replace(tzinfo=timezone.utc)
+                except ValueError:
+                    continue
+
+                if os.path.isdir(folder):
+                    yield book, hour, folder
+
+
+def merge_rows(files, read_rows=()):
+    """ Read the files and get their rows sorted and without duplicates
+
+    A row is identified by its tick time: one observation per tick of a
+    book, so the rows of the same tick are copies saved again (a replay of
+    the journal over a saved window, or a crash before the merged files
+    were removed) and only the first one is kept. The consecutive ticks of
+    an unchanged book have identical values and are all kept, and so are
+    the rows saved without their tick time.
+
+    Files with different extra metrics are merged with the union of the
+    metrics, NaN where a file doesn't have one.
+
+    :param files: paths of the files.
+    :type files: list
+
+    :param read_rows: ``(metric_columns, rows)`` already read, merged with
+        the rows of the files.
+        Default: none
+    :type read_rows: list
+    """
+    files_rows = list(read_rows)
+
+    for path_to_file in files:
+        extension = os.path.splitext(path_to_file)[1]
+        read = FILE_FORMATS_BY_EXTENSION[extension].read_with_metrics
+
+        files_rows.append(read(path_to_file))
+
+    metric_columns = []
+
+    for columns, _ in files_rows:
+        for column in columns:
+            if column not in metric_columns:
+                metric_columns.append(column)
+
+    spread_columns = len(SPREAD_COLUMNS)
+    rows = []
+    tick_times = set()
+
+    for columns, file_rows in files_rows:
+        positions = [
+            columns.index(column) if column in columns else None
+            for column in metric_columns
+        ]
+
+        for row in file_rows:
+            tick_time = row[5]
+
+            if tick_time is not None:
+                if tick_time in tick_times:
+                    continue
+
+                tick_times.add(tick_time)
+
+            metrics = tuple(
+                math.nan if position is None
+                else row[spread_columns + position]
+                for position in positions
+            )
+
+            rows.append(row[:spread_columns] + metrics)
+
+    # Stable: the rows of the same time keep the collection order
+    rows.sort(key=get_row_time)
+
+    return metric_columns, rows
+
+
+def rows_to_window(book, metric_columns, rows, file_format):
+    """ Put merged rows in a window, to render and describe them
+
+    :param book: name of the order book.
+    :type book: str
+
+    :param metric_columns: names of the extra metrics.
+    :type metric_columns: list
+
+    :param rows: rows of all the columns, see ``merge_rows``.
+    :type rows: list
+
+    :param file_format: format of the file, a key of ``FILE_FORMATS``.
+    :type file_format: str
+    """
+    window = SpreadWindow(book, len(rows), file_format, metric_columns)
+
+    for row in rows:
+        window.append(
+            row[0], row[2], row[3], row[4], row[len(SPREAD_COLUMNS):],
+            row[5]
+        )
+
+    return window
+
+
+def get_file_format(path_to_file):
+    """ Get the name of the format of a file, a key of ``FILE_FORMATS``
+
+    :param path_to_file: path of the file.
+    :type path_to_file: str
+    """
+    extension = os.path.splitext(path_to_file)[1]
+
+    return next(
+        name for name, value in FILE_FORMATS.items()
+        if value.extension == extension
+    )
+
+
+def compact_hour(book, hour, folder, file_format=None):
+    """ Merge the files of an hour of a book in a single file
+
+    The merged file takes the lowest partition number, which the collector
+    never hands out again, and replaces it atomically. Then the merged
+    files are removed. Files saved while compacting are kept as they are.
+
+    Return ``(files_before, bytes_before, files_after, bytes_after)``, or
+    None if the hour has a single file. A single file without statistics
+    gets them.
+
+    :param book: name of the order book.
+    :type book: str
+
+    :param hour: hour of the files.
+    :type hour: datetime
+
+    :param folder: hour folder of the book.
+    :type folder: str
+
+    :param file_format: format of the merged file, a key of ``FILE_FORMATS``.
+        Default: the format of the last file
+    :type file_format: str
+    """
+    file_name = generate_file_name(hour, f'bid_ask_spread-{book}-')
+
+    partitions = list_partition_files(folder, file_name)
+    files = [path_to_file for _, path_to_file in partitions]
+
+    if len(files) == 1 and read_statistics(files[0]) is None:
+        metric_columns, rows = merge_rows(files)
+        window = rows_to_window(
+            book, metric_columns, rows, get_file_format(files[0])
+        )
+
+        write_statistics(files[0], window_statistics(window))
+
+    if len(files) < 2:
+        return None
+
+    bytes_before = sum(os.path.getsize(path) for path in files)
+
+    metric_columns, rows = merge_rows(files)
+
+    window = rows_to_window(
+        book, metric_columns, rows, file_format or get_file_format(files[-1])
+    )
+
+    path_to_file = os.path.join(
+        folder,
+        file_name + str(partitions[0][0]) + window.file_format.extension
+    )
+
+    # The statistics go first: until the file is replaced, they cover more
+    # rows than the old file has, which only makes readers open it
+    write_statistics(path_to_file, window_statistics(window))
+
+    save_file(
+        path_to_file,
+        window.file_format.render(window),
+        window.file_format.mode
+    )
+
+    for merged_file in files:
+        if merged_file != path_to_file:
+            remove_file(merged_file)
+            remove_statistics(merged_file)
+
+    return len(files), bytes_before, 1, os.path.getsize(path_to_file)
+
+
+def compact_data_lake(books=None, day=None, directory=None, file_format=None,
+                      delay=COMPACTION_DELAY):
+    """ Compact the closed hours of the Data Lake and report the savings
+
+    Return ``(files_before, bytes_before, files_after, bytes_after)`` of the
+    compacted hours.
+
+    :param books: names of the order books. Default: all of them
+    :type books: list
+
+    :param day: only the hours of this day. Example: ``20231001``
+        Default: all the days
+    :type day: str
+
+    :param directory: folder that contains the ``data_lake``.
+        Default: the current working directory
+    :type directory: str
+
+    :param file_format: format of the merged files, a key of
+        ``FILE_FORMATS``. Default: the format of the last file of each hour
+    :type file_format: str
+
+    :param delay: time after the end of an hour before compacting it.
+        Default: ``COMPACTION_DELAY``
+    :type delay: timedelta
+    """
+    closed_before = datetime.now(timezone.utc) - delay
+    totals = [0, 0, 0, 0]
+
+    for book, hour, folder in list_book_hours(books, day, directory):
+        # The collector may still save files of this hour
+        if hour + timedelta(hours=1) > closed_before:
+            continue
+
+        result = compact_hour(book, hour, folder, file_format)
+
+        if result is None:
+            continue
+
+        files_before, bytes_before, files_after, bytes_after = result
+
+        print(
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            f'- Compacted {book} {hour.strftime("%Y%m%d-%H")}:',
+            f'{files_before} files ({bytes_before} bytes) ->',
+            f'{files_after} file ({bytes_after} bytes)'
+        )
+
+        totals = [total + value for total, value in zip(totals, result)]
+
+    print(
+        datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        f'- Compaction done: {totals[0]} files ({totals[1]} bytes) ->',
+        f'{totals[2]} files ({totals[3]} bytes)'
+    )
+
+    return tuple(totals)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--book', action='append', dest='books',
+                        help='order book to compact, can be repeated. '
+                             'Default: all of them')
+    parser.add_argument('--day', help='only this day, as YYYYMMDD')
+    parser.add_argument('--file-format', choices=sorted(FILE_FORMATS),
+                        help='format of the merged files. '
+                             'Default: the format of the last file')
+    parser.add_argument('--directory',
+                        help='folder that contains the data_lake. '
+                             'Default: the current working directory')
+    args = parser.parse_args()
+
+    # With s3, the merged files and the removals are spooled for the
+    # collector to upload
+    use_storage(get_storage(args.directory))
+
+    compact_data_lake(args.books, args.day, args.directory, args.file_format)
+
+
+if __name__ == '__main__':
+    main()
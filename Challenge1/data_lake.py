@@ -0,0 +1,174 @@
+import os
+
+# Extensions of the data files, one per file format
+FILE_EXTENSIONS = ('.csv', '.parquet', '.arrow')
+
+
+def generate_path_to_folder(book, timestamp, directory=None):
+    """Generate the path where the files will be saved
+
+    :param book: name of the order book to save.
+    :type book: str
+
+    :param timestamp: value for create the folder structure.
+    :type timestamp: datetime
+
+    :param directory: folder that contains the ``data_lake``.
+        Default: the current working directory
+    :type directory: str
+    """
+
+    # to get the current working directory
+    if directory is None:
+        directory = os.getcwd()
+
+    # Get the current date and time for the folder structure
+    year_month_day = timestamp.strftime('%Y%m%d')
+    hour = timestamp.strftime('%H')
+    minute = timestamp.strftime('%M')
+
+    # Join values and build de path
+    full_path = os.path.join(
+        directory,
+        'data_lake',
+        'markets',
+        book,
+        'bid_ask_spread',
+        f'{year_month_day}',
+        f'{hour}'
+    )
+
+    # full_path = os.path.join(
+    #     'data_lake',
+    #     'markets',
+    #     book,
+    #     'bid_ask_spread',
+    #     f'date_{year_month_day}',
+    #     f'hour_{hour}',
+    #     f"minute_{minute}"
+    # )
+
+    return full_path
+
+
+def generate_file_name(timestamp, prefix='spread-'):
+    """Generate the filename to be saved
+
+    :param timestamp: value for file name.
+    :type timestamp: datetime
+
+    :param prefix: file name prefix
+    :type prefix: str
+    """
+    _timestamp = timestamp.strftime('%Y%m%d-%H')
+    # time = timestamp.strftime('%H_%M')
+
+    file_name = f'{prefix}{_timestamp}-part-'
+
+    return file_name
+
+
+def get_last_file_partition(folder, file_name):
+    """ Get the last partition file number
+
+    :param folder: URL resource part.
+    :type folder: str
+
+    :param file_name: URL resource part.
+    :type file_name: str
+    """
+    last_partition = None
+
+    files = os.listdir(folder)
+
+    files = list(
+        filter(lambda f:
+               f.startswith(file_name) and
+               os.path.splitext(f)[1] in FILE_EXTENSIONS, files
+               )
+    )
+
+    files = list(
+        map(lambda f:
+            int(os.path.splitext(f)[0].split('part-').pop()), files
+            )
+    )
+
+    if files is not None and len(files) > 0:
+        files = sorted(files)
+        last_partition = files.pop()
+
+    return last_partition
+
+
+def list_partition_files(folder, file_name):
+    """ List the ``(partition, path)`` of the data files of an hour, in order
+
+    :param folder: hour folder of an order book.
+    :type folder: str
+
+    :param file_name: file name prefix, see ``generate_file_name``.
+    :type file_name: str
+    """
+    files = []
+
+    for entry in os.scandir(folder):
+        name, extension = os.path.splitext(entry.name)
+
+        if entry.name.startswith(file_name) and extension in FILE_EXTENSIONS:
+            files.append((int(name.split('part-').pop()), entry.path))
+
+    return sorted(files)
+
+
+def fsync_folder(folder):
+    """ Make the new and removed files of a folder durable
+
+    :param folder: path of the folder.
+    :type folder: str
+    """
+    fd = os.open(folder, os.O_RDONLY)
+
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_file_atomically(path_to_file, content, mode='w', durable=False):
+    """ Write a whole file at once, readers never see it half written
+
+    The content goes to a temporary file in the same folder, which is
+    renamed over ``path_to_file`` when it's complete.
+
+    :param path_to_file: final path of the file.
+    :type path_to_file: str
+
+    :param content: full content of the file.
+    :type content: str or bytes
+
+    :param mode: ``w`` for text content or ``wb`` for bytes.
+        Default: ``w``
+    :type mode: str
+
+    :param durable: fsync the file and its folder, so it survives a crash
+        of the machine.
+        Default: False
+    :type durable: bool
+    """
+    folder, file_name = os.path.split(path_to_file)
+
+    # Hidden and without the final extension, so it's never listed as a part
+    path_to_temp = os.path.join(folder, f'.{file_name}.tmp')
+
+    with open(path_to_temp, mode) as file:
+        file.write(content)
+
+        if durable:
+            file.flush()
+            os.fsync(file.fileno())
+
+    os.replace(path_to_temp, path_to_file)
+
+    if durable:
+        fsync_folder(folder or '.')
@@ -0,0 +1,225 @@
+import re
+
+import numpy as np
+
+from top_of_book import TopOfBook, locate_bids_and_asks, read_top_of_book
+
+# Levels where the spread and the volume imbalance are measured
+DEPTH_LEVELS = (5, 10)
+
+# Notional (quote currency) to fill when measuring the effective spread
+DEPTH_NOTIONALS = (10_000.0, 100_000.0)
+
+# Orders parsed per side. Deeper levels are never read, so the cost of a
+# tick is bounded no matter how deep the book is
+DEPTH_MAX_LEVELS = 100
+
+PRICE_PATTERN = re.compile(rb'"price"\s*:\s*"?([^",}]+)')
+AMOUNT_PATTERN = re.compile(rb'"amount"\s*:\s*"?([^",}]+)')
+
+
+def read_side(content, side, max_levels):
+    """ Convert the first orders of a side to price and amount arrays
+
+    :param content: raw response body.
+    :type content: bytes
+
+    :param side: ``(start, end)`` position of the side, see
+        ``locate_bids_and_asks``.
+    :type side: tuple
+
+    :param max_levels: orders to read.
+    :type max_levels: int
+    """
+    # Jump to the end of the last order to read, the rest is never scanned
+    end = side[0]
+
+    for _ in range(max_levels):
+        order_end = content.find(b'}', end + 1, side[1])
+
+        if order_end < 0:
+            break
+
+        end = order_end
+
+    prices = PRICE_PATTERN.findall(content, side[0], end)
+    amounts = AMOUNT_PATTERN.findall(content, side[0], end)
+
+    if len(prices) != len(amounts):
+        raise ValueError('Order book orders without price or amount')
+
+    # A single conversion of all the levels, from bytes to doubles
+    return (
+        np.array(prices).astype(np.float64),
+        np.array(amounts).astype(np.float64)
+    )
+
+
+def levels_spread(bid_prices, ask_prices, indexes):
+    """ Spread between the bid and the ask of every level
+
+    :param bid_prices: bid prices, from the best one.
+    :type bid_prices: numpy.ndarray
+
+    :param ask_prices: ask prices, from the best one.
+    :type ask_prices: numpy.ndarray
+
+    :param indexes: levels (0 is the best) to measure.
+    :type indexes: numpy.ndarray
+    """
+    result = np.full(len(indexes), np.nan)
+    valid = indexes < min(len(bid_prices), len(ask_prices))
+
+    bids = bid_prices[indexes[valid]]
+    asks = ask_prices[indexes[valid]]
+
+    result[valid] = (asks - bids) * 100 / asks
+
+    return result
+
+
+def levels_imbalance(bid_amounts, ask_amounts, indexes):
+    """ Volume imbalance of the first levels, from -1 (asks) to 1 (bids)
+
+    :param bid_amounts: bid amounts, from the best level.
+    :type bid_amounts: numpy.ndarray
+
+    :param ask_amounts: ask amounts, from the best level.
+    :type ask_amounts: numpy.ndarray
+
+    :param indexes: last level (0 is the best) of each measure.
+    :type indexes: numpy.ndarray
+    """
+    result = np.full(len(indexes), np.nan)
+    valid = indexes < min(len(bid_amounts), len(ask_amounts))
+
+    bids = np.cumsum(bid_amounts)[indexes[valid]]
+    asks = np.cumsum(ask_amounts)[indexes[valid]]
+
+    result[valid] = (bids - asks) / (bids + asks)
+
+    return result
+
+
+def fill_price(prices, amounts, notionals):
+    """ Average price (VWAP) to fill every notional walking a side
+
+    :param prices: prices of the side, from the best one.
+    :type prices: numpy.ndarray
+
+    :param amounts: amounts of the side.
+    :type amounts: numpy.ndarray
+
+    :param notionals: notionals to fill, in quote currency.
+    :type notionals: numpy.ndarray
+    """
+    result = np.full(len(notionals), np.nan)
+
+    notional_sum = np.cumsum(prices * amounts)
+    amount_sum = np.cumsum(amounts)
+
+    # Level where each notional gets filled. Not enough depth: NaN
+    levels = np.searchsorted(notional_sum, notionals)
+    valid = levels < len(prices)
+    levels = levels[valid]
+
+    previous = levels - 1
+    filled_notional = np.where(levels > 0, notional_sum[previous], 0.0)
+    filled_amount = np.where(levels > 0, amount_sum[previous], 0.0)
+
+    amount = (
+        filled_amount +
+        (notionals[valid] - filled_notional) / prices[levels]
+    )
+
+    result[valid] = notionals[valid] / amount
+
+    return result
+
+
+class DepthEngine:
+    """ Compute depth metrics of the order books with vectorized passes
+
+    The metrics, in the order of ``columns``, are:
+
+    - ``spread_l<N>``: spread between the bid and the ask of level N.
+    - ``imbalance_l<N>``: ``(bids - asks) / (bids + asks)`` volume of the
+      first N levels.
+    - ``effective_spread_<notional>``: spread between the average prices to
+      sell and to buy ``notional`` (quote currency).
+
+    A metric without enough depth is NaN.
+
+    :param levels: levels for the spread and the imbalance.
+        Default: ``DEPTH_LEVELS``
+    :type levels: tuple
+
+    :param notionals: notionals for the effective spread.
+        Default: ``DEPTH_NOTIONALS``
+    :type notionals: tuple
+
+    :param max_levels: orders parsed per side.
+        Default: ``DEPTH_MAX_LEVELS``
+    :type max_levels: int
+    """
+
+    def __init__(self, levels=DEPTH_LEVELS, notionals=DEPTH_NOTIONALS,
+                 max_levels=DEPTH_MAX_LEVELS):
+        self.levels = np.array(levels, dtype=np.int64)
+        self.notionals = np.array(notionals, dtype=np.float64)
+        self.max_levels = max_levels
+
+        self.columns = (
+            [f'spread_l{level}' for level in levels] +
+            [f'imbalance_l{level}' for level in levels] +
+            [f'effective_spread_{notional:g}' for notional in notionals]
+        )
+
+    def compute(self, bid_prices, bid_amounts, ask_prices, ask_amounts):
+        """ Compute the metrics of a snapshot, in the order of ``columns``
+
+        :param bid_prices: bid prices, from the best one.
+        :type bid_prices: numpy.ndarray
+
+        :param bid_amounts: bid amounts.
+        :type bid_amounts: numpy.ndarray
+
+        :param ask_prices: ask prices, from the best one.
+        :type ask_prices: numpy.ndarray
+
+        :param ask_amounts: ask amounts.
+        :type ask_amounts: numpy.ndarray
+        """
+        indexes = self.levels - 1
+
+        sell_price = fill_price(bid_prices, bid_amounts, self.notionals)
+        buy_price = fill_price(ask_prices, ask_amounts, self.notionals)
+
+        return np.concatenate([
+            levels_spread(bid_prices, ask_prices, indexes),
+            levels_imbalance(bid_amounts, ask_amounts, indexes),
+            (buy_price - sell_price) * 100 / buy_price,
+        ])
+
+    def read(self, content):
+        """ Get the best bid and ask, and the depth metrics, of a response
+
+        Use it as the ``parse`` function of the fetcher.
+
+        :param content: raw response body.
+        :type content: bytes
+        """
+        top = read_top_of_book(content)
+
+        bids, asks = locate_bids_and_asks(content)
+
+        bid_prices, bid_amounts = read_side(content, bids, self.max_levels)
+        ask_prices, ask_amounts = read_side(content, asks, self.max_levels)
+
+        metrics = self.compute(
+            bid_prices, bid_amounts, ask_prices, ask_amounts
+        )
+
+        return TopOfBook(
+            top.updated_at, top.sequence, top.bid, top.ask, metrics
+        )
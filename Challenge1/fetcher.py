@@ -0,0 +1,261 @@
+import asyncio
+import json
+import random
+import re
+import time
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import collector_metrics
+
+# Maximum number of open connections shared by all the order books
+MAX_CONNECTIONS = 100
+
+# Seconds to wait for a whole request (connect + response)
+REQUEST_TIMEOUT = 0.8
+
+# Retries after the first attempt. Keep it low: a tick lasts one second
+MAX_RETRIES = 2
+
+# Exponential backoff (seconds) with full jitter between retries
+BACKOFF_BASE = 0.05
+BACKOFF_CAP = 0.25
+
+# Responses worth to retry. Any other error status fails immediately
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# The sequence is read from the raw response, without parsing the book
+SEQUENCE_PATTERN = re.compile(rb'"sequence"\s*:\s*"?(\d+)')
+
+
+def backoff_delay(attempt):
+    """ Get the seconds to wait before a retry, using full jitter
+
+    :param attempt: number of the failed attempt, starting in 0.
+    :type attempt: int
+    """
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def read_sequence(content):
+    """ Get the order book sequence from the raw response
+
+    :param content: raw response body.
+    :type content: bytes
+    """
+    # The sequence is at the end of the payload, after the orders
+    index = content.rfind(b'"sequence"')
+
+    match = SEQUENCE_PATTERN.match(content, index) if index >= 0 else None
+
+    return match.group(1).decode() if match else None
+
+
+class OrderBookCache:
+    """ Keep the last parsed response of every order book
+
+    A response with the same ``payload.sequence`` as the previous one is
+    not parsed again, the previous data is returned instead.
+
+    :param parse: function that converts the raw response to data.
+        Example: ``top_of_book.read_top_of_book``
+        Default: ``json.loads``
+    :type parse: callable
+    """
+
+    def __init__(self, parse=json.loads):
+        self.parse = parse
+        self.sequences = {}
+        self.data = {}
+
+    def load(self, book, content):
+        """ Parse the response, unless the order book has not changed
+
+        :param book: name of the order book.
+        :type book: str
+
+        :param content: raw response body.
+        :type content: bytes
+        """
+        sequence = read_sequence(content)
+
+        if sequence is not None and self.sequences.get(book) == sequence:
+            return self.data[book]
+
+        data = self.parse(content)
+
+        self.sequences[book] = sequence
+        self.data[book] = data
+
+        return data
+
+
+def create_session(max_connections=MAX_CONNECTIONS):
+    """ Create a keep-alive HTTP session with a connection pool
+
+    :param max_connections: connections kept open per host.
+        Default: ``MAX_CONNECTIONS``
+    :type max_connections: int
+    """
+    adapter = HTTPAdapter(
+        pool_connections=max_connections,
+        pool_maxsize=max_connections
+    )
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+
+def fetch_with_retries(session, url, sign, url_endpoint,
+                       timeout=REQUEST_TIMEOUT, retries=MAX_RETRIES):
+    """ GET a resource retrying connection errors and transient statuses
+
+    :param session: keep-alive session from ``create_session``.
+    :type session: requests.Session
+
+    :param url: full URL of the resource.
+    :type url: str
+
+    :param sign: function that returns the headers for ``url_endpoint``.
+    :type sign: callable
+
+    :param url_endpoint: URL resource part, used for the signature.
+    :type url_endpoint: str
+
+    :param timeout: seconds to wait for each attempt.
+    :type timeout: float
+
+    :param retries: retries after the first attempt.
+    :type retries: int
+    """
+    for attempt in range(retries + 1):
+        last_attempt = attempt == retries
+
+        try:
+            # Sign every attempt, the nonce must be new
+            response = session.get(
+                url, headers=sign(url_endpoint), timeout=timeout
+            )
+        except requests.RequestException:
+            if last_attempt:
+                raise
+        else:
+            if response.status_code == 200:
+                return response.content
+
+            if last_attempt or response.status_code not in RETRY_STATUSES:
+                raise Exception(
+                    f'Error getting order books: {response.status_code}'
+                )
+
+        time.sleep(backoff_delay(attempt))
+
+
+class OrderBookFetcher:
+    """ Fetch order books from the API over a pooled keep-alive client
+
+    Use it as an async context manager: the connection pool is opened on
+    enter and closed on exit.
+
+    :param base_url: API root. Example: ``https://sandbox.bitso.com/api/v3``
+    :type base_url: str
+
+    :param sign: function that returns the request headers for an endpoint.
+        Example: ``sign_request``
+    :type sign: callable
+
+    :param timeout: seconds to wait for each attempt.
+        Default: ``REQUEST_TIMEOUT``
+    :type timeout: float
+
+    :param retries: retries after the first attempt.
+        Default: ``MAX_RETRIES``
+    :type retries: int
+
+    :param max_connections: connections shared by all the order books.
+        Default: ``MAX_CONNECTIONS``
+    :type max_connections: int
+
+    :param parse: function that converts the raw response to data.
+        Example: ``top_of_book.read_top_of_book``
+        Default: ``json.loads``
+    :type parse: callable
+    """
+
+    def __init__(self, base_url, sign, timeout=REQUEST_TIMEOUT,
+                 retries=MAX_RETRIES, max_connections=MAX_CONNECTIONS,
+                 parse=json.loads):
+        self.base_url = base_url
+        self.sign = sign
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.max_connections = max_connections
+        self.cache = OrderBookCache(parse)
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_connections)
+
+        self.session = aiohttp.ClientSession(
+            connector=connector, timeout=self.timeout
+        )
+
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        self.session = None
+
+    async def fetch_raw(self, url_endpoint):
+        """ GET an endpoint retrying connection errors and transient statuses
+
+        :param url_endpoint: URL resource part.
+            Example: ``order_book/?book=btc_mxn``
+        :type url_endpoint: str
+        """
+        url = f'{self.base_url}/{url_endpoint}'
+
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+
+            # Sign every attempt, the nonce must be new
+            with collector_metrics.timer('sign_seconds'):
+                headers = self.sign(url_endpoint)
+
+            try:
+                with collector_metrics.timer('fetch_seconds'):
+                    async with self.session.get(
+                        url, headers=headers
+                    ) as response:
+                        if response.status == 200:
+                            return await response.read()
+
+                        status = response.status
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if last_attempt:
+                    raise
+            else:
+                if last_attempt or status not in RETRY_STATUSES:
+                    raise Exception(f'Error getting order books: {status}')
+
+            collector_metrics.increment('retries_total')
+
+            await asyncio.sleep(backoff_delay(attempt))
+
+    async def fetch(self, book='usd_mxn'):
+        """ Fetch the parsed order book. Unchanged books are not parsed again
+
+        :param book: name of the order book to search.
+            Examples: ``usd_mxn`` or ``btc_mxn``.
+            Default: ``usd_mxn``
+        :type book: str
+        """
+        content = await self.fetch_raw(f'order_book/?book={book}')
+
+        with collector_metrics.timer('decode_seconds'):
+            return self.cache.load(book, content)
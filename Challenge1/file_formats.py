@@ -0,0 +1,323 @@
+import csv
+import itertools
+from collections import namedtuple
+from datetime import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # Only needed by the columnar formats
+    pa = None
+
+# Codec of the columnar formats
+COMPRESSION = 'zstd'
+
+# Columns of the files, in order. The tick time is None in the rows saved
+# before it was kept
+SPREAD_COLUMNS = [
+    'orderbook_timestamp', 'book', 'bid', 'ask', 'spread', 'tick_time'
+]
+
+# read: rows of the spread columns. read_with_metrics: names of the extra
+# metrics, and rows of all the columns
+FileFormat = namedtuple(
+    'FileFormat', ['extension', 'mode', 'render', 'read', 'read_with_metrics']
+)
+
+
+def get_spread_schema(metric_columns=()):
+    """ Get the typed schema embedded in the columnar files
+
+    :param metric_columns: names of the extra metrics after the spread.
+        Default: no extra metrics
+    :type metric_columns: list
+    """
+    return pa.schema([
+        ('orderbook_timestamp', pa.timestamp('us', tz='UTC')),
+        ('book', pa.string()),
+        ('bid', pa.float64()),
+        ('ask', pa.float64()),
+        ('spread', pa.float64()),
+        ('tick_time', pa.timestamp('us', tz='UTC')),
+    ] + [(column, pa.float64()) for column in metric_columns])
+
+
+def get_row_time(row):
+    """ Get the time of a row: its tick time, or its order book timestamp
+    if the tick is unknown
+
+    :param row: row of the spread columns.
+    :type row: tuple
+    """
+    return row[5] or row[0]
+
+
+def timestamp_column(values):
+    """ Convert seconds since the epoch to an Arrow column of timestamps,
+    null where NaN
+
+    :param values: typed array of doubles.
+    :type values: array.array
+    """
+    return pa.array(
+        [None if value != value else round(value * 1_000_000)
+         for value in values],
+        pa.int64()
+    ).cast(pa.timestamp('us', tz='UTC'))
+
+
+def float_column(values):
+    """ Wrap a typed array of doubles as an Arrow column, without copying
+
+    :param values: typed array of doubles.
+    :type values: array.array
+    """
+    return pa.Array.from_buffers(
+        pa.float64(), len(values), [None, pa.py_buffer(values)]
+    )
+
+
+def window_to_table(window):
+    """ Convert a window of observations to an Arrow table
+
+    :param window: observations of one order book.
+    :type window: window_writer.SpreadWindow
+    """
+    if pa is None:
+        raise ImportError('pyarrow is required for the columnar file formats')
+
+    return pa.Table.from_arrays(
+        [
+            timestamp_column(window.timestamps),
+            pa.array([window.book] * len(window), pa.string()),
+            float_column(window.bids),
+            float_column(window.asks),
+            float_column(window.spreads),
+            timestamp_column(window.tick_times),
+        ] + [
+            float_column(window.get_metric(column))
+            for column in range(len(window.metric_columns))
+        ],
+        schema=get_spread_schema(window.metric_columns)
+    )
+
+
+def window_to_csv(window):
+    """ Render a window as CSV, the original format of the Data Lake
+
+    :param window: observations of one order book.
+    :type window: window_writer.SpreadWindow
+    """
+    return window.to_csv()
+
+
+def window_to_parquet(window):
+    """ Render a window as a compressed Parquet file
+
+    :param window: observations of one order book.
+    :type window: window_writer.SpreadWindow
+    """
+    sink = pa.BufferOutputStream()
+
+    pq.write_table(window_to_table(window), sink, compression=COMPRESSION)
+
+    return sink.getvalue().to_pybytes()
+
+
+def window_to_arrow(window):
+    """ Render a window as a compressed Arrow IPC file
+
+    :param window: observations of one order book.
+    :type window: window_writer.SpreadWindow
+    """
+    table = window_to_table(window)
+    sink = pa.BufferOutputStream()
+    options = pa.ipc.IpcWriteOptions(compression=COMPRESSION)
+
+    with pa.ipc.new_file(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+
+    return sink.getvalue().to_pybytes()
+
+
+def split_csv_headers(reader):
+    """ Get the headers of a CSV file and an iterator of its rows
+
+    Some first partitions were saved without headers, their first row is
+    already an observation.
+
+    :param reader: reader of the file.
+    :type reader: csv.reader
+    """
+    first_row = next(reader, None)
+
+    if first_row is None:
+        return [], reader
+
+    if first_row[0] == 'timestamp':
+        return first_row, reader
+
+    return [], itertools.chain([first_row], reader)
+
+
+def parse_csv_row(row, tick_times):
+    """ Parse the spread columns of a CSV row
+
+    :param row: values of the row.
+    :type row: list
+
+    :param tick_times: the file has the tick time after the spread.
+    :type tick_times: bool
+    """
+    tick_time = None
+
+    if tick_times and row[5]:
+        tick_time = datetime.fromisoformat(row[5])
+
+    return (
+        datetime.fromisoformat(row[0]), row[1],
+        float(row[2]), float(row[3]), float(row[4]), tick_time
+    )
+
+
+def parse_csv_with_metrics(lines):
+    """ Parse the metric names and the rows of CSV content, all the columns
+
+    :param lines: lines of the content, a file or a list.
+    :type lines: iterable
+    """
+    headers, rows = split_csv_headers(csv.reader(lines))
+
+    # The files saved before the tick times have the metrics after the
+    # spread
+    tick_times = headers[5:6] == ['tick_time']
+    metrics_start = 6 if tick_times else 5
+
+    rows = [
+        parse_csv_row(row, tick_times) +
+        tuple(float(value) for value in row[metrics_start:])
+        for row in rows
+    ]
+
+    return headers[metrics_start:], rows
+
+
+def read_csv(path_to_file):
+    """ Read the rows of a CSV file as
+    ``(orderbook_timestamp, book, bid, ask, spread, tick_time)`` tuples
+
+    :param path_to_file: path of the file.
+    :type path_to_file: str
+    """
+    _, rows = read_csv_with_metrics(path_to_file)
+
+    return [row[:len(SPREAD_COLUMNS)] for row in rows]
+
+
+def read_csv_with_metrics(path_to_file):
+    """ Read the metric names and the rows of a CSV file, all the columns
+
+    :param path_to_file: path of the file.
+    :type path_to_file: str
+    """
+    with open(path_to_file, newline='') as file:
+        return parse_csv_with_metrics(file)
+
+
+def table_to_rows(table, columns=SPREAD_COLUMNS):
+    """ Convert an Arrow table to ``(orderbook_timestamp, ...)`` tuples
+
+    :param table: table with the columns of ``get_spread_schema``.
+    :type table: pyarrow.Table
+
+    :param columns: columns of the tuples, in order.
+        Default: ``SPREAD_COLUMNS``
+    :type columns: list
+    """
+    # The files saved before the tick times don't have them
+    columns = [
+        table.column(name).to_pylist() if name in table.column_names
+        else [None] * table.num_rows
+        for name in columns
+    ]
+
+    return list(zip(*columns))
+
+
+def table_to_rows_with_metrics(table):
+    """ Get the metric names and the rows of an Arrow table, all the columns
+
+    :param table: table with the columns of ``get_spread_schema``.
+    :type table: pyarrow.Table
+    """
+    metric_columns = [
+        name for name in table.column_names if name not in SPREAD_COLUMNS
+    ]
+
+    return (
+        metric_columns,
+        table_to_rows(table, SPREAD_COLUMNS + metric_columns)
+    )
+
+
+def read_parquet(path_to_file):
+    """ Read the rows of a Parquet file
+
+    :param path_to_file: path of the file.
+    :type path_to_file: str
+    """
+    return table_to_rows(pq.read_table(path_to_file))
+
+
+def read_arrow(path_to_file):
+    """ Read the rows of an Arrow IPC file
+
+    :param path_to_file: path of the file.
+    :type path_to_file: str
+    """
+    with pa.memory_map(path_to_file) as source:
+        table = pa.ipc.open_file(source).read_all()
+
+        return table_to_rows(table)
+
+
+def read_parquet_with_metrics(path_to_file):
+    """ Read the metric names and the rows of a Parquet file
+
+    :param path_to_file: path of the file.
+    :type path_to_file: str
+    """
+    return table_to_rows_with_metrics(pq.read_table(path_to_file))
+
+
+def read_arrow_with_metrics(path_to_file):
+    """ Read the metric names and the rows of an Arrow IPC file
+
+    :param path_to_file: path of the file.
+    :type path_to_file: str
+    """
+    with pa.memory_map(path_to_file) as source:
+        table = pa.ipc.open_file(source).read_all()
+
+        return table_to_rows_with_metrics(table)
+
+
+FILE_FORMATS = {
+    'csv': FileFormat(
+        '.csv', 'w', window_to_csv, read_csv, read_csv_with_metrics
+    ),
+    'parquet': FileFormat(
+        '.parquet', 'wb', window_to_parquet, read_parquet,
+        read_parquet_with_metrics
+    ),
+    'arrow': FileFormat(
+        '.arrow', 'wb', window_to_arrow, read_arrow, read_arrow_with_metrics
+    ),
+}
+
+# File format of every extension
+FILE_FORMATS_BY_EXTENSION = {
+    file_format.extension: file_format
+    for file_format in FILE_FORMATS.values()
+}
@@ -0,0 +1,329 @@
+import itertools
+import json
+import os
+import threading
+import zlib
+from datetime import datetime
+
+from data_lake import fsync_folder
+from metrics import collector_metrics
+
+# Seconds between two group commits: the rows of all the books written
+# meanwhile are made durable by one fsync per file
+COMMIT_INTERVAL = 0.05
+
+SEGMENT_EXTENSION = '.journal'
+
+
+def get_journal_folder(directory=None):
+    """ Get the folder of the journal, inside the Data Lake
+
+    :param directory: folder that contains the ``data_lake``.
+        Default: the current working directory
+    :type directory: str
+    """
+    if directory is None:
+        directory = os.getcwd()
+
+    return os.path.join(directory, 'data_lake', 'journal')
+
+
+def encode_record(payload):
+    """ Encode a record as a line with the CRC32 of its payload
+
+    :param payload: content of the record, without new lines.
+    :type payload: str
+    """
+    payload = payload.encode()
+
+    return b'%08x %s\n' % (zlib.crc32(payload), payload)
+
+
+def decode_records(content):
+    """ Get the payloads of the records, up to the first torn or corrupt one
+
+    A crash in the middle of a write leaves a last line without its new
+    line or with a wrong CRC: it and anything after it is ignored.
+
+    :param content: content of a segment.
+    :type content: bytes
+    """
+    payloads = []
+
+    for line in content.split(b'\n')[:-1]:
+        crc, _, payload = line.partition(b' ')
+
+        try:
+            if int(crc, 16) != zlib.crc32(payload):
+                break
+        except ValueError:
+            break
+
+        payloads.append(payload.decode())
+
+    return payloads
+
+
+class JournalSegment:
+    """ Journal of the rows of one window, appended as they arrive
+
+    :param journal: journal that commits the segment.
+    :type journal: Journal
+
+    :param path: path of the segment file.
+    :type path: str
+
+    :param new: create the file, which must not exist: a segment is never
+        shared by two windows. False to reopen a segment left by a crash.
+        Default: True
+    :type new: bool
+    """
+
+    def __init__(self, journal, path, new=True):
+        flags = os.O_WRONLY | os.O_APPEND
+
+        if new:
+            flags |= os.O_CREAT | os.O_EXCL
+
+        self.journal = journal
+        self.path = path
+        self.fd = os.open(path, flags, 0o644)
+        self.lock = threading.Lock()
+
+    def write(self, payload):
+        # Straight to the OS: a crash of the process loses nothing
+        with self.lock:
+            if self.fd is not None:
+                os.write(self.fd, encode_record(payload))
+
+        self.journal.dirty(self)
+
+    def append(self, values):
+        """ Append a row
+
+        :param values: numbers of the row.
+        :type values: list
+        """
+        self.write(','.join(map(repr, values)))
+
+    def sync(self):
+        with self.lock:
+            if self.fd is not None:
+                os.fsync(self.fd)
+
+    def remove(self):
+        """ Remove the segment, once its window is saved durably """
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+
+        os.remove(self.path)
+
+
+class Journal:
+    """ Write-ahead journal of the windows in progress, with group commit
+
+    Every window has its own segment, ``<book>-<window start>-<N>.journal``
+    (a full window is followed by another one with the same start), a header
+    and a line per row, each with its CRC32. The rows are written to the
+    OS right away and a background thread makes them durable with an
+    fsync per segment every ``commit_interval`` seconds, so a row costs a
+    ``write`` and not an fsync. A segment is removed when its window file
+    is saved; the segments left by a crash are recovered on start.
+
+    :param folder: folder of the segments.
+        Default: ``data_lake/journal`` of the current working directory
+    :type folder: str
+
+    :param commit_interval: seconds between two group commits.
+        Default: ``COMMIT_INTERVAL``
+    :type commit_interval: float
+    """
+
+    def __init__(self, folder=None, commit_interval=COMMIT_INTERVAL):
+        self.folder = folder
+        self.commit_interval = commit_interval
+        self.lock = threading.Lock()
+        self.dirty_segments = set()
+        self.new_segments = False
+        self.stopped = threading.Event()
+        self.thread = None
+
+        # Numbers of the segments created by this journal
+        self.numbers = itertools.count()
+
+    def get_folder(self):
+        return self.folder or get_journal_folder()
+
+    def get_segment_path(self, book, start, number):
+        """ Get the path of a segment of a window
+
+        :param book: name of the order book.
+        :type book: str
+
+        :param start: start of the window.
+        :type start: datetime
+
+        :param number: number of the segment, among the ones of the same
+            window start.
+        :type number: int
+        """
+        return os.path.join(
+            self.get_folder(),
+            f'{book}-{start.strftime("%Y%m%d-%H%M%S")}-{number:06d}'
+            f'{SEGMENT_EXTENSION}'
+        )
+
+    def create_segment(self, book, start):
+        # The numbers left by a previous run are skipped
+        while True:
+            path = self.get_segment_path(book, start, next(self.numbers))
+
+            try:
+                return JournalSegment(self, path)
+            except FileExistsError:
+                continue
+
+    def open_segment(self, book, start, metric_columns=(), path=None):
+        """ Create the segment of a new window
+
+        :param book: name of the order book.
+        :type book: str
+
+        :param start: start of the window.
+        :type start: datetime
+
+        :param metric_columns: names of the extra metrics of the rows.
+        :type metric_columns: list
+
+        :param path: reopen this segment, left by a crash, instead.
+        :type path: str
+        """
+        os.makedirs(self.get_folder(), exist_ok=True)
+
+        if path is not None:
+            # A segment restored after a crash already has its header
+            segment = JournalSegment(self, path, new=False)
+        else:
+            segment = self.create_segment(book, start)
+            segment.write(json.dumps({
+                'book': book,
+                'start': str(start),
+                'metric_columns': list(metric_columns),
+                'tick_time': True,
+            }))
+
+        with self.lock:
+            self.new_segments = True
+
+        self.start()
+
+        return segment
+
+    def dirty(self, segment):
+        with self.lock:
+            self.dirty_segments.add(segment)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self.run, name='journal', daemon=True
+            )
+            self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.commit_interval):
+            self.commit()
+
+    def commit(self):
+        """ Make durable the rows written since the last commit """
+        with self.lock:
+            segments = self.dirty_segments
+            new_segments = self.new_segments
+            self.dirty_segments = set()
+            self.new_segments = False
+
+        if not segments and not new_segments:
+            return
+
+        with collector_metrics.timer('journal_commit_seconds'):
+            for segment in segments:
+                try:
+                    segment.sync()
+                except OSError as error:
+                    print(
+                        datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                        f'- Error committing {segment.path}: {error}'
+                    )
+
+            # The entries of the new segments
+            if new_segments:
+                fsync_folder(self.get_folder())
+
+        collector_metrics.increment('journal_commits_total')
+
+    def close(self):
+        """ Stop the commit thread, after a last commit """
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+            self.stopped.clear()
+
+        self.commit()
+
+    def read_segments(self, books=None):
+        """ Read the segments left in the folder, oldest window first
+
+        Return ``(header, rows, path)`` tuples, the rows are lists of
+        numbers.
+
+        :param books: only the segments of these books.
+            Default: all of them
+        :type books: list
+        """
+        folder = self.get_folder()
+
+        if not os.path.isdir(folder):
+            return []
+
+        segments = []
+
+        for entry in os.scandir(folder):
+            if not entry.name.endswith(SEGMENT_EXTENSION):
+                continue
+
+            with open(entry.path, 'rb') as file:
+                payloads = decode_records(file.read())
+
+            if not payloads:
+                # Crashed before the header was written
+                os.remove(entry.path)
+                continue
+
+            header = json.loads(payloads[0])
+
+            if books is not None and header['book'] not in books:
+                continue
+
+            rows = [
+                [float(value) for value in payload.split(',')]
+                for payload in payloads[1:]
+            ]
+
+            # Keep only the complete records: the torn tail is cut, so the
+            # next rows are appended after a valid line
+            valid_size = sum(len(encode_record(p)) for p in payloads)
+
+            if valid_size < entry.stat().st_size:
+                os.truncate(entry.path, valid_size)
+
+            segments.append((header, rows, entry.path))
+
+        # The windows of the same start in the order of their segments
+        segments.sort(
+            key=lambda segment: (segment[0]['start'], segment[2])
+        )
+
+        return segments
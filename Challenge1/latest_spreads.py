@@ -0,0 +1,514 @@
+import asyncio
+import json
+import math
+import time
+from datetime import datetime
+
+import numpy as np
+from aiohttp import web
+
+from metrics import collector_metrics
+
+# Observations kept per book: the last 24 hours of one tick per second
+RING_SIZE = 24 * 60 * 60
+
+# Columns of the rings, after the timestamp
+RING_COLUMNS = ['bid', 'ask', 'spread']
+SPREAD = RING_COLUMNS.index('spread')
+
+# Resolution of the rings, one tick per second: the shortest interval of a
+# downsampled query
+MIN_STEP = 1.0
+
+# Most intervals of a downsampled query
+MAX_INTERVALS = RING_SIZE
+
+# Queries of more rows are rendered in a thread: the event loop that
+# collects the ticks never waits for them
+EXECUTOR_ROWS = 3600
+
+# Values of a list encoded at once by ``render_spreads``: the JSON encoder
+# holds the GIL, the event loop runs between two blocks
+RENDER_BLOCK = 4096
+
+
+class SpreadRing:
+    """ Last observations of a book, in a fixed size ring of arrays
+
+    The timestamp, bid, ask and spread are preallocated arrays of doubles,
+    the new observations overwrite the oldest ones. The timestamps are
+    kept in order, so a range is found by binary search.
+
+    :param size: observations kept.
+        Default: ``RING_SIZE``
+    :type size: int
+    """
+
+    def __init__(self, size=RING_SIZE):
+        self.size = size
+        self.timestamps = np.empty(size)
+        self.values = np.empty((len(RING_COLUMNS), size))
+
+        # Observations in the ring, and position of the next one
+        self.count = 0
+        self.position = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, bid, ask, spread):
+        """ Add an observation, overwriting the oldest one if full
+
+        :param timestamp: time of the observation, seconds since the epoch.
+        :type timestamp: float
+
+        :param bid: best bid price, NaN for a gap.
+        :type bid: float
+
+        :param ask: best ask price, NaN for a gap.
+        :type ask: float
+
+        :param spread: bid-ask spread in percent, NaN for a gap.
+        :type spread: float
+        """
+        # A wall clock set back must not break the order of the ring
+        if self.count and timestamp < self.timestamps[self.position - 1]:
+            timestamp = self.timestamps[self.position - 1]
+
+        self.timestamps[self.position] = timestamp
+        self.values[:, self.position] = (bid, ask, spread)
+
+        self.position = (self.position + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def get_slices(self):
+        """ Get the slices of the arrays with the observations, oldest first
+
+        Two slices once the ring is full and wrapped, one before.
+        """
+        start = (self.position - self.count) % self.size
+
+        if start + self.count <= self.size:
+            return [slice(start, start + self.count)]
+
+        return [slice(start, self.size), slice(0, self.position)]
+
+    def select(self, start=None, end=None):
+        """ Get the timestamps and values of the observations in a range
+
+        Return ``(timestamps, values)``, ``values`` with a row per column
+        of ``RING_COLUMNS``. They are views of the ring when possible: use
+        them before the next ``append``.
+
+        :param start: start of the range (included), seconds since the
+            epoch. Default: the oldest observation
+        :type start: float
+
+        :param end: end of the range (excluded), seconds since the epoch.
+            Default: after the newest observation
+        :type end: float
+        """
+        parts = []
+
+        for part in self.get_slices():
+            timestamps = self.timestamps[part]
+
+            first = 0 if start is None else \
+                np.searchsorted(timestamps, start, 'left')
+            last = len(timestamps) if end is None else \
+                np.searchsorted(timestamps, end, 'left')
+
+            if first < last:
+                positions = slice(part.start + first, part.start + last)
+                parts.append((
+                    self.timestamps[positions], self.values[:, positions]
+                ))
+
+        if not parts:
+            return np.empty(0), np.empty((len(RING_COLUMNS), 0))
+
+        if len(parts) == 1:
+            return parts[0]
+
+        return (
+            np.concatenate([timestamps for timestamps, _ in parts]),
+            np.concatenate([values for _, values in parts], axis=1)
+        )
+
+    def latest(self):
+        """ Get the ``(timestamp, values)`` of the newest observation that
+        is not a gap, None if there is none
+        """
+        position = (self.position - 1) % self.size
+
+        # Usually the newest one, else a search of the whole ring with numpy
+        if not self.count or math.isnan(self.values[SPREAD, position]):
+            position = None
+
+            for part in reversed(self.get_slices()):
+                valid = np.flatnonzero(~np.isnan(self.values[SPREAD, part]))
+
+                if len(valid):
+                    position = part.start + valid[-1]
+                    break
+
+            if position is None:
+                return None
+
+        return (
+            float(self.timestamps[position]),
+            self.values[:, position].copy()
+        )
+
+
+def downsample(timestamps, values, step, max_intervals=MAX_INTERVALS):
+    """ Aggregate observations in intervals of ``step`` seconds
+
+    Return the start of every interval with observations, and the count,
+    mean, min, max and last of the spread of each one. The gaps (NaN) are
+    left out, an interval with only gaps has NaN values and a 0 count.
+    Raise ValueError if the range has more than ``max_intervals``.
+
+    :param timestamps: sorted timestamps, seconds since the epoch.
+    :type timestamps: numpy.ndarray
+
+    :param values: rows of the ``RING_COLUMNS``, see ``SpreadRing.select``.
+    :type values: numpy.ndarray
+
+    :param step: length of the intervals, aligned to the epoch.
+    :type step: float
+
+    :param max_intervals: most intervals of the range.
+        Default: ``MAX_INTERVALS``
+    :type max_intervals: int
+    """
+    spreads = values[SPREAD]
+
+    if not len(timestamps):
+        empty = np.empty(0)
+        return empty, {
+            name: empty for name in ['count', 'mean', 'min', 'max', 'last']
+        }
+
+    # The timestamps are sorted: the first row of every interval is found
+    # by binary search, not by flooring all of them
+    first = math.floor(timestamps[0] / step)
+    count = math.floor(timestamps[-1] / step) - first + 1
+
+    # Checked before allocating them
+    if count > max_intervals:
+        raise ValueError(
+            f'Too many intervals: {count}, the most is {max_intervals}'
+        )
+
+    intervals = (first + np.arange(count)) * step
+    starts = np.searchsorted(timestamps, intervals)
+
+    # Without the intervals that have no rows
+    kept = starts < np.r_[starts[1:], len(timestamps)]
+    intervals = intervals[kept]
+    starts = starts[kept]
+
+    valid = ~np.isnan(spreads)
+    counts = np.add.reduceat(valid.view(np.int8), starts, dtype=np.int64)
+    sums = np.add.reduceat(np.where(valid, spreads, 0.0), starts)
+
+    # fmin and fmax skip the NaN values, unless all of them are NaN
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, sums / counts, np.nan)
+
+    return intervals, {
+        'count': counts,
+        'mean': means,
+        'min': np.fmin.reduceat(spreads, starts),
+        'max': np.fmax.reduceat(spreads, starts),
+        'last': spreads[np.r_[starts[1:], len(spreads)] - 1],
+    }
+
+
+class LatestSpreads:
+    """ Rings of the last observations of every book, for the dashboards
+
+    :param size: observations kept per book.
+        Default: ``RING_SIZE``
+    :type size: int
+    """
+
+    def __init__(self, size=RING_SIZE):
+        self.size = size
+        self.rings = {}
+
+    def get_ring(self, book):
+        if book not in self.rings:
+            self.rings[book] = SpreadRing(self.size)
+
+        return self.rings[book]
+
+    def add(self, book, timestamp, bid, ask, spread):
+        """ Add an observation of a book
+
+        :param book: name of the order book.
+        :type book: str
+
+        :param timestamp: time of the observation.
+        :type timestamp: datetime
+
+        :param bid: best bid price.
+        :type bid: float
+
+        :param ask: best ask price.
+        :type ask: float
+
+        :param spread: bid-ask spread in percent.
+        :type spread: float
+        """
+        self.get_ring(book).append(timestamp.timestamp(), bid, ask, spread)
+
+    def add_gap(self, book, timestamp):
+        """ Add a tick without observation of a book
+
+        :param book: name of the order book.
+        :type book: str
+
+        :param timestamp: time of the tick.
+        :type timestamp: datetime
+        """
+        self.add(book, timestamp, math.nan, math.nan, math.nan)
+
+
+def to_json_values(values):
+    """ Convert an array to a list for JSON, NaN (gaps) as null
+
+    :param values: numbers.
+    :type values: numpy.ndarray
+    """
+    return [None if value != value else value for value in values.tolist()]
+
+
+def parse_time(value):
+    """ Parse a query parameter as seconds since the epoch
+
+    :param value: seconds since the epoch or an ISO 8601 datetime (naive
+        datetimes are considered UTC), or None.
+    :type value: str
+    """
+    if value is None:
+        return None
+
+    try:
+        return float(value)
+    except ValueError:
+        timestamp = datetime.fromisoformat(value)
+
+        if timestamp.tzinfo is None:
+            return (timestamp - datetime(1970, 1, 1)).total_seconds()
+
+        return timestamp.timestamp()
+
+
+def select_spreads(latest_spreads, book, query):
+    """ Copy the observations of a query of the service, see
+    ``start_query_server``. Return the timestamps, values and step
+
+    The copies can be formatted by ``format_spreads`` in another thread
+    while the ring goes on.
+
+    :param latest_spreads: rings of the books.
+    :type latest_spreads: LatestSpreads
+
+    :param book: name of the order book.
+    :type book: str
+
+    :param query: parameters of the query: ``start``, ``end``, ``last``
+        and ``step``.
+    :type query: dict
+    """
+    ring = latest_spreads.rings[book]
+
+    start = parse_time(query.get('start'))
+    end = parse_time(query.get('end'))
+
+    if query.get('last') is not None:
+        start = time.time() - float(query['last'])
+
+    step = None
+
+    if query.get('step') is not None:
+        step = float(query['step'])
+
+        if not MIN_STEP <= step < math.inf:
+            raise ValueError(
+                f'The step must be at least {MIN_STEP} seconds: {step}'
+            )
+
+    timestamps, values = ring.select(start, end)
+
+    return timestamps.copy(), values.copy(), step
+
+
+def format_spreads(book, timestamps, values, step=None):
+    """ Get the response of a query, see ``select_spreads``
+
+    :param book: name of the order book.
+    :type book: str
+
+    :param timestamps: timestamps of the observations.
+    :type timestamps: numpy.ndarray
+
+    :param values: rows of the ``RING_COLUMNS``.
+    :type values: numpy.ndarray
+
+    :param step: downsample to intervals of this length, see
+        ``downsample``.
+        Default: all the observations
+    :type step: float
+    """
+    if step is not None:
+        intervals, aggregates = downsample(timestamps, values, step)
+
+        return {
+            'book': book,
+            'step': step,
+            'timestamp': intervals.tolist(),
+            **{
+                name: to_json_values(column)
+                for name, column in aggregates.items()
+            },
+        }
+
+    return {
+        'book': book,
+        'timestamp': timestamps.tolist(),
+        **{
+            column: to_json_values(values[index])
+            for index, column in enumerate(RING_COLUMNS)
+        },
+    }
+
+
+def query_spreads(latest_spreads, book, query):
+    """ Answer a query of the service, see ``start_query_server``
+
+    See ``select_spreads`` for the parameters.
+    """
+    return format_spreads(book, *select_spreads(latest_spreads, book, query))
+
+
+def render_spreads(book, timestamps, values, step=None):
+    """ Get the JSON of the response of a query as bytes, see
+    ``format_spreads``. The lists are encoded in blocks of
+    ``RENDER_BLOCK`` values
+    """
+    fields = []
+
+    for name, value in format_spreads(book, timestamps, values, step).items():
+        if isinstance(value, list):
+            blocks = [
+                json.dumps(value[position:position + RENDER_BLOCK])[1:-1]
+                for position in range(0, len(value), RENDER_BLOCK)
+            ]
+            encoded = f'[{", ".join(blocks)}]'
+        else:
+            encoded = json.dumps(value)
+
+        fields.append(f'{json.dumps(name)}: {encoded}')
+
+    return f'{{{", ".join(fields)}}}'.encode()
+
+
+async def start_query_server(latest_spreads, host='127.0.0.1', port=None,
+                             path=None):
+    """ Serve the last observations of the books, without the Data Lake
+
+    - ``GET /spreads``: the books and their observations in memory.
+    - ``GET /spreads/<book>/latest``: the newest observation.
+    - ``GET /spreads/<book>?start=&end=``: the observations in
+      ``[start, end)``, seconds since the epoch or ISO 8601 datetimes
+      (naive ones are UTC). ``last=300`` for the last 5 minutes.
+    - ``GET /spreads/<book>?last=3600&step=60``: the count, mean, min, max
+      and last spread of every minute. The step is ``MIN_STEP`` or more,
+      and a query has ``MAX_INTERVALS`` at most.
+
+    The columns are lists, gaps are null. The queries of more than
+    ``EXECUTOR_ROWS`` are rendered in a thread. Return the runner, call
+    ``await runner.cleanup()`` to stop it.
+
+    :param latest_spreads: rings of the books.
+    :type latest_spreads: LatestSpreads
+
+    :param host: interface to listen on.
+        Default: ``127.0.0.1``
+    :type host: str
+
+    :param port: port to listen on.
+    :type port: int
+
+    :param path: listen on this Unix socket instead of a port.
+    :type path: str
+    """
+    def get_book(request):
+        book = request.match_info['book']
+
+        if book not in latest_spreads.rings:
+            raise web.HTTPNotFound(text=f'Unknown book: {book}')
+
+        return book
+
+    async def handle_books(request):
+        return web.json_response({
+            book: len(ring) for book, ring in latest_spreads.rings.items()
+        })
+
+    async def handle_latest(request):
+        book = get_book(request)
+
+        with collector_metrics.timer('query_seconds'):
+            latest = latest_spreads.rings[book].latest()
+
+        if latest is None:
+            return web.json_response({'book': book})
+
+        timestamp, values = latest
+
+        return web.json_response({
+            'book': book,
+            'timestamp': timestamp,
+            **dict(zip(RING_COLUMNS, values.tolist())),
+        })
+
+    async def handle_range(request):
+        book = get_book(request)
+
+        try:
+            with collector_metrics.timer('query_seconds'):
+                timestamps, values, step = select_spreads(
+                    latest_spreads, book, request.query
+                )
+
+                if len(timestamps) <= EXECUTOR_ROWS:
+                    return web.json_response(
+                        format_spreads(book, timestamps, values, step)
+                    )
+
+                body = await asyncio.get_running_loop().run_in_executor(
+                    None, render_spreads, book, timestamps, values, step
+                )
+        except ValueError as error:
+            raise web.HTTPBadRequest(text=str(error))
+
+        return web.Response(body=body, content_type='application/json')
+
+    app = web.Application()
+    app.router.add_get('/spreads', handle_books)
+    app.router.add_get('/spreads/{book}/latest', handle_latest)
+    app.router.add_get('/spreads/{book}', handle_range)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+
+    if path is not None:
+        await web.UnixSite(runner, path).start()
+    else:
+        await web.TCPSite(runner, host, port).start()
+
+    return runner
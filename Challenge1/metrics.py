@@ -0,0 +1,363 @@
+import asyncio
+import time
+from contextlib import nullcontext
+
+from aiohttp import web
+
+from data_lake import write_file_atomically
+
+# Sub-buckets per power of two of the histograms (as HDR Histogram): 2^7
+# gives values with a relative error under 1%
+SIGNIFICANT_BITS = 7
+
+# Quantiles exported for every histogram
+EXPORTED_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+# Seconds between two exports of the metrics file
+EXPORT_INTERVAL = 10.0
+
+
+class LatencyHistogram:
+    """ Histogram of durations with buckets of a bounded relative error
+
+    The durations are counted in microseconds, in log-linear buckets like
+    HDR Histogram: ``2^SIGNIFICANT_BITS`` linear sub-buckets per power of
+    two. Recording is a couple of integer operations and a dictionary
+    increment, and the memory doesn't depend on the number of values.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    @staticmethod
+    def bucket(microseconds):
+        magnitude = max(0, microseconds.bit_length() - SIGNIFICANT_BITS)
+        sub_bucket = microseconds >> magnitude
+
+        return magnitude << SIGNIFICANT_BITS | sub_bucket
+
+    @staticmethod
+    def bucket_value(bucket):
+        """ Get the highest duration (seconds) counted in a bucket """
+        magnitude = bucket >> SIGNIFICANT_BITS
+        sub_bucket = bucket & ((1 << SIGNIFICANT_BITS) - 1)
+
+        return (((sub_bucket + 1) << magnitude) - 1) / 1_000_000
+
+    def record(self, seconds):
+        """ Count a duration
+
+        :param seconds: duration in seconds.
+        :type seconds: float
+        """
+        bucket = self.bucket(max(0, int(seconds * 1_000_000)))
+
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count = self.count + 1
+        self.total = self.total + seconds
+
+        if seconds > self.maximum:
+            self.maximum = seconds
+
+    def quantile(self, quantile):
+        """ Get the duration of a quantile, None if empty
+
+        :param quantile: from 0 to 1. Example: 0.99
+        :type quantile: float
+        """
+        if not self.count:
+            return None
+
+        rank = quantile * self.count
+        seen = 0
+
+        for bucket in sorted(self.counts):
+            seen = seen + self.counts[bucket]
+
+            if seen >= rank:
+                return min(self.bucket_value(bucket), self.maximum)
+
+        return self.maximum
+
+    def merge(self, other):
+        """ Add the durations counted by another histogram
+
+        The buckets are the same for every histogram, so the quantiles of
+        the merged one have the same error.
+
+        :param other: histogram to add.
+        :type other: LatencyHistogram
+        """
+        for bucket, count in list(other.counts.items()):
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+
+        self.count = self.count + other.count
+        self.total = self.total + other.total
+        self.maximum = max(self.maximum, other.maximum)
+
+    def copy(self):
+        histogram = LatencyHistogram()
+        histogram.merge(self)
+
+        return histogram
+
+
+class StageTimer:
+    """ Context manager that records the duration of its block
+
+    :param metrics: metrics where the duration is recorded.
+    :type metrics: Metrics
+
+    :param name: name of the histogram.
+    :type name: str
+    """
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.started)
+
+
+# Returned by the timers of disabled metrics: does nothing
+DISABLED_TIMER = nullcontext()
+
+
+class Metrics:
+    """ Timers, counters and gauges of the collector
+
+    Disabled, every method returns right away, so the instrumentation can
+    stay in the hot path.
+
+    :param enabled: record the values.
+        Default: False
+    :type enabled: bool
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name, seconds):
+        """ Record a duration in the histogram of a stage
+
+        :param name: name of the histogram. Example: ``fetch_seconds``
+        :type name: str
+
+        :param seconds: duration in seconds.
+        :type seconds: float
+        """
+        if not self.enabled:
+            return
+
+        histogram = self.histograms.get(name)
+
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram()
+
+        histogram.record(seconds)
+
+    def increment(self, name, value=1):
+        """ Add to a counter
+
+        :param name: name of the counter. Example: ``ticks_late_total``
+        :type name: str
+
+        :param value: amount to add.
+            Default: 1
+        :type value: int
+        """
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        """ Set the current value of a gauge
+
+        :param name: name of the gauge, labels included. Examples:
+            ``write_queue_depth`` or ``writer_queue_depth{book="btc_mxn"}``
+        :type name: str
+
+        :param value: current value.
+        :type value: float
+        """
+        if self.enabled:
+            self.gauges[name] = value
+
+    def add_to_gauge(self, name, value):
+        """ Add to the current value of a gauge (negative to subtract)
+
+        :param name: name of the gauge.
+        :type name: str
+
+        :param value: amount to add.
+        :type value: float
+        """
+        if self.enabled:
+            self.gauges[name] = self.gauges.get(name, 0) + value
+
+    def timer(self, name):
+        """ Record the duration of a ``with`` block in the histogram ``name``
+
+        :param name: name of the histogram.
+        :type name: str
+        """
+        if not self.enabled:
+            return DISABLED_TIMER
+
+        return StageTimer(self, name)
+
+    def snapshot(self):
+        """ Copy the values, for example to send them to another process
+
+        The copy is made of plain objects that can be pickled.
+        """
+        return {
+            'histograms': {
+                name: histogram.copy()
+                for name, histogram in list(self.histograms.items())
+            },
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+        }
+
+    def merge(self, snapshot, gauges=True):
+        """ Add the values of a snapshot: histograms and counters are
+        added, gauges are summed
+
+        :param snapshot: values of other metrics, see ``snapshot``.
+        :type snapshot: dict
+
+        :param gauges: add the gauges too.
+            Default: True
+        :type gauges: bool
+        """
+        for name, histogram in snapshot['histograms'].items():
+            if name not in self.histograms:
+                self.histograms[name] = LatencyHistogram()
+
+            self.histograms[name].merge(histogram)
+
+        for name, value in snapshot['counters'].items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+        if gauges:
+            for name, value in snapshot['gauges'].items():
+                self.gauges[name] = self.gauges.get(name, 0) + value
+
+    def to_prometheus(self, prefix='collector_'):
+        """ Render the metrics in the Prometheus text format
+
+        The histograms are exported as summaries with ``EXPORTED_QUANTILES``.
+
+        :param prefix: prefix of every metric name.
+            Default: ``collector_``
+        :type prefix: str
+        """
+        lines = []
+
+        for metric_type, values in (('counter', self.counters),
+                                    ('gauge', self.gauges)):
+            families = set()
+
+            for name, value in sorted(values.items()):
+                # Labels are part of the name: name{label="value"}
+                family = name.split('{')[0]
+
+                if family not in families:
+                    families.add(family)
+                    lines.append(f'# TYPE {prefix}{family} {metric_type}')
+
+                lines.append(f'{prefix}{name} {value}')
+
+        for name, histogram in sorted(self.histograms.items()):
+            lines.append(f'# TYPE {prefix}{name} summary')
+
+            for quantile in EXPORTED_QUANTILES:
+                lines.append(
+                    f'{prefix}{name}{{quantile="{quantile}"}} '
+                    f'{histogram.quantile(quantile)}'
+                )
+
+            lines.append(f'{prefix}{name}_sum {histogram.total}')
+            lines.append(f'{prefix}{name}_count {histogram.count}')
+            lines.append(f'# TYPE {prefix}{name}_max gauge')
+            lines.append(f'{prefix}{name}_max {histogram.maximum}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write_file(self, path_to_file):
+        """ Save the metrics (Prometheus text format) to a file, atomically
+
+        :param path_to_file: path of the metrics file.
+        :type path_to_file: str
+        """
+        write_file_atomically(path_to_file, self.to_prometheus())
+
+
+async def export_metrics(metrics, path_to_file, interval=EXPORT_INTERVAL):
+    """ Save the metrics to a file every interval, until cancelled
+
+    :param metrics: metrics to export.
+    :type metrics: Metrics
+
+    :param path_to_file: path of the metrics file. Example: a file read by
+        the textfile collector of the Prometheus node exporter.
+    :type path_to_file: str
+
+    :param interval: seconds between two exports.
+        Default: ``EXPORT_INTERVAL``
+    :type interval: float
+    """
+    loop = asyncio.get_running_loop()
+
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            await loop.run_in_executor(None, metrics.write_file, path_to_file)
+    finally:
+        metrics.write_file(path_to_file)
+
+
+async def start_metrics_server(metrics, host='127.0.0.1', port=9100):
+    """ Serve the metrics at ``http://<host>:<port>/metrics``
+
+    Return the runner, call ``await runner.cleanup()`` to stop it.
+
+    :param metrics: metrics to serve.
+    :type metrics: Metrics
+
+    :param host: interface to listen on.
+        Default: ``127.0.0.1``
+    :type host: str
+
+    :param port: port to listen on.
+        Default: 9100
+    :type port: int
+    """
+    async def handle(request):
+        return web.Response(
+            text=metrics.to_prometheus(), content_type='text/plain'
+        )
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    return runner
+
+
+# Shared by the fetcher, the collector and the writers of the process
+collector_metrics = Metrics()
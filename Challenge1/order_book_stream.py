@@ -0,0 +1,648 @@
+import asyncio
+import bisect
+import json
+import random
+from datetime import datetime, timezone
+
+import aiohttp
+import numpy as np
+
+from metrics import collector_metrics
+from scheduler import TickScheduler
+from top_of_book import TopOfBook
+
+# Public WebSocket API of Bitso
+WS_URL = 'wss://ws.bitso.com'
+
+# Channel with every change of the orders of a book
+DIFF_ORDERS = 'diff-orders'
+
+# Side of an order in the diffs: "t" field
+BUY = 0
+SELL = 1
+
+# Status of an order in the diffs: "s" field. The other ones (cancelled,
+# completed) remove the order from the book
+OPEN = 'open'
+
+# Seconds between two spreads of a book, one per second like the polling
+# collector. None: on every update (a window is then a number of updates,
+# not 10 minutes)
+STREAM_INTERVAL = 1.0
+
+# Diffs kept per book while it's synced. Past them (the snapshots keep
+# failing) the kept ones are dropped and the sync waits for a newer snapshot
+MAX_PENDING = 10000
+
+# Seconds between two pings to detect a dead connection
+HEARTBEAT = 10.0
+
+# Seconds to wait (with full jitter) before reconnecting, at most
+RECONNECT_DELAY_CAP = 5.0
+
+
+class SequenceGap(Exception):
+    """ A diff of the order book was missed, the book must be synced again
+    """
+
+
+class PriceLevels:
+    """ Price levels of one side of an order book, sorted by price
+
+    The prices are kept in an ascending list (updated with a binary search)
+    and the amount and the number of orders of every level in a dict, so
+    the best price is read in constant time.
+    """
+
+    def __init__(self):
+        self.prices = []
+
+        # price: [amount, orders]
+        self.levels = {}
+
+    def __len__(self):
+        return len(self.prices)
+
+    def add(self, price, amount):
+        """ Add an order to its level
+
+        :param price: price of the order.
+        :type price: float
+
+        :param amount: amount of the order.
+        :type amount: float
+        """
+        level = self.levels.get(price)
+
+        if level is None:
+            bisect.insort(self.prices, price)
+            self.levels[price] = [amount, 1]
+        else:
+            level[0] = level[0] + amount
+            level[1] = level[1] + 1
+
+    def remove(self, price, amount):
+        """ Remove an order from its level, and the level if it gets empty
+
+        :param price: price of the order.
+        :type price: float
+
+        :param amount: amount of the order.
+        :type amount: float
+        """
+        level = self.levels[price]
+        level[1] = level[1] - 1
+
+        if level[1]:
+            level[0] = level[0] - amount
+        else:
+            del self.levels[price]
+            del self.prices[bisect.bisect_left(self.prices, price)]
+
+    def lowest(self):
+        return self.prices[0] if self.prices else None
+
+    def highest(self):
+        return self.prices[-1] if self.prices else None
+
+    def top(self, levels, descending=False):
+        """ Get the prices and amounts of the best levels, as arrays
+
+        :param levels: number of levels.
+        :type levels: int
+
+        :param descending: the best levels are the highest prices (bids).
+            Default: False
+        :type descending: bool
+        """
+        if descending:
+            prices = self.prices[:-levels - 1:-1]
+        else:
+            prices = self.prices[:levels]
+
+        return (
+            np.array(prices, dtype=np.float64),
+            np.array([self.levels[price][0] for price in prices],
+                     dtype=np.float64)
+        )
+
+
+class LocalOrderBook:
+    """ Order book of one book kept up to date with the diffs of the stream
+
+    It starts from a snapshot of the orders (``order_book`` with
+    ``aggregate=false``) and applies, in order, the diffs with a bigger
+    sequence. A missing sequence raises ``SequenceGap``.
+
+    :param book: name of the order book.
+    :type book: str
+    """
+
+    def __init__(self, book):
+        self.book = book
+        self.sequence = None
+        self.updated_at = None
+
+        # oid: (side, price, amount)
+        self.orders = {}
+        self.bids = PriceLevels()
+        self.asks = PriceLevels()
+
+    @property
+    def synced(self):
+        return self.sequence is not None
+
+    def reset(self):
+        """ Forget the orders, until the next snapshot """
+        self.__init__(self.book)
+
+    def side(self, side):
+        return self.bids if side == BUY else self.asks
+
+    def add_order(self, oid, side, price, amount):
+        """ Add an order, or replace it if it's already in the book
+
+        :param oid: id of the order.
+        :type oid: str
+
+        :param side: ``BUY`` or ``SELL``.
+        :type side: int
+
+        :param price: price of the order.
+        :type price: float
+
+        :param amount: amount of the order.
+        :type amount: float
+        """
+        self.remove_order(oid)
+
+        self.orders[oid] = (side, price, amount)
+        self.side(side).add(price, amount)
+
+    def remove_order(self, oid):
+        """ Remove an order, if it's in the book
+
+        :param oid: id of the order.
+        :type oid: str
+        """
+        order = self.orders.pop(oid, None)
+
+        if order is not None:
+            side, price, amount = order
+            self.side(side).remove(price, amount)
+
+    def load_snapshot(self, payload):
+        """ Replace the orders with the ones of a snapshot
+
+        :param payload: payload of an ``order_book`` response with
+            ``aggregate=false``: every order has its ``oid``.
+        :type payload: dict
+        """
+        self.reset()
+
+        for side, orders in ((BUY, payload['bids']), (SELL, payload['asks'])):
+            for order in orders:
+                self.add_order(
+                    order['oid'], side, float(order['price']),
+                    float(order['amount'])
+                )
+
+        self.sequence = int(payload['sequence'])
+        self.updated_at = payload['updated_at']
+
+    def apply(self, message):
+        """ Apply a ``diff-orders`` message. Return False if it's older than
+        the book
+
+        :param message: message of the stream.
+        :type message: dict
+        """
+        sequence = int(message['sequence'])
+
+        # Already in the snapshot
+        if sequence <= self.sequence:
+            return False
+
+        if sequence != self.sequence + 1:
+            raise SequenceGap(
+                f'{self.book}: expected sequence {self.sequence + 1}, '
+                f'got {sequence}'
+            )
+
+        for diff in message['payload']:
+            amount = diff.get('a')
+
+            if diff.get('s', OPEN) == OPEN and amount and float(amount) > 0:
+                self.add_order(
+                    diff['o'], int(diff['t']), float(diff['r']),
+                    float(amount)
+                )
+            else:
+                self.remove_order(diff['o'])
+
+            if 'd' in diff:
+                self.updated_at = datetime.fromtimestamp(
+                    diff['d'] / 1000, timezone.utc
+                ).isoformat()
+
+        self.sequence = sequence
+
+        return True
+
+    def to_payload(self):
+        """ Get the orders as the payload of an ``order_book`` response with
+        ``aggregate=false``, sorted like the API one """
+        sides = {BUY: [], SELL: []}
+
+        for oid, (side, price, amount) in self.orders.items():
+            sides[side].append(
+                {'book': self.book, 'price': str(price),
+                 'amount': str(amount), 'oid': oid}
+            )
+
+        sides[BUY].sort(key=lambda order: -float(order['price']))
+        sides[SELL].sort(key=lambda order: float(order['price']))
+
+        return {
+            'asks': sides[SELL],
+            'bids': sides[BUY],
+            'updated_at': self.updated_at,
+            'sequence': str(self.sequence),
+        }
+
+    def top_of_book(self, depth_engine=None):
+        """ Get the best bid and ask, and the depth metrics if requested
+
+        :param depth_engine: computes the depth metrics.
+            Default: no depth metrics
+        :type depth_engine: depth.DepthEngine
+        """
+        metrics = None
+
+        if depth_engine is not None:
+            bid_prices, bid_amounts = self.bids.top(
+                depth_engine.max_levels, descending=True
+            )
+            ask_prices, ask_amounts = self.asks.top(depth_engine.max_levels)
+
+            metrics = depth_engine.compute(
+                bid_prices, bid_amounts, ask_prices, ask_amounts
+            )
+
+        return TopOfBook(
+            self.updated_at, str(self.sequence), self.bids.highest(),
+            self.asks.lowest(), metrics
+        )
+
+
+class OrderBookStream:
+    """ Keep local order books of several books from the diff-orders stream
+
+    The diffs that arrive while a book is being synced are kept and applied
+    after the snapshot. A missing sequence (or a reconnection) syncs the
+    book again from a new snapshot of the REST API.
+
+    The spread is handed over on every update or, with an ``interval``, on
+    the ticks of a ``scheduler.TickScheduler`` (a book out of sync is a
+    gap, like a failed request of the polling collector).
+
+    :param books: names of the order books.
+        Examples: ``['usd_mxn', 'btc_mxn']``
+    :type books: list
+
+    :param fetcher: fetcher of the snapshots. Its connection pool is used by
+        the WebSocket too.
+    :type fetcher: fetcher.OrderBookFetcher
+
+    :param on_order_book: coroutine function
+        ``on_order_book(book, data, tick_time)``, see
+        ``collector.collect_order_books``.
+    :type on_order_book: callable
+
+    :param ws_url: URL of the WebSocket API.
+        Default: ``WS_URL``
+    :type ws_url: str
+
+    :param interval: seconds between two spreads of a book, None on every
+        update.
+        Default: ``STREAM_INTERVAL``
+    :type interval: float
+
+    :param depth_engine: computes the depth metrics of every spread.
+        Default: no depth metrics
+    :type depth_engine: depth.DepthEngine
+
+    :param max_pending: diffs kept per book while it's synced.
+        Default: ``MAX_PENDING``
+    :type max_pending: int
+    """
+
+    def __init__(self, books, fetcher, on_order_book, ws_url=WS_URL,
+                 interval=STREAM_INTERVAL, depth_engine=None,
+                 max_pending=MAX_PENDING):
+        self.books = list(books)
+        self.fetcher = fetcher
+        self.on_order_book = on_order_book
+        self.ws_url = ws_url
+        self.interval = interval
+        self.depth_engine = depth_engine
+        self.max_pending = max_pending
+
+        self.order_books = {book: LocalOrderBook(book) for book in books}
+
+        # Diffs received while the book is synced: book: [messages]
+        self.pending = {}
+        self.syncs = {}
+
+    async def fetch_snapshot(self, book):
+        """ Get the orders of a book from the REST API
+
+        :param book: name of the order book.
+        :type book: str
+        """
+        content = await self.fetcher.fetch_raw(
+            f'order_book/?book={book}&aggregate=false'
+        )
+
+        return json.loads(content)['payload']
+
+    def start_sync(self, book):
+        """ Sync a book again from a snapshot, in the background
+
+        :param book: name of the order book.
+        :type book: str
+        """
+        self.order_books[book].reset()
+        self.pending.setdefault(book, [])
+
+        if book not in self.syncs:
+            self.syncs[book] = asyncio.create_task(self.sync(book))
+
+    def keep_pending(self, book, message):
+        """ Keep a diff of a book being synced, to apply it after the
+        snapshot
+
+        Once ``max_pending`` diffs are kept they are dropped: the first diff
+        kept is then newer, and the sync loads snapshots until one is not
+        older than it.
+
+        :param book: name of the order book.
+        :type book: str
+
+        :param message: message of the stream.
+        :type message: dict
+        """
+        pending = self.pending.setdefault(book, [])
+
+        if len(pending) >= self.max_pending:
+            collector_metrics.increment('stream_pending_dropped_total')
+
+            print(
+                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                f'- Dropped {len(pending)} {book} diffs kept for the sync'
+            )
+
+            pending.clear()
+
+        pending.append(message)
+
+    async def sync(self, book):
+        """ Load a snapshot of a book and apply the diffs kept meanwhile
+
+        :param book: name of the order book.
+        :type book: str
+        """
+        order_book = self.order_books[book]
+        attempt = 0
+
+        try:
+            while not order_book.synced:
+                collector_metrics.increment('stream_syncs_total')
+
+                try:
+                    snapshot = await self.fetch_snapshot(book)
+                except Exception as error:
+                    print(
+                        datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                        f'- Error getting the {book} snapshot: {error}'
+                    )
+
+                    await asyncio.sleep(reconnect_delay(attempt))
+                    attempt = attempt + 1
+                    continue
+
+                order_book.load_snapshot(snapshot)
+
+                try:
+                    # The diffs older than the snapshot are skipped
+                    for message in self.pending[book]:
+                        order_book.apply(message)
+                except SequenceGap:
+                    # The snapshot is older than the first diff kept: wait
+                    # for a newer one
+                    order_book.reset()
+
+                    await asyncio.sleep(reconnect_delay(attempt))
+                    attempt = attempt + 1
+                    continue
+
+                del self.pending[book]
+        finally:
+            del self.syncs[book]
+
+    async def handle_message(self, message):
+        """ Apply a message of the stream to its book
+
+        :param message: message of the stream.
+        :type message: dict
+        """
+        book = message.get('book')
+
+        if message.get('type') != DIFF_ORDERS or book not in self.order_books:
+            # Keep alive and subscription messages
+            return
+
+        collector_metrics.increment('stream_messages_total')
+
+        order_book = self.order_books[book]
+
+        if not order_book.synced:
+            self.keep_pending(book, message)
+            return
+
+        try:
+            with collector_metrics.timer('apply_seconds'):
+                changed = order_book.apply(message)
+        except SequenceGap as error:
+            collector_metrics.increment('stream_gaps_total')
+
+            print(
+                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                f'- Resyncing {error}'
+            )
+
+            self.start_sync(book)
+            self.keep_pending(book, message)
+            return
+
+        if changed and self.interval is None:
+            await self.on_order_book(
+                book, order_book.top_of_book(self.depth_engine),
+                datetime.now(timezone.utc)
+            )
+
+    async def receive(self):
+        """ Subscribe to the books and apply their diffs, until disconnected
+        """
+        async with self.fetcher.session.ws_connect(
+            self.ws_url, heartbeat=HEARTBEAT
+        ) as websocket:
+            # The diffs of the last connection are useless
+            self.pending = {}
+
+            # Subscribe before the snapshots, so no diff is missed
+            for book in self.books:
+                await websocket.send_json(
+                    {'action': 'subscribe', 'book': book, 'type': DIFF_ORDERS}
+                )
+
+            for book in self.books:
+                self.start_sync(book)
+
+            async for ws_message in websocket:
+                if ws_message.type != aiohttp.WSMsgType.TEXT:
+                    break
+
+                await self.handle_message(json.loads(ws_message.data))
+
+    async def sample(self, requests_number=None, alignment=None):
+        """ Hand over the spread of every book on the ticks of ``interval``
+
+        :param requests_number: Maximum number of ticks. Forever if None.
+        :type requests_number: int
+
+        :param alignment: start on a multiple of these seconds of wall clock.
+        :type alignment: float
+        """
+        scheduler = TickScheduler(self.interval)
+        tick = scheduler.first_tick(alignment)
+        last_tick = None
+
+        if requests_number is not None:
+            last_tick = tick + requests_number
+
+        while last_tick is None or tick < last_tick:
+            await scheduler.wait(tick)
+
+            tick_time = scheduler.tick_time(tick)
+
+            for book, order_book in self.order_books.items():
+                data = None
+
+                if order_book.synced:
+                    data = order_book.top_of_book(self.depth_engine)
+                else:
+                    collector_metrics.increment('ticks_missed_total')
+
+                await self.on_order_book(book, data, tick_time)
+
+            tick, skipped_ticks = scheduler.next_tick(tick)
+
+            for skipped in skipped_ticks:
+                if last_tick is not None and skipped >= last_tick:
+                    break
+
+                for book in self.books:
+                    collector_metrics.increment('ticks_missed_total')
+
+                    await self.on_order_book(
+                        book, None, scheduler.tick_time(skipped)
+                    )
+
+    async def run(self, requests_number=None, alignment=None):
+        """ Stream the books, reconnecting when the connection is lost
+
+        :param requests_number: Maximum number of ticks when sampling on an
+            ``interval``. Forever if None.
+            Default: None
+        :type requests_number: int
+
+        :param alignment: start the ticks on a multiple of these seconds of
+            wall clock, when sampling on an ``interval``.
+            Default: start on the next tick
+        :type alignment: float
+        """
+        sampler = None
+
+        if self.interval is not None:
+            sampler = asyncio.create_task(
+                self.sample(requests_number, alignment)
+            )
+
+        attempt = 0
+
+        try:
+            async with self.fetcher:
+                while sampler is None or not sampler.done():
+                    try:
+                        await self.receive_until(sampler)
+                        attempt = 0
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as \
+                            error:
+                        print(
+                            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                            f'- WebSocket error: {error}'
+                        )
+
+                    if sampler is not None and sampler.done():
+                        break
+
+                    collector_metrics.increment('stream_reconnects_total')
+
+                    for sync in list(self.syncs.values()):
+                        sync.cancel()
+
+                    await asyncio.sleep(reconnect_delay(attempt))
+                    attempt = attempt + 1
+        finally:
+            if sampler is not None:
+                sampler.cancel()
+                await asyncio.gather(sampler, return_exceptions=True)
+
+            for sync in list(self.syncs.values()):
+                sync.cancel()
+
+    async def receive_until(self, sampler):
+        """ Receive until disconnected or, if any, the sampler is done
+
+        :param sampler: task of ``sample``, or None.
+        :type sampler: asyncio.Task
+        """
+        if sampler is None:
+            await self.receive()
+            return
+
+        receiver = asyncio.create_task(self.receive())
+
+        await asyncio.wait(
+            [receiver, sampler], return_when=asyncio.FIRST_COMPLETED
+        )
+
+        if not receiver.done():
+            receiver.cancel()
+
+        # Raise the errors of the connection
+        await asyncio.gather(receiver, return_exceptions=sampler.done())
+
+        # Raise the errors of the sampler
+        if sampler.done():
+            sampler.result()
+
+
+def reconnect_delay(attempt):
+    """ Get the seconds to wait before reconnecting, using full jitter
+
+    :param attempt: number of the failed attempt, starting in 0.
+    :type attempt: int
+    """
+    return random.uniform(0, min(RECONNECT_DELAY_CAP, 0.1 * 2 ** attempt))
@@ -0,0 +1,172 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from data_lake import get_last_file_partition, write_file_atomically
+
+# Hidden, so it's never mistaken by a partition file
+MANIFEST_FILE_NAME = '.partitions.json'
+
+# Partition numbers reserved by every write of a manifest. The ones not
+# handed out before a restart are skipped
+RESERVED_PARTITIONS = 16
+
+# Folders kept in memory. The least recently used ones (the closed hours)
+# are evicted, and read again from their manifest if they are written
+CACHED_FOLDERS = 256
+
+
+class PartitionAllocator:
+    """ Hand out the ``part-N`` numbers of every (book, hour) folder
+
+    A small manifest inside the folder has the last partition reserved,
+    ``RESERVED_PARTITIONS`` at a time, so a restarted process continues the
+    numbering without listing the files, and the manifest isn't written on
+    every allocation. The manifest is rebuilt from the directory when it's
+    missing. The numbers handed out and the last partition of each folder
+    are cached in memory.
+
+    :param cached_folders: folders kept in memory.
+        Default: ``CACHED_FOLDERS``
+    :type cached_folders: int
+    """
+
+    def __init__(self, cached_folders=CACHED_FOLDERS):
+        self.lock = threading.Lock()
+        self.cached_folders = cached_folders
+
+        # {folder: {file_name: last reserved partition}}, as persisted,
+        # least recently used first
+        self.manifests = OrderedDict()
+
+        # {folder: {file_name: partition}} of the next number to hand out,
+        # and of the last partition handed out or found in the folder
+        self.next_partitions = {}
+        self.last_partitions = {}
+
+    def load_manifest(self, folder):
+        """ Get the manifest of a folder: ``{file_name: last reserved}``
+
+        Call it with the lock acquired.
+
+        :param folder: hour folder of an order book.
+        :type folder: str
+        """
+        manifest = self.manifests.get(folder)
+
+        if manifest is not None:
+            self.manifests.move_to_end(folder)
+            return manifest
+
+        path_to_manifest = os.path.join(folder, MANIFEST_FILE_NAME)
+
+        try:
+            with open(path_to_manifest) as file:
+                manifest = json.load(file)
+        except (FileNotFoundError, ValueError):
+            manifest = {}
+
+        self.manifests[folder] = manifest
+        self.next_partitions[folder] = {
+            # Any reserved partition may have been handed out before
+            file_name: last_reserved + 1
+            for file_name, last_reserved in manifest.items()
+            if last_reserved is not None
+        }
+        self.last_partitions[folder] = {}
+
+        while len(self.manifests) > self.cached_folders:
+            evicted_folder, _ = self.manifests.popitem(last=False)
+            del self.next_partitions[evicted_folder]
+            del self.last_partitions[evicted_folder]
+
+        return manifest
+
+    def save_manifest(self, folder):
+        """ Persist the reserved partitions of a folder
+
+        :param folder: hour folder of an order book.
+        :type folder: str
+        """
+        path_to_manifest = os.path.join(folder, MANIFEST_FILE_NAME)
+
+        write_file_atomically(
+            path_to_manifest, json.dumps(self.manifests[folder])
+        )
+
+    def read_last_partition(self, folder, file_name):
+        """ Get the last partition, from the files if none was handed out
+        since the folder was loaded
+
+        Call it with the lock acquired.
+
+        :param folder: hour folder of an order book.
+        :type folder: str
+
+        :param file_name: file name prefix, see ``generate_file_name``.
+        :type file_name: str
+        """
+        self.load_manifest(folder)
+
+        last_partitions = self.last_partitions[folder]
+
+        # The reserved numbers may have no file: the last one is listed
+        if file_name not in last_partitions:
+            last_partitions[file_name] = get_last_file_partition(
+                folder, file_name
+            )
+
+        return last_partitions[file_name]
+
+    def last_partition(self, folder, file_name):
+        """ Get the last partition number, None if there is none
+
+        :param folder: hour folder of an order book.
+        :type folder: str
+
+        :param file_name: file name prefix, see ``generate_file_name``.
+        :type file_name: str
+        """
+        with self.lock:
+            return self.read_last_partition(folder, file_name)
+
+    def next_partition(self, folder, file_name):
+        """ Reserve and return the next partition number
+
+        The number is reserved in the manifest before returning it, so it's
+        never handed out twice, not even after a restart.
+
+        :param folder: hour folder of an order book. It must exist.
+        :type folder: str
+
+        :param file_name: file name prefix, see ``generate_file_name``.
+        :type file_name: str
+        """
+        with self.lock:
+            manifest = self.load_manifest(folder)
+            next_partitions = self.next_partitions[folder]
+
+            partition = next_partitions.get(file_name)
+
+            if partition is None:
+                # Without manifest: after the files of the folder
+                last_partition = self.read_last_partition(folder, file_name)
+                partition = (
+                    0 if last_partition is None else last_partition + 1
+                )
+
+            last_reserved = manifest.get(file_name)
+
+            if last_reserved is None or last_reserved < partition:
+                manifest[file_name] = partition + RESERVED_PARTITIONS - 1
+                self.save_manifest(folder)
+
+            next_partitions[file_name] = partition + 1
+            self.last_partitions[folder][file_name] = partition
+
+            return partition
+
+
+# Shared by all the writers of the process
+partition_allocator = PartitionAllocator()
@@ -0,0 +1,277 @@
+import os
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta, timezone
+
+from archive import get_archive_path, is_archive, read_archive, read_index
+from data_lake import (generate_file_name, generate_path_to_folder,
+                       list_partition_files)
+from file_formats import (FILE_FORMATS_BY_EXTENSION, SPREAD_COLUMNS,
+                          get_row_time)
+from zone_maps import may_have_rows, read_statistics
+
+# Rows per batch returned by read_spread_batches
+BATCH_SIZE = 600
+SpreadRow = namedtuple('SpreadRow', SPREAD_COLUMNS)
+
+
+def to_utc(timestamp):
+    """ Get a timestamp in UTC, the time zone of the Data Lake partitions
+
+    :param timestamp: naive timestamps are considered UTC.
+    :type timestamp: datetime
+    """
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+
+    return timestamp.astimezone(timezone.utc)
+
+
+def list_hour_folders(book, start, end, directory=None):
+    """ List the existing ``<date>/<hour>`` folders of a book in a range
+
+    Only the folders of the days and hours in the range are checked, the
+    rest of the Data Lake is never listed.
+
+    :param book: name of the order book.
+    :type book: str
+
+    :param start: start of the range (included).
+    :type start: datetime
+
+    :param end: end of the range (excluded).
+    :type end: datetime
+
+    :param directory: folder that contains the ``data_lake``.
+        Default: the current working directory
+    :type directory: str
+    """
+    start = to_utc(start)
+    end = to_utc(end)
+
+    day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    while day < end:
+        next_day = day + timedelta(days=1)
+
+        day_folder = os.path.dirname(
+            generate_path_to_folder(book, day, directory)
+        )
+
+        if os.path.isdir(day_folder):
+            hour = max(day, start.replace(minute=0, second=0, microsecond=0))
+
+            while hour < min(next_day, end):
+                folder = generate_path_to_folder(book, hour, directory)
+
+                if os.path.isdir(folder):
+                    yield hour, folder
+
+                hour = hour + timedelta(hours=1)
+
+        day = next_day
+
+
+def list_spread_files(books, start, end, directory=None):
+    """ List the spread files of the books in a range, by book, hour and part
+
+    The files are in the hour (and day) of the ticks of their rows.
+
+    :param books: names of the order books. Examples: ``btc_mxn`` or
+        ``['usd_mxn', 'btc_mxn']``
+    :type books: str or list
+
+    :param start: start of the range (included).
+    :type start: datetime
+
+    :param end: end of the range (excluded).
+    :type end: datetime
+
+    :param directory: folder that contains the ``data_lake``.
+        Default: the current working directory
+    :type directory: str
+    """
+    if isinstance(books, str):
+        books = [books]
+
+    start = to_utc(start)
+    end = to_utc(end)
+
+    for book in books:
+        day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+
+        while day < end:
+            next_day = day + timedelta(days=1)
+
+            # An archived day is a single file, see ``archive.py``
+            path_to_archive = get_archive_path(book, day, directory)
+
+            if read_index(path_to_archive) is not None:
+                yield path_to_archive
+
+                day = next_day
+                continue
+
+            for hour, folder in list_hour_folders(
+                book, max(day, start), min(next_day, end), directory
+            ):
+                file_name = generate_file_name(
+                    hour, f'bid_ask_spread-{book}-'
+                )
+
+                for _, path_to_file in list_partition_files(
+                    folder, file_name
+                ):
+                    yield path_to_file
+
+            day = next_day
+
+
+def read_spread_file(path_to_file, start, end,
+                     min_spread=None, max_spread=None):
+    """ Read the rows of a spread file that match the filters
+
+    The rows are filtered by their tick time, the partition of their file.
+    Files whose statistics (see ``zone_maps.py``) show that no row matches
+    are not opened. Of an archived day, only the blocks that may have rows
+    that match are decompressed.
+
+    :param path_to_file: path of the file.
+    :type path_to_file: str
+
+    :param start: start of the range (included).
+    :type start: datetime
+
+    :param end: end of the range (excluded).
+    :type end: datetime
+
+    :param min_spread: keep the rows with a spread bigger or equal.
+    :type min_spread: float
+
+    :param max_spread: keep the rows with a spread lower or equal.
+    :type max_spread: float
+    """
+    start = to_utc(start)
+    end = to_utc(end)
+
+    # Skip the file if its statistics show no row can match
+    statistics = read_statistics(path_to_file)
+
+    if not may_have_rows(statistics, start, end, min_spread, max_spread):
+        return []
+
+    if is_archive(path_to_file):
+        # Only the blocks that may match are decompressed
+        rows = read_archive(
+            path_to_file, start, end, min_spread, max_spread
+        )
+    else:
+        extension = os.path.splitext(path_to_file)[1]
+        rows = FILE_FORMATS_BY_EXTENSION[extension].read(path_to_file)
+
+    return [
+        SpreadRow(*row) for row in rows
+        if start <= get_row_time(row) < end and
+        (min_spread is None or row[4] >= min_spread) and
+        (max_spread is None or row[4] <= max_spread)
+    ]
+
+
+def map_in_order(function, items, workers):
+    """ Apply a function to the items in a thread pool, yielding in order
+
+    At most ``2 * workers`` results are kept in memory at the same time.
+
+    :param function: function to apply.
+    :type function: callable
+
+    :param items: items to process.
+    :type items: iterable
+
+    :param workers: number of threads.
+    :type workers: int
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+
+        for item in items:
+            pending.append(executor.submit(function, item))
+
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def read_spread_batches(books, start, end, min_spread=None, max_spread=None,
+                        directory=None, workers=None, batch_size=BATCH_SIZE):
+    """ Read lazily the spread rows of the books in a range, in batches
+
+    Only the files of the requested books, days and hours are opened. The
+    range is of the tick times of the rows, the order book timestamps of
+    the rows saved without them.
+
+    :param books: names of the order books. Examples: ``btc_mxn`` or
+        ``['usd_mxn', 'btc_mxn']``
+    :type books: str or list
+
+    :param start: start of the range (included).
+    :type start: datetime
+
+    :param end: end of the range (excluded).
+    :type end: datetime
+
+    :param min_spread: keep the rows with a spread bigger or equal.
+    :type min_spread: float
+
+    :param max_spread: keep the rows with a spread lower or equal.
+    :type max_spread: float
+
+    :param directory: folder that contains the ``data_lake``.
+        Default: the current working directory
+    :type directory: str
+
+    :param workers: read the files in parallel with these threads.
+        Default: None, read one file after the other
+    :type workers: int
+
+    :param batch_size: maximum rows per batch.
+        Default: ``BATCH_SIZE``
+    :type batch_size: int
+    """
+    files = list_spread_files(books, start, end, directory)
+
+    def read(path_to_file):
+        return read_spread_file(
+            path_to_file, start, end, min_spread, max_spread
+        )
+
+    if workers:
+        files_rows = map_in_order(read, files, workers)
+    else:
+        files_rows = map(read, files)
+
+    batch = []
+
+    for rows in files_rows:
+        batch.extend(rows)
+
+        while len(batch) >= batch_size:
+            yield batch[:batch_size]
+            batch = batch[batch_size:]
+
+    if batch:
+        yield batch
+
+
+def read_spread_rows(books, start, end, min_spread=None, max_spread=None,
+                     directory=None, workers=None):
+    """ Read lazily the spread rows of the books in a range, one by one
+
+    See ``read_spread_batches`` for the parameters.
+    """
+    for batch in read_spread_batches(
+        books, start, end, min_spread, max_spread, directory, workers
+    ):
+        yield from batch
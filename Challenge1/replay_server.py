@@ -0,0 +1,545 @@
+""" Local stand-in of the Bitso ``order_book`` endpoint
+
+Serves recorded or synthetic order books with configurable depth, update
+rate, latency and errors, so the collector can be tested without network.
+With ``--diffs`` it also streams the ``diff-orders`` of the books over a
+WebSocket, as ``wss://ws.bitso.com`` does.
+
+Usage:
+    python replay_server.py --port 8080 --depth 500 --latency-ms 20
+    BASE_URL=http://localhost:8080 python Challenge1.py
+
+    python replay_server.py --port 8080 --diffs --drop-rate 0.01
+    BASE_URL=http://localhost:8080 WS_URL=ws://localhost:8080/ \
+        INGESTION=stream python Challenge1.py
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import time
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+from order_book_stream import BUY, DIFF_ORDERS, OPEN, SELL, LocalOrderBook
+
+API_PATH = '/api/v3/order_book/'
+WS_PATH = '/'
+
+
+def build_order_book(book, mid_price, depth, sequence, tick_size=0.01):
+    """ Build a raw order book response, sorted like the API one
+
+    :param book: name of the order book.
+    :type book: str
+
+    :param mid_price: price between the best bid and the best ask.
+    :type mid_price: float
+
+    :param depth: orders per side.
+    :type depth: int
+
+    :param sequence: sequence of the order book.
+    :type sequence: int
+
+    :param tick_size: price step between two levels.
+        Default: 0.01
+    :type tick_size: float
+    """
+    def orders(direction):
+        return ','.join(
+            f'{{"book":"{book}",'
+            f'"price":"{mid_price + direction * tick_size * level:.2f}",'
+            f'"amount":"{random.uniform(0.001, 2):.8f}"}}'
+            for level in range(1, depth + 1)
+        )
+
+    updated_at = datetime.now(timezone.utc).replace(microsecond=0)
+
+    return (
+        f'{{"success":true,"payload":{{'
+        f'"asks":[{orders(1)}],"bids":[{orders(-1)}],'
+        f'"updated_at":"{updated_at.isoformat()}",'
+        f'"sequence":"{sequence}"}}}}'
+    ).encode()
+
+
+class SyntheticOrderBooks:
+    """ Order books with a random walk price, created on demand
+
+    :param depth: orders per side.
+    :type depth: int
+
+    :param updates_per_second: times per second every book changes.
+    :type updates_per_second: float
+    """
+
+    def __init__(self, depth=100, updates_per_second=1.0):
+        self.depth = depth
+        self.update_interval = 1 / updates_per_second
+        self.books = {}
+
+    def get(self, book):
+        """ Get the current raw response of a book
+
+        :param book: name of the order book.
+        :type book: str
+        """
+        now = time.monotonic()
+        state = self.books.get(book)
+
+        if state is None:
+            state = {'mid_price': random.uniform(10, 1e6), 'sequence': 0,
+                     'updated': None}
+
+        if state['updated'] is None or \
+                now - state['updated'] >= self.update_interval:
+            mid_price = state['mid_price'] * (1 + random.gauss(0, 0.0001))
+            sequence = state['sequence'] + 1
+
+            state = {
+                'mid_price': mid_price,
+                'sequence': sequence,
+                'updated': now,
+                'content': build_order_book(
+                    book, mid_price, self.depth, sequence
+                ),
+            }
+            self.books[book] = state
+
+        return state['content']
+
+
+class RecordedOrderBooks:
+    """ Order books recorded from the API, replayed in a loop
+
+    Every book is a ``<book>.jsonl`` file in the folder, one raw response
+    per line. Example to record one: ``curl -s
+    'https://sandbox.bitso.com/api/v3/order_book/?book=btc_mxn' >>
+    recordings/btc_mxn.jsonl``
+
+    :param folder: folder with the recordings.
+    :type folder: str
+
+    :param updates_per_second: recorded responses replayed per second.
+    :type updates_per_second: float
+    """
+
+    def __init__(self, folder, updates_per_second=1.0):
+        self.updates_per_second = updates_per_second
+        self.started = time.monotonic()
+        self.books = {}
+
+        for file_name in os.listdir(folder):
+            book, extension = os.path.splitext(file_name)
+
+            if extension == '.jsonl':
+                with open(os.path.join(folder, file_name), 'rb') as file:
+                    self.books[book] = [
+                        line.strip() for line in file if line.strip()
+                    ]
+
+    def get(self, book):
+        """ Get the current raw response of a book, None if not recorded
+
+        :param book: name of the order book.
+        :type book: str
+        """
+        responses = self.books.get(book)
+
+        if not responses:
+            return None
+
+        updates = int((time.monotonic() - self.started) *
+                      self.updates_per_second)
+
+        return responses[updates % len(responses)]
+
+
+class DiffOrderBooks:
+    """ Order books that change one order at a time, with their diffs
+
+    Every update is a ``diff-orders`` message applied to a local copy of
+    the book, so the snapshots (``aggregate=false``) and the aggregated
+    responses always match the stream. The books are synthetic (orders
+    added, cancelled and partially filled around a mid price) or
+    replayed from a folder with a ``<book>.snapshot.json`` (response with
+    ``aggregate=false``) and a ``<book>.diffs.jsonl`` (a message per line)
+    for every book.
+
+    :param depth: orders per side of the synthetic books.
+    :type depth: int
+
+    :param recordings: folder with the recordings.
+        Default: synthetic books
+    :type recordings: str
+    """
+
+    def __init__(self, depth=100, recordings=None):
+        self.depth = depth
+        self.recorded = bool(recordings)
+        self.books = {}
+
+        if recordings:
+            for file_name in os.listdir(recordings):
+                if file_name.endswith('.snapshot.json'):
+                    self.load_recording(
+                        recordings, file_name[:-len('.snapshot.json')]
+                    )
+
+    def load_recording(self, folder, book):
+        with open(os.path.join(folder, f'{book}.snapshot.json')) as file:
+            payload = json.load(file)['payload']
+
+        with open(os.path.join(folder, f'{book}.diffs.jsonl')) as file:
+            diffs = [json.loads(line) for line in file if line.strip()]
+
+        order_book = LocalOrderBook(book)
+        order_book.load_snapshot(payload)
+
+        self.books[book] = {'order_book': order_book, 'diffs': iter(diffs)}
+
+    def create_book(self, book):
+        mid_price = random.uniform(10, 1e6)
+        tick_size = max(0.01, mid_price / 100_000)
+
+        order_book = LocalOrderBook(book)
+        order_book.load_snapshot({
+            'bids': [], 'asks': [], 'sequence': 0,
+            'updated_at': datetime.now(timezone.utc).isoformat(),
+        })
+
+        state = {
+            'order_book': order_book,
+            'diffs': None,
+            'mid_price': mid_price,
+            'tick_size': tick_size,
+            'oids': itertools.count(),
+        }
+        self.books[book] = state
+
+        for level in range(1, self.depth + 1):
+            for side, direction in ((BUY, -1), (SELL, 1)):
+                price = mid_price + direction * tick_size * level
+
+                self.apply_order(book, state, side, price)
+
+        return state
+
+    def get_state(self, book):
+        state = self.books.get(book)
+
+        if state is None and not self.recorded:
+            state = self.create_book(book)
+
+        return state
+
+    def apply_order(self, book, state, side, price, oid=None, amount=None,
+                    status=OPEN):
+        """ Create the message of a change of an order and apply it """
+        order_book = state['order_book']
+
+        if oid is None:
+            oid = f'{book}-{next(state["oids"])}'
+
+        diff = {
+            'd': int(time.time() * 1000),
+            'r': f'{price:.2f}',
+            't': side,
+            'o': oid,
+            's': status,
+        }
+
+        if status == OPEN:
+            if amount is None:
+                amount = random.uniform(0.001, 2)
+
+            diff['a'] = f'{amount:.8f}'
+            diff['v'] = f'{amount * price:.2f}'
+
+        message = {
+            'type': DIFF_ORDERS,
+            'book': book,
+            'sequence': order_book.sequence + 1,
+            'payload': [diff],
+        }
+
+        order_book.apply(message)
+
+        return message
+
+    def next_message(self, book):
+        """ Change the book and get the message of the change, None if the
+        recording is over
+
+        :param book: name of the order book.
+        :type book: str
+        """
+        state = self.get_state(book)
+
+        if state is None:
+            return None
+
+        if state['diffs'] is not None:
+            for message in state['diffs']:
+                if state['order_book'].apply(message):
+                    return message
+
+            return None
+
+        order_book = state['order_book']
+        action = random.random()
+
+        if action < 0.4 or len(order_book.orders) < 2 * self.depth:
+            # New order close to the mid price
+            side = random.choice((BUY, SELL))
+            direction = -1 if side == BUY else 1
+            price = state['mid_price'] + direction * state['tick_size'] * \
+                random.randint(1, self.depth)
+
+            return self.apply_order(book, state, side, price)
+
+        oid = random.choice(list(order_book.orders))
+        side, price, amount = order_book.orders[oid]
+
+        if action < 0.7:
+            # Partial fill
+            return self.apply_order(
+                book, state, side, price, oid, amount * random.uniform(0.1, 1)
+            )
+
+        status = 'cancelled' if action < 0.9 else 'completed'
+
+        return self.apply_order(book, state, side, price, oid, status=status)
+
+    def get(self, book):
+        """ Get the current aggregated response of a book, None if unknown
+
+        :param book: name of the order book.
+        :type book: str
+        """
+        state = self.get_state(book)
+
+        if state is None:
+            return None
+
+        order_book = state['order_book']
+        payload = order_book.to_payload()
+
+        for side, levels, descending in (('bids', order_book.bids, True),
+                                         ('asks', order_book.asks, False)):
+            prices, amounts = levels.top(len(levels), descending)
+
+            payload[side] = [
+                {'book': book, 'price': str(price), 'amount': str(amount)}
+                for price, amount in zip(prices.tolist(), amounts.tolist())
+            ]
+
+        return json.dumps({'success': True, 'payload': payload}).encode()
+
+    def get_orders(self, book):
+        """ Get the current response with ``aggregate=false`` of a book,
+        None if unknown
+
+        :param book: name of the order book.
+        :type book: str
+        """
+        state = self.get_state(book)
+
+        if state is None:
+            return None
+
+        return json.dumps(
+            {'success': True, 'payload': state['order_book'].to_payload()}
+        ).encode()
+
+
+async def publish_diffs(order_books, subscribers, updates_per_second,
+                        drop_rate=0.0):
+    """ Change the books and send the diffs to their subscribers, forever
+
+    :param order_books: books that change.
+    :type order_books: DiffOrderBooks
+
+    :param subscribers: WebSocket responses subscribed to every book.
+    :type subscribers: dict
+
+    :param updates_per_second: diffs per second of every book.
+    :type updates_per_second: float
+
+    :param drop_rate: fraction of the diffs not sent, to test the gaps.
+    :type drop_rate: float
+    """
+    interval = 1 / updates_per_second
+    started = time.monotonic()
+    update = 0
+
+    while True:
+        update = update + 1
+        await asyncio.sleep(
+            max(0, started + update * interval - time.monotonic())
+        )
+
+        for book in list(subscribers):
+            message = order_books.next_message(book)
+
+            if message is None:
+                continue
+
+            data = json.dumps(message)
+
+            for websocket in list(subscribers[book]):
+                if random.random() < drop_rate:
+                    continue
+
+                try:
+                    await websocket.send_str(data)
+                except ConnectionError:
+                    subscribers[book].discard(websocket)
+
+
+def create_app(order_books, latency=0.0, jitter=0.0, error_rate=0.0,
+               updates_per_second=1.0, drop_rate=0.0):
+    """ Create the web application of the stand-in API
+
+    :param order_books: ``SyntheticOrderBooks``, ``RecordedOrderBooks`` or
+        ``DiffOrderBooks`` (also streamed at ``WS_PATH``).
+    :type order_books: object
+
+    :param latency: seconds added to every response.
+    :type latency: float
+
+    :param jitter: random seconds (up to) added to the latency.
+    :type jitter: float
+
+    :param error_rate: fraction of the requests answered with a 503.
+    :type error_rate: float
+
+    :param updates_per_second: diffs per second of every streamed book.
+    :type updates_per_second: float
+
+    :param drop_rate: fraction of the streamed diffs not sent.
+    :type drop_rate: float
+    """
+    streams_diffs = isinstance(order_books, DiffOrderBooks)
+
+    # book: {WebSocket responses}
+    subscribers = {}
+
+    async def order_book(request):
+        await asyncio.sleep(latency + random.uniform(0, jitter))
+
+        if random.random() < error_rate:
+            return web.Response(status=503)
+
+        book = request.query.get('book', 'usd_mxn')
+
+        if streams_diffs and request.query.get('aggregate') == 'false':
+            content = order_books.get_orders(book)
+        else:
+            content = order_books.get(book)
+
+        if content is None:
+            return web.Response(
+                status=400,
+                body=json.dumps({'success': False}),
+                content_type='application/json'
+            )
+
+        return web.Response(body=content, content_type='application/json')
+
+    async def stream(request):
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+
+        async for ws_message in websocket:
+            message = json.loads(ws_message.data)
+
+            if message.get('action') != 'subscribe' or \
+                    message.get('type') != DIFF_ORDERS:
+                continue
+
+            # Create the book before the first diff
+            order_books.get(message['book'])
+            subscribers.setdefault(message['book'], set()).add(websocket)
+
+            await websocket.send_json({
+                'action': 'subscribe', 'response': 'ok',
+                'time': int(time.time() * 1000), 'type': DIFF_ORDERS,
+            })
+
+        for book_subscribers in subscribers.values():
+            book_subscribers.discard(websocket)
+
+        return websocket
+
+    async def publisher(app):
+        task = asyncio.create_task(publish_diffs(
+            order_books, subscribers, updates_per_second, drop_rate
+        ))
+
+        yield
+
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    app = web.Application()
+    app.router.add_get(API_PATH, order_book)
+    app.router.add_get(API_PATH.rstrip('/'), order_book)
+
+    if streams_diffs:
+        app.router.add_get(WS_PATH, stream)
+        app.cleanup_ctx.append(publisher)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--depth', type=int, default=100,
+                        help='orders per side of the synthetic books')
+    parser.add_argument('--updates-per-second', type=float, default=1.0,
+                        help='times per second every book changes')
+    parser.add_argument('--recordings',
+                        help='folder with <book>.jsonl recordings, '
+                             'replayed instead of synthetic books')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--diffs', action='store_true',
+                        help='stream the diff-orders of the books over a '
+                             'WebSocket at ' + WS_PATH)
+    parser.add_argument('--drop-rate', type=float, default=0.0,
+                        help='fraction of the diffs not sent')
+    args = parser.parse_args()
+
+    if args.diffs:
+        order_books = DiffOrderBooks(args.depth, args.recordings)
+    elif args.recordings:
+        order_books = RecordedOrderBooks(
+            args.recordings, args.updates_per_second
+        )
+    else:
+        order_books = SyntheticOrderBooks(
+            args.depth, args.updates_per_second
+        )
+
+    app = create_app(
+        order_books,
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        error_rate=args.error_rate,
+        updates_per_second=args.updates_per_second,
+        drop_rate=args.drop_rate
+    )
+
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,507 @@
+import csv
+import itertools
+import math
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from data_lake import generate_file_name
+from partitions import partition_allocator
+from storage import save_file
+
+# Length of the rollups of every tier
+ROLLUP_INTERVALS = {
+    '1m': timedelta(minutes=1),
+    '10m': timedelta(minutes=10),
+    '1h': timedelta(hours=1),
+}
+
+# Rollups saved in the same file: an hour of 1m, a day of 10m and 1h. The
+# file of a period is saved again every time one of its rollups is closed
+ROLLUP_FILE_PERIODS = {
+    '1m': timedelta(hours=1),
+    '10m': timedelta(days=1),
+    '1h': timedelta(days=1),
+}
+
+# Relative error of the p50 and p99 of the sketch
+SKETCH_ACCURACY = 0.01
+
+# Spreads closer to zero are counted as zero by the sketch
+SKETCH_MIN_VALUE = 1e-12
+
+ROLLUP_HEADERS = [
+    'timestamp', 'book', 'interval', 'count', 'mean', 'min', 'max', 'last',
+    'p50', 'p99',
+]
+
+Rollup = namedtuple('Rollup', ROLLUP_HEADERS)
+
+
+def generate_path_to_rollup_folder(book, interval, timestamp, directory=None):
+    """ Generate the folder of the rollups of a book, tier and day
+
+    :param book: name of the order book.
+    :type book: str
+
+    :param interval: rollup tier, a key of ``ROLLUP_INTERVALS``.
+    :type interval: str
+
+    :param timestamp: value for the folder structure.
+    :type timestamp: datetime
+
+    :param directory: folder that contains the ``data_lake``.
+        Default: the current working directory
+    :type directory: str
+    """
+    if directory is None:
+        directory = os.getcwd()
+
+    return os.path.join(
+        directory,
+        'data_lake',
+        'markets',
+        book,
+        'bid_ask_spread_rollup',
+        interval,
+        timestamp.strftime('%Y%m%d')
+    )
+
+
+def floor_timestamp(timestamp, interval):
+    """ Get the start of the interval that contains a timestamp, in UTC
+
+    :param timestamp: aware timestamp.
+    :type timestamp: datetime
+
+    :param interval: length of the intervals, aligned to the epoch.
+    :type interval: timedelta
+    """
+    seconds = timestamp.timestamp()
+    length = interval.total_seconds()
+
+    return datetime.fromtimestamp(seconds - seconds % length, timezone.utc)
+
+
+class SpreadSketch:
+    """ Streaming quantiles with a bounded relative error
+
+    Every value is counted in a logarithmic bucket (as in DDSketch), so an
+    update is a dictionary increment and the memory grows with the range of
+    the values, not with their number.
+
+    :param relative_accuracy: relative error of the quantiles.
+        Default: ``SKETCH_ACCURACY``
+    :type relative_accuracy: float
+    """
+
+    def __init__(self, relative_accuracy=SKETCH_ACCURACY):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positives = {}
+        self.negatives = {}
+        self.zeros = 0
+        self.count = 0
+
+    def bucket(self, value):
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def value(self, bucket):
+        return 2 * self.gamma ** bucket / (self.gamma + 1)
+
+    def add(self, value):
+        """ Count a value
+
+        :param value: spread in percent.
+        :type value: float
+        """
+        self.count = self.count + 1
+
+        if value > SKETCH_MIN_VALUE:
+            bucket = self.bucket(value)
+            self.positives[bucket] = self.positives.get(bucket, 0) + 1
+        elif value < -SKETCH_MIN_VALUE:
+            bucket = self.bucket(-value)
+            self.negatives[bucket] = self.negatives.get(bucket, 0) + 1
+        else:
+            self.zeros = self.zeros + 1
+
+    def quantile(self, quantile):
+        """ Get the approximate value of a quantile, None if empty
+
+        :param quantile: from 0 to 1. Example: 0.99
+        :type quantile: float
+        """
+        if not self.count:
+            return None
+
+        rank = quantile * (self.count - 1)
+        seen = 0
+
+        # From the lowest value: the biggest negative buckets first
+        for bucket in sorted(self.negatives, reverse=True):
+            seen = seen + self.negatives[bucket]
+
+            if seen > rank:
+                return -self.value(bucket)
+
+        seen = seen + self.zeros
+
+        if seen > rank:
+            return 0.0
+
+        for bucket in sorted(self.positives):
+            seen = seen + self.positives[bucket]
+
+            if seen > rank:
+                return self.value(bucket)
+
+        return self.value(max(self.positives))
+
+
+class SpreadAggregate:
+    """ Aggregates of the spread of a book during an interval
+
+    :param start: start of the interval.
+    :type start: datetime
+    """
+
+    def __init__(self, start):
+        self.start = start
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.last = None
+        self.sketch = SpreadSketch()
+
+    def add(self, spread):
+        """ Add an observation, in constant time
+
+        :param spread: bid-ask spread in percent.
+        :type spread: float
+        """
+        self.count = self.count + 1
+        self.total = self.total + spread
+        self.minimum = min(self.minimum, spread)
+        self.maximum = max(self.maximum, spread)
+        self.last = spread
+        self.sketch.add(spread)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def to_row(self, book, interval):
+        """ Get the rollup as a row of ``ROLLUP_HEADERS``
+
+        :param book: name of the order book.
+        :type book: str
+
+        :param interval: rollup tier, a key of ``ROLLUP_INTERVALS``.
+        :type interval: str
+        """
+        return [
+            str(self.start), book, interval, self.count, self.mean,
+            self.minimum, self.maximum, self.last,
+            self.sketch.quantile(0.5), self.sketch.quantile(0.99),
+        ]
+
+
+class RollupFile:
+    """ Closed rollups of a book and tier that are saved in one file
+
+    The file is rewritten (atomically) with all the rollups every time it's
+    flushed, so the rollups of the period in progress are in the Data Lake
+    as soon as they are closed.
+
+    :param book: name of the order book.
+    :type book: str
+
+    :param interval: rollup tier, a key of ``ROLLUP_INTERVALS``.
+    :type interval: str
+
+    :param period: start of the period of the file.
+    :type period: datetime
+    """
+
+    def __init__(self, book, interval, period):
+        self.book = book
+        self.interval = interval
+        self.period = period
+        self.rows = []
+        self.path_to_file = None
+
+        # The flushes run in threads while rollups are added
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get_path(self):
+        """ Get the path of the file, a new partition on the first call """
+        if self.path_to_file is None:
+            path_to_folder = generate_path_to_rollup_folder(
+                self.book, self.interval, self.period
+            )
+
+            os.makedirs(path_to_folder, exist_ok=True)
+
+            file_name = generate_file_name(
+                self.period,
+                f'bid_ask_spread_rollup-{self.book}-{self.interval}-'
+            )
+
+            file_partition = partition_allocator.next_partition(
+                path_to_folder, file_name
+            )
+
+            self.path_to_file = os.path.join(
+                path_to_folder, file_name + str(file_partition) + '.csv'
+            )
+
+        return self.path_to_file
+
+    def flush(self):
+        """ Save the rollups closed so far to the file in the Data Lake """
+        # The last flush to take the lock has the most rows
+        with self.lock:
+            rows = list(self.rows)
+            path_to_file = self.get_path()
+
+            lines = [','.join(ROLLUP_HEADERS)] + [
+                ','.join('' if value is None else str(value) for value in row)
+                for row in rows
+            ]
+
+            save_file(path_to_file, '\n'.join(lines) + '\n')
+
+        print(
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            f'- Saved {len(rows)} {self.book} {self.interval} rollups. File:',
+            os.path.basename(path_to_file))
+
+        return path_to_file
+
+
+class RollupWriter:
+    """ Keep rolling aggregates of every book and tier, and their files
+
+    Each observation updates the aggregate in progress of every tier. When
+    an observation falls in a new interval, the previous aggregate is
+    closed and kept in the file of its period, which is saved again.
+
+    :param intervals: rollup tiers, keys of ``ROLLUP_INTERVALS``.
+        Default: all of them
+    :type intervals: list
+    """
+
+    def __init__(self, intervals=tuple(ROLLUP_INTERVALS)):
+        self.intervals = list(intervals)
+        self.aggregates = {}
+        self.files = {}
+
+    def current(self, book, interval):
+        """ Get the aggregate in progress of a book and tier, or None
+
+        :param book: name of the order book.
+        :type book: str
+
+        :param interval: rollup tier, a key of ``ROLLUP_INTERVALS``.
+        :type interval: str
+        """
+        return self.aggregates.get((book, interval))
+
+    def close(self, book, interval):
+        """ Move the aggregate in progress to its file. Return the files to
+        save: the one of the aggregate, after the previous one if its
+        period is over
+
+        :param book: name of the order book.
+        :type book: str
+
+        :param interval: rollup tier, a key of ``ROLLUP_INTERVALS``.
+        :type interval: str
+        """
+        key = (book, interval)
+        aggregate = self.aggregates.pop(key)
+
+        period = floor_timestamp(
+            aggregate.start, ROLLUP_FILE_PERIODS[interval]
+        )
+
+        rollup_file = self.files.get(key)
+        closed_file = None
+
+        if rollup_file is not None and rollup_file.period != period:
+            closed_file = self.files.pop(key)
+            rollup_file = None
+
+        if rollup_file is None:
+            rollup_file = RollupFile(book, interval, period)
+            self.files[key] = rollup_file
+
+        rollup_file.rows.append(aggregate.to_row(book, interval))
+
+        if closed_file is not None:
+            return [closed_file, rollup_file]
+
+        return [rollup_file]
+
+    def add(self, book, timestamp, spread):
+        """ Add an observation. Return the files with new rollups, closed by
+        it
+
+        The caller is in charge of the ``flush``.
+
+        :param book: name of the order book.
+        :type book: str
+
+        :param timestamp: order book timestamp, aware.
+        :type timestamp: datetime
+
+        :param spread: bid-ask spread in percent.
+        :type spread: float
+        """
+        rollup_files = []
+
+        for interval in self.intervals:
+            key = (book, interval)
+            aggregate = self.aggregates.get(key)
+
+            # Late observations stay in the interval in progress
+            if aggregate is None or \
+                    timestamp >= aggregate.start + ROLLUP_INTERVALS[interval]:
+                if aggregate is not None:
+                    rollup_files.extend(self.close(book, interval))
+
+                aggregate = SpreadAggregate(
+                    floor_timestamp(timestamp, ROLLUP_INTERVALS[interval])
+                )
+                self.aggregates[key] = aggregate
+
+            aggregate.add(spread)
+
+        return rollup_files
+
+    def pop_all(self):
+        """ Close every aggregate and detach all the files, for example at
+        exit """
+        for book, interval in list(self.aggregates):
+            self.close(book, interval)
+
+        rollup_files = [
+            rollup_file for rollup_file in self.files.values()
+            if len(rollup_file)
+        ]
+
+        self.files = {}
+
+        return rollup_files
+
+
+def read_rollup_file(path_to_file):
+    """ Read the rollups of a file as ``Rollup`` tuples
+
+    :param path_to_file: path of the file.
+    :type path_to_file: str
+    """
+    def to_float(value):
+        return float(value) if value else None
+
+    with open(path_to_file, newline='') as file:
+        return [
+            Rollup(
+                datetime.fromisoformat(row['timestamp']), row['book'],
+                row['interval'], int(row['count']), to_float(row['mean']),
+                to_float(row['min']), to_float(row['max']),
+                to_float(row['last']), to_float(row['p50']),
+                to_float(row['p99'])
+            )
+            for row in csv.DictReader(file)
+        ]
+
+
+def merge_rollups(rollups):
+    """ Merge the rollups of the same interval in one
+
+    A collector stopped in the middle of an interval saves what it has of
+    it, and the next run saves the rest in a new file. The count, mean,
+    min and max of the merge are exact, and ``last`` is the one of the
+    later file. The quantiles are approximated from the ones of the
+    parts: the p50 is their mean weighted by count, and the p99 is the
+    biggest one, an upper bound.
+
+    :param rollups: rollups of the same interval, in the order of their
+        files.
+    :type rollups: list
+    """
+    if len(rollups) == 1:
+        return rollups[0]
+
+    # An interval is saved once it has an observation: no part is empty
+    count = sum(rollup.count for rollup in rollups)
+
+    return rollups[-1]._replace(
+        count=count,
+        mean=sum(rollup.mean * rollup.count for rollup in rollups) / count,
+        min=min(rollup.min for rollup in rollups),
+        max=max(rollup.max for rollup in rollups),
+        p50=sum(rollup.p50 * rollup.count for rollup in rollups) / count,
+        p99=max(rollup.p99 for rollup in rollups),
+    )
+
+
+def read_rollups(book, interval, start, end, directory=None):
+    """ Read the rollups of a book and tier in a range, sorted by timestamp
+
+    Only the folders of the days in the range are opened. The rollups of
+    an interval saved by two runs of the collector are merged, see
+    ``merge_rollups``.
+
+    :param book: name of the order book.
+    :type book: str
+
+    :param interval: rollup tier, a key of ``ROLLUP_INTERVALS``.
+    :type interval: str
+
+    :param start: start of the range (included), aware.
+    :type start: datetime
+
+    :param end: end of the range (excluded), aware.
+    :type end: datetime
+
+    :param directory: folder that contains the ``data_lake``.
+        Default: the current working directory
+    :type directory: str
+    """
+    day = floor_timestamp(start, timedelta(days=1))
+
+    while day < end:
+        folder = generate_path_to_rollup_folder(book, interval, day, directory)
+        rollups = []
+
+        if os.path.isdir(folder):
+            for entry in os.scandir(folder):
+                if entry.name.endswith('.csv') and \
+                        not entry.name.startswith('.'):
+                    partition = int(
+                        os.path.splitext(entry.name)[0].split('part-').pop()
+                    )
+
+                    rollups.extend(
+                        (rollup.timestamp, partition, rollup)
+                        for rollup in read_rollup_file(entry.path)
+                    )
+
+        # The parts of an interval in the order of their files
+        rollups.sort(key=lambda item: item[:2])
+
+        for timestamp, parts in itertools.groupby(
+            rollups, key=lambda item: item[0]
+        ):
+            if start <= timestamp < end:
+                yield merge_rollups([rollup for _, _, rollup in parts])
+
+        day = day + timedelta(days=1)
@@ -0,0 +1,102 @@
+import asyncio
+import math
+import time
+from datetime import datetime, timezone
+
+# Seconds between two observations of a book
+TICK_INTERVAL = 1.0
+
+
+class TickScheduler:
+    """ Ticks on the whole seconds (or intervals) of the wall clock
+
+    The wall clock is read once, to align the ticks. Then the ticks are
+    scheduled on the monotonic clock, at absolute times: the work done in a
+    tick never delays the next ones, so the rate doesn't drift. Tick ``N``
+    is due at ``origin + N * interval``.
+
+    :param interval: seconds between two ticks.
+        Default: ``TICK_INTERVAL``
+    :type interval: float
+    """
+
+    def __init__(self, interval=TICK_INTERVAL):
+        self.interval = interval
+
+        wall_time = time.time()
+        monotonic_time = time.monotonic()
+
+        # Tick 0 is the next whole interval of the wall clock
+        self.origin_wall_time = math.ceil(wall_time / interval) * interval
+        self.origin = monotonic_time + (self.origin_wall_time - wall_time)
+
+    def tick_time(self, tick):
+        """ Get the wall clock time of a tick, as an UTC datetime
+
+        :param tick: number of the tick.
+        :type tick: int
+        """
+        return datetime.fromtimestamp(
+            self.origin_wall_time + tick * self.interval, timezone.utc
+        )
+
+    def due_time(self, tick):
+        """ Get the monotonic time when a tick is due
+
+        :param tick: number of the tick.
+        :type tick: int
+        """
+        return self.origin + tick * self.interval
+
+    def current_tick(self):
+        """ Get the last tick that is already due (-1 before tick 0) """
+        return math.floor((time.monotonic() - self.origin) / self.interval)
+
+    def first_tick(self, alignment=None):
+        """ Get the first tick not due yet, on a multiple of ``alignment``
+
+        :param alignment: seconds of wall clock the tick must be a multiple
+            of. Example: 600 to start on a 10 minute boundary.
+            Default: any tick
+        :type alignment: float
+        """
+        tick = self.current_tick() + 1
+
+        if alignment:
+            wall_time = self.origin_wall_time + tick * self.interval
+            aligned = math.ceil(wall_time / alignment) * alignment
+
+            tick = tick + round((aligned - wall_time) / self.interval)
+
+        return tick
+
+    def next_tick(self, tick):
+        """ Get the tick after ``tick`` and the ticks already missed between
+
+        If the tick after ``tick`` is over (its interval has passed), it
+        can't be observed anymore: the next one is the tick in progress,
+        and the skipped ones are returned to record them as gaps.
+
+        :param tick: last tick that was handled.
+        :type tick: int
+        """
+        next_tick = max(tick + 1, self.current_tick())
+
+        return next_tick, list(range(tick + 1, next_tick))
+
+    async def wait(self, tick):
+        """ Sleep until a tick is due
+
+        :param tick: number of the tick.
+        :type tick: int
+        """
+        # The event loop clock is monotonic too
+        await asyncio.sleep(max(0, self.due_time(tick) - time.monotonic()))
+
+    def wait_sync(self, tick):
+        """ Block until a tick is due
+
+        :param tick: number of the tick.
+        :type tick: int
+        """
+        time.sleep(max(0, self.due_time(tick) - time.monotonic()))
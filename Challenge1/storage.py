@@ -0,0 +1,761 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import random
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl, quote, urlsplit
+
+import aiohttp
+from yarl import URL
+
+from data_lake import fsync_folder, write_file_atomically
+from metrics import collector_metrics
+
+# Seconds between two scans of the spool for files to upload
+UPLOAD_INTERVAL = 1.0
+
+# Files uploaded per scan, and at the same time
+UPLOAD_BATCH = 64
+UPLOAD_CONCURRENCY = 8
+
+# Files bigger than this are uploaded in parts of PART_SIZE (S3 needs at
+# least 5 MiB per part, but the last one). The windows (tens of KiB) and
+# the archives of a day are smaller: they go in a single PUT
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+PART_SIZE = 8 * 1024 * 1024
+
+# Seconds to wait for a whole request, and retries after the first attempt
+UPLOAD_TIMEOUT = 60.0
+UPLOAD_RETRIES = 4
+
+# Exponential backoff (seconds) with full jitter between retries
+UPLOAD_BACKOFF_BASE = 0.5
+UPLOAD_BACKOFF_CAP = 10.0
+
+# Responses worth to retry. Any other error status fails the upload
+UPLOAD_RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+# Seconds to upload the spool when the collector stops, the rest is
+# uploaded on the next start
+DRAIN_TIMEOUT = 10.0
+
+# Suffix of the links being added to the spool, never uploaded
+LINK_SUFFIX = '.link'
+
+# Suffix of the entries of the spool that remove their key from the bucket
+REMOVAL_SUFFIX = '.remove'
+
+# Seconds a removal waits in the spool: an upload of the same key started
+# before (by another process) is over by then, and can't bring it back
+REMOVAL_DELAY = 600.0
+
+
+def get_data_lake_folder(directory=None):
+    """ Get the ``data_lake`` folder, the root of the object keys
+
+    :param directory: folder that contains the ``data_lake``.
+        Default: the current working directory
+    :type directory: str
+    """
+    if directory is None:
+        directory = os.getcwd()
+
+    return os.path.join(directory, 'data_lake')
+
+
+def get_spool_key(path_to_entry, spool_folder):
+    """ Get the key of the object of an entry of the spool
+
+    :param path_to_entry: path of a spooled file or removal.
+    :type path_to_entry: str
+
+    :param spool_folder: folder of the spool.
+    :type spool_folder: str
+    """
+    key = os.path.relpath(path_to_entry, spool_folder)
+
+    if key.endswith(REMOVAL_SUFFIX):
+        key = key[:-len(REMOVAL_SUFFIX)]
+
+    return key
+
+
+def upload_delay(attempt):
+    """ Get the seconds to wait before retrying an upload, using full jitter
+
+    :param attempt: number of the failed attempt, starting in 0.
+    :type attempt: int
+    """
+    return random.uniform(
+        0, min(UPLOAD_BACKOFF_CAP, UPLOAD_BACKOFF_BASE * 2 ** attempt)
+    )
+
+
+def sign_s3_request(method, url, headers, payload_hash, access_key,
+                    secret_key, region):
+    """ Sign a request to S3 with AWS Signature Version 4
+
+    Return the headers with the ``Authorization``, ``x-amz-date`` and
+    ``x-amz-content-sha256`` ones. Without credentials the request goes
+    unsigned.
+
+    :param method: HTTP method.
+    :type method: str
+
+    :param url: URL of the request, with the path already encoded.
+    :type url: str
+
+    :param headers: headers of the request, all of them are signed.
+    :type headers: dict
+
+    :param payload_hash: hex SHA-256 of the body.
+    :type payload_hash: str
+
+    :param access_key: access key id.
+    :type access_key: str
+
+    :param secret_key: secret access key.
+    :type secret_key: str
+
+    :param region: region of the bucket. Example: ``us-east-1``
+    :type region: str
+    """
+    parts = urlsplit(url)
+    amz_date = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+    headers = dict(headers)
+    headers['host'] = parts.netloc
+    headers['x-amz-date'] = amz_date
+    headers['x-amz-content-sha256'] = payload_hash
+
+    if not access_key or not secret_key:
+        return headers
+
+    query = sorted(
+        (quote(name, safe='-_.~'), quote(value, safe='-_.~'))
+        for name, value in parse_qsl(parts.query, keep_blank_values=True)
+    )
+
+    signed = sorted((name.lower(), str(value).strip())
+                    for name, value in headers.items())
+    signed_headers = ';'.join(name for name, _ in signed)
+
+    canonical_request = '\n'.join([
+        method,
+        parts.path or '/',
+        '&'.join(f'{name}={value}' for name, value in query),
+        ''.join(f'{name}:{value}\n' for name, value in signed),
+        signed_headers,
+        payload_hash,
+    ])
+
+    scope = f'{amz_date[:8]}/{region}/s3/aws4_request'
+
+    string_to_sign = '\n'.join([
+        'AWS4-HMAC-SHA256',
+        amz_date,
+        scope,
+        hashlib.sha256(canonical_request.encode()).hexdigest(),
+    ])
+
+    key = f'AWS4{secret_key}'.encode()
+
+    for value in [amz_date[:8], region, 's3', 'aws4_request']:
+        key = hmac.new(key, value.encode(), hashlib.sha256).digest()
+
+    signature = hmac.new(
+        key, string_to_sign.encode(), hashlib.sha256
+    ).hexdigest()
+
+    headers['Authorization'] = (
+        f'AWS4-HMAC-SHA256 Credential={access_key}/{scope}, '
+        f'SignedHeaders={signed_headers}, Signature={signature}'
+    )
+
+    return headers
+
+
+class LocalStorage:
+    """ Data Lake in the local file system
+
+    :param directory: folder that contains the ``data_lake``.
+        Default: the current working directory
+    :type directory: str
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+
+    def save(self, path_to_file, content, mode='w', durable=False):
+        """ Save a whole file of the Data Lake, atomically
+
+        See ``data_lake.write_file_atomically`` for the parameters.
+        """
+        write_file_atomically(path_to_file, content, mode, durable)
+
+    def remove(self, path_to_file):
+        """ Remove a file of the Data Lake
+
+        :param path_to_file: path of the file.
+        :type path_to_file: str
+        """
+        os.remove(path_to_file)
+
+    async def run(self):
+        """ Nothing to upload: the local files are the Data Lake """
+
+    def close(self):
+        pass
+
+
+class S3Storage(LocalStorage):
+    """ Data Lake in an S3 compatible object store, spooled locally
+
+    Every file is saved to the local Data Lake (the readers, the compaction
+    and the partition numbers keep working on it) and linked in the spool,
+    ``data_lake/spool``. ``run`` uploads the spooled files in batches over
+    a pooled connection, ``data_lake/<key>`` to ``<prefix><key>`` of the
+    bucket, and removes them from the spool once uploaded. A removed file
+    (by the compaction or the archive) leaves a removal in the spool, that
+    deletes its object. The writers
+    never wait for the object store: if it's slow or down, the files wait
+    in the spool, also across restarts.
+
+    An upload is a PUT of the whole file to its key (in parts for the big
+    files), so retrying it is idempotent: a file uploaded twice leaves the
+    same object.
+
+    :param endpoint: URL of the object store. Example:
+        ``https://s3.us-east-1.amazonaws.com`` or ``http://localhost:5000``
+    :type endpoint: str
+
+    :param bucket: name of the bucket.
+    :type bucket: str
+
+    :param access_key: access key id. Default: unsigned requests
+    :type access_key: str
+
+    :param secret_key: secret access key.
+    :type secret_key: str
+
+    :param region: region of the bucket.
+        Default: ``us-east-1``
+    :type region: str
+
+    :param prefix: prefix of the keys. Example: ``bitso/``
+        Default: no prefix
+    :type prefix: str
+
+    :param directory: folder that contains the ``data_lake``.
+        Default: the current working directory
+    :type directory: str
+    """
+
+    def __init__(self, endpoint, bucket, access_key=None, secret_key=None,
+                 region='us-east-1', prefix='', directory=None):
+        super().__init__(directory)
+        self.endpoint = endpoint.rstrip('/')
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.prefix = prefix
+
+    def get_spool_folder(self):
+        return os.path.join(get_data_lake_folder(self.directory), 'spool')
+
+    def save(self, path_to_file, content, mode='w', durable=False):
+        """ Save a whole file to the local Data Lake and spool it
+
+        See ``data_lake.write_file_atomically`` for the parameters.
+        """
+        super().save(path_to_file, content, mode, durable)
+
+        self.spool(path_to_file, durable)
+
+    def get_spool_entry(self, path_to_file):
+        """ Get the path of the entry of a file in the spool
+
+        :param path_to_file: path of the file, inside ``data_lake``.
+        :type path_to_file: str
+        """
+        key = os.path.relpath(
+            path_to_file, get_data_lake_folder(self.directory)
+        )
+
+        if key.startswith(os.pardir):
+            raise ValueError(f'Not a file of the Data Lake: {path_to_file}')
+
+        return os.path.join(self.get_spool_folder(), key)
+
+    def spool(self, path_to_file, durable=False):
+        """ Add a file of the local Data Lake to the spool
+
+        The spool gets a hard link: the upload keeps the content saved now,
+        even if the file is replaced or removed (by the compaction) first.
+
+        :param path_to_file: path of the file, inside ``data_lake``.
+        :type path_to_file: str
+
+        :param durable: fsync the folder of the link.
+            Default: False
+        :type durable: bool
+        """
+        path_to_entry = self.get_spool_entry(path_to_file)
+        folder = os.path.dirname(path_to_entry)
+
+        os.makedirs(folder, exist_ok=True)
+
+        # Unique per thread, then renamed over a previous entry (if any)
+        path_to_link = (
+            f'{path_to_entry}.{os.getpid()}.{threading.get_ident()}'
+            f'{LINK_SUFFIX}'
+        )
+
+        os.link(path_to_file, path_to_link)
+        os.replace(path_to_link, path_to_entry)
+
+        # A file saved again after a removal is kept in the bucket
+        try:
+            os.remove(path_to_entry + REMOVAL_SUFFIX)
+        except FileNotFoundError:
+            pass
+
+        if durable:
+            fsync_folder(folder)
+
+    def remove(self, path_to_file):
+        """ Remove a file from the local Data Lake and spool the removal of
+        its object
+
+        The removal is spooled first: after a crash in between, the file
+        left is merged (or archived) and removed again.
+
+        :param path_to_file: path of the file, inside ``data_lake``.
+        :type path_to_file: str
+        """
+        path_to_entry = self.get_spool_entry(path_to_file)
+
+        os.makedirs(os.path.dirname(path_to_entry), exist_ok=True)
+
+        # A pending upload of the file is not needed anymore
+        try:
+            os.remove(path_to_entry)
+        except FileNotFoundError:
+            pass
+
+        with open(path_to_entry + REMOVAL_SUFFIX, 'w'):
+            pass
+
+        super().remove(path_to_file)
+
+    def list_spool(self, limit=None):
+        """ Get the ``(path, key)`` of the spooled files and removals,
+        oldest first
+
+        The removals younger than ``REMOVAL_DELAY`` are left for later.
+
+        :param limit: maximum number of entries.
+            Default: all of them
+        :type limit: int
+        """
+        spool_folder = self.get_spool_folder()
+        removed_before = time.time() - REMOVAL_DELAY
+        entries = []
+
+        for folder, _, file_names in os.walk(spool_folder):
+            for file_name in file_names:
+                if file_name.endswith(LINK_SUFFIX):
+                    continue
+
+                path_to_entry = os.path.join(folder, file_name)
+
+                try:
+                    modified = os.stat(path_to_entry).st_mtime
+                except FileNotFoundError:
+                    continue
+
+                if (file_name.endswith(REMOVAL_SUFFIX) and
+                        modified > removed_before):
+                    continue
+
+                entries.append((modified, path_to_entry))
+
+        entries.sort()
+
+        return [
+            (path_to_entry, get_spool_key(path_to_entry, spool_folder))
+            for _, path_to_entry in entries[:limit]
+        ]
+
+    def get_url(self, key, query=''):
+        """ Get the URL of an object, path style and encoded
+
+        :param key: key of the object, without the prefix.
+        :type key: str
+
+        :param query: query string. Example: ``uploads=``
+        :type query: str
+        """
+        path = quote(
+            f'{self.prefix}{key}'.replace(os.sep, '/'), safe='/-_.~'
+        )
+        url = f'{self.endpoint}/{quote(self.bucket)}/{path}'
+
+        return f'{url}?{query}' if query else url
+
+    async def request(self, session, method, url, content=b'', headers=None):
+        """ Send a signed request, retrying connection errors and transient
+        statuses
+
+        Return the headers and the body of the response.
+
+        :param session: pooled session.
+        :type session: aiohttp.ClientSession
+
+        :param method: HTTP method.
+        :type method: str
+
+        :param url: URL, see ``get_url``.
+        :type url: str
+
+        :param content: body of the request.
+        :type content: bytes
+
+        :param headers: extra headers.
+        :type headers: dict
+        """
+        payload_hash = hashlib.sha256(content).hexdigest()
+
+        for attempt in range(UPLOAD_RETRIES + 1):
+            last_attempt = attempt == UPLOAD_RETRIES
+
+            # Sign every attempt, the date must be recent
+            signed_headers = sign_s3_request(
+                method, url, headers or {}, payload_hash, self.access_key,
+                self.secret_key, self.region
+            )
+
+            try:
+                async with session.request(
+                    method, URL(url, encoded=True), data=content,
+                    headers=signed_headers
+                ) as response:
+                    body = await response.read()
+                    status = response.status
+
+                    # A completed multipart upload may fail with a 200
+                    if status == 200 and b'<Error>' in body[:200]:
+                        status = 500
+
+                    if status in (200, 204):
+                        return response.headers, body
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if last_attempt:
+                    raise
+            else:
+                if last_attempt or status not in UPLOAD_RETRY_STATUSES:
+                    raise Exception(
+                        f'Error {method} {url}: {status} {body[:200]}'
+                    )
+
+            collector_metrics.increment('upload_retries_total')
+
+            await asyncio.sleep(upload_delay(attempt))
+
+    async def put_object(self, session, key, content):
+        """ Upload a whole object with a single PUT
+
+        :param session: pooled session.
+        :type session: aiohttp.ClientSession
+
+        :param key: key of the object, without the prefix.
+        :type key: str
+
+        :param content: content of the object.
+        :type content: bytes
+        """
+        await self.request(
+            session, 'PUT', self.get_url(key), content,
+            {'Content-MD5': base64.b64encode(
+                hashlib.md5(content).digest()
+            ).decode()}
+        )
+
+    async def put_multipart(self, session, key, content):
+        """ Upload a big object in parts of ``PART_SIZE``, in parallel
+
+        A failed upload is aborted, so no part is left in the bucket.
+
+        :param session: pooled session.
+        :type session: aiohttp.ClientSession
+
+        :param key: key of the object, without the prefix.
+        :type key: str
+
+        :param content: content of the object.
+        :type content: bytes
+        """
+        _, body = await self.request(
+            session, 'POST', self.get_url(key, 'uploads=')
+        )
+        upload_id = ElementTree.fromstring(body).findtext('{*}UploadId')
+        upload_query = f'uploadId={quote(upload_id, safe="")}'
+
+        async def put_part(number, offset):
+            part = content[offset:offset + PART_SIZE]
+
+            headers, _ = await self.request(
+                session, 'PUT',
+                self.get_url(key, f'partNumber={number}&{upload_query}'),
+                part,
+                {'Content-MD5': base64.b64encode(
+                    hashlib.md5(part).digest()
+                ).decode()}
+            )
+
+            return number, headers['ETag']
+
+        try:
+            parts = await asyncio.gather(*[
+                put_part(number, offset) for number, offset in enumerate(
+                    range(0, len(content), PART_SIZE), start=1
+                )
+            ])
+
+            complete = ''.join(
+                f'<Part><PartNumber>{number}</PartNumber>'
+                f'<ETag>{etag}</ETag></Part>'
+                for number, etag in parts
+            )
+
+            await self.request(
+                session, 'POST', self.get_url(key, upload_query),
+                f'<CompleteMultipartUpload>{complete}'
+                f'</CompleteMultipartUpload>'.encode()
+            )
+        except BaseException:
+            try:
+                await self.request(
+                    session, 'DELETE', self.get_url(key, upload_query)
+                )
+            except Exception:
+                pass
+
+            raise
+
+    async def delete_object(self, session, path_to_entry, key):
+        """ Delete the object of a spooled removal and remove it from the
+        spool
+
+        Deleting a missing object succeeds, so it can be retried.
+
+        :param session: pooled session.
+        :type session: aiohttp.ClientSession
+
+        :param path_to_entry: path of the removal in the spool.
+        :type path_to_entry: str
+
+        :param key: key of the object, without the prefix.
+        :type key: str
+        """
+        with collector_metrics.timer('upload_seconds'):
+            await self.request(session, 'DELETE', self.get_url(key))
+
+        try:
+            os.remove(path_to_entry)
+        except FileNotFoundError:
+            pass
+
+        collector_metrics.increment('removals_total')
+
+    async def upload(self, session, path_to_entry, key):
+        """ Upload a spooled file and remove it from the spool
+
+        :param session: pooled session.
+        :type session: aiohttp.ClientSession
+
+        :param path_to_entry: path of the file in the spool.
+        :type path_to_entry: str
+
+        :param key: key of the object, without the prefix.
+        :type key: str
+        """
+        if path_to_entry.endswith(REMOVAL_SUFFIX):
+            return await self.delete_object(session, path_to_entry, key)
+
+        loop = asyncio.get_running_loop()
+
+        with open(path_to_entry, 'rb') as file:
+            inode = os.fstat(file.fileno()).st_ino
+            content = await loop.run_in_executor(None, file.read)
+
+        with collector_metrics.timer('upload_seconds'):
+            if len(content) > MULTIPART_THRESHOLD:
+                await self.put_multipart(session, key, content)
+            else:
+                await self.put_object(session, key, content)
+
+        # A file spooled again meanwhile (a new link) is uploaded again
+        try:
+            if os.stat(path_to_entry).st_ino == inode:
+                os.remove(path_to_entry)
+        except FileNotFoundError:
+            pass
+
+        collector_metrics.increment('uploads_total')
+        collector_metrics.increment('upload_bytes_total', len(content))
+
+    async def upload_spool(self, session):
+        """ Upload a batch of spooled files, ``UPLOAD_CONCURRENCY`` at once
+
+        Return the number of files of the batch, and of failed uploads.
+
+        :param session: pooled session.
+        :type session: aiohttp.ClientSession
+        """
+        loop = asyncio.get_running_loop()
+
+        entries = await loop.run_in_executor(
+            None, self.list_spool, UPLOAD_BATCH
+        )
+
+        semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+        async def upload(path_to_entry, key):
+            async with semaphore:
+                try:
+                    await self.upload(session, path_to_entry, key)
+                except FileNotFoundError:
+                    # Uploaded by another process
+                    pass
+                except Exception as error:
+                    collector_metrics.increment('upload_errors_total')
+
+                    print(
+                        datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                        f'- Error uploading {key}: {error}'
+                    )
+
+                    return 1
+
+            return 0
+
+        failed = await asyncio.gather(*[
+            upload(path_to_entry, key) for path_to_entry, key in entries
+        ])
+
+        return len(entries), sum(failed)
+
+    def create_session(self):
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=UPLOAD_CONCURRENCY),
+            timeout=aiohttp.ClientTimeout(total=UPLOAD_TIMEOUT)
+        )
+
+    async def run(self, interval=UPLOAD_INTERVAL):
+        """ Upload the spooled files every ``interval`` seconds, until
+        cancelled
+
+        :param interval: seconds between two scans of the spool.
+            Default: ``UPLOAD_INTERVAL``
+        :type interval: float
+        """
+        async with self.create_session() as session:
+            while True:
+                files, failed = await self.upload_spool(session)
+
+                # After a full batch, the next one goes right away
+                if failed or files < UPLOAD_BATCH:
+                    await asyncio.sleep(interval)
+
+    async def drain(self):
+        """ Upload the spooled files until none is left or one fails """
+        async with self.create_session() as session:
+            while True:
+                files, failed = await self.upload_spool(session)
+
+                if failed or not files:
+                    break
+
+    def close(self, timeout=DRAIN_TIMEOUT):
+        """ Upload the files spooled by the last windows, for a while
+
+        :param timeout: seconds to upload, the rest is uploaded on the next
+            start.
+            Default: ``DRAIN_TIMEOUT``
+        :type timeout: float
+        """
+        try:
+            asyncio.run(asyncio.wait_for(self.drain(), timeout))
+        except (asyncio.TimeoutError, aiohttp.ClientError):
+            pass
+
+        left = len(self.list_spool())
+
+        if left:
+            print(
+                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                f'- {left} files left in the spool, uploaded on the next start'
+            )
+
+
+# Storage of the files saved by the writers, see ``use_storage``
+data_lake_storage = LocalStorage()
+
+
+def use_storage(storage):
+    """ Set the storage of the files saved by the writers
+
+    :param storage: ``LocalStorage`` or ``S3Storage``.
+    :type storage: LocalStorage
+    """
+    global data_lake_storage
+
+    data_lake_storage = storage
+
+
+def save_file(path_to_file, content, mode='w', durable=False):
+    """ Save a whole file of the Data Lake with the storage in use
+
+    See ``data_lake.write_file_atomically`` for the parameters.
+    """
+    data_lake_storage.save(path_to_file, content, mode, durable)
+
+
+def remove_file(path_to_file):
+    """ Remove a file of the Data Lake with the storage in use
+
+    :param path_to_file: path of the file.
+    :type path_to_file: str
+    """
+    data_lake_storage.remove(path_to_file)
+
+
+def get_storage(directory=None):
+    """ Get the storage set by the environment variables of the collector,
+    ``STORAGE`` (local or s3), ``S3_ENDPOINT``, ``S3_BUCKET``,
+    ``S3_PREFIX``, ``AWS_REGION``, ``AWS_ACCESS_KEY_ID`` and
+    ``AWS_SECRET_ACCESS_KEY``
+
+    :param directory: folder that contains the ``data_lake``.
+        Default: the current working directory
+    :type directory: str
+    """
+    if os.environ.get('STORAGE', 'local') != 's3':
+        return LocalStorage(directory)
+
+    return S3Storage(
+        os.environ.get('S3_ENDPOINT', 'https://s3.amazonaws.com'),
+        os.environ.get('S3_BUCKET'),
+        os.environ.get('AWS_ACCESS_KEY_ID'),
+        os.environ.get('AWS_SECRET_ACCESS_KEY'),
+        os.environ.get('AWS_REGION', 'us-east-1'),
+        os.environ.get('S3_PREFIX', ''),
+        directory
+    )
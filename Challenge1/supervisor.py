@@ -0,0 +1,350 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from datetime import datetime
+
+from metrics import Metrics, export_metrics, start_metrics_server
+
+# Worker processes. One per core: every worker has its own interpreter,
+# so the parsing and the computing of the books run in parallel
+WORKERS = os.cpu_count() or 1
+
+# Seconds between two reports (heartbeat and metrics) of a worker
+REPORT_INTERVAL = 5.0
+
+# A worker without reports during these seconds is restarted: its event
+# loop is stuck
+HEALTH_TIMEOUT = 30.0
+
+# Seconds to wait before restarting a worker, doubled on every restart in
+# a row, up to the cap
+RESTART_DELAY = 1.0
+RESTART_DELAY_CAP = 60.0
+
+# Seconds a stopped worker has to save its windows before it's killed
+STOP_TIMEOUT = 10.0
+
+
+def shard_books(books, workers):
+    """ Split the books in at most ``workers`` shards, round robin
+
+    :param books: names of the order books.
+    :type books: list
+
+    :param workers: number of shards.
+    :type workers: int
+    """
+    shards = [books[index::workers] for index in range(workers)]
+
+    return [shard for shard in shards if shard]
+
+
+async def report_health(reports, worker, metrics, interval=REPORT_INTERVAL):
+    """ Send a heartbeat with the metrics to the supervisor, until cancelled
+
+    Runs in the event loop of the worker, so the reports stop if the loop
+    gets stuck.
+
+    :param reports: queue read by the supervisor.
+    :type reports: multiprocessing.Queue
+
+    :param worker: number of the worker.
+    :type worker: int
+
+    :param metrics: metrics of the worker.
+    :type metrics: metrics.Metrics
+
+    :param interval: seconds between two reports.
+        Default: ``REPORT_INTERVAL``
+    :type interval: float
+    """
+    try:
+        while True:
+            reports.put((worker, os.getpid(), metrics.snapshot()))
+            await asyncio.sleep(interval)
+    finally:
+        # Last values, for the aggregated metrics
+        reports.put((worker, os.getpid(), metrics.snapshot()))
+
+
+def stop_on_sigterm():
+    """ Raise ``SystemExit`` on SIGTERM, so the worker saves its windows """
+    def handle(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, handle)
+
+
+class Worker:
+    """ A worker process and its health
+
+    :param index: number of the worker.
+    :type index: int
+
+    :param books: names of the order books of the worker.
+    :type books: list
+    """
+
+    def __init__(self, index, books):
+        self.index = index
+        self.books = books
+        self.process = None
+        self.started = None
+        self.last_report = None
+        self.restarts = 0
+        self.restart_at = None
+
+        # Last metrics reported by the running process
+        self.snapshot = None
+
+
+class Supervisor:
+    """ Run the books in several worker processes and keep them running
+
+    Every worker gets a shard of the books and owns its whole path (fetch,
+    compute and write), so the workers share nothing: the files of a book
+    are only written by its worker. The workers report every
+    ``REPORT_INTERVAL`` seconds; a dead worker, or one without reports
+    during ``HEALTH_TIMEOUT`` seconds, is restarted.
+
+    :param books: names of the order books.
+    :type books: list
+
+    :param target: function ``target(index, books, reports)`` that runs a
+        worker. It must be importable (picklable) by the new processes.
+    :type target: callable
+
+    :param workers: number of worker processes.
+        Default: ``WORKERS``
+    :type workers: int
+
+    :param health_timeout: seconds without reports to restart a worker.
+        Default: ``HEALTH_TIMEOUT``
+    :type health_timeout: float
+    """
+
+    def __init__(self, books, target, workers=WORKERS,
+                 health_timeout=HEALTH_TIMEOUT):
+        # New interpreters: no thread nor connection is inherited
+        self.context = multiprocessing.get_context('spawn')
+        self.reports = self.context.Queue()
+        self.target = target
+        self.health_timeout = health_timeout
+
+        self.workers = [
+            Worker(index, shard)
+            for index, shard in enumerate(shard_books(list(books), workers))
+        ]
+
+        # Aggregated metrics of all the workers
+        self.metrics = Metrics(enabled=True)
+
+        # Counters and histograms of the processes already stopped
+        self.retired = Metrics(enabled=True)
+
+    def start(self, worker):
+        """ Start the process of a worker
+
+        :param worker: worker to start.
+        :type worker: Worker
+        """
+        worker.process = self.context.Process(
+            target=self.target,
+            args=(worker.index, worker.books, self.reports),
+            name=f'worker-{worker.index}',
+            daemon=True
+        )
+        worker.process.start()
+
+        worker.started = time.monotonic()
+        worker.last_report = worker.started
+        worker.restart_at = None
+
+        print(
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            f'- Started worker {worker.index} (pid {worker.process.pid}):',
+            ', '.join(worker.books)
+        )
+
+    def stop(self, worker, timeout=STOP_TIMEOUT):
+        """ Stop the process of a worker, letting it save its windows
+
+        :param worker: worker to stop.
+        :type worker: Worker
+
+        :param timeout: seconds to wait before killing it, 0 to kill it
+            right away.
+            Default: ``STOP_TIMEOUT``
+        :type timeout: float
+        """
+        process = worker.process
+
+        if process is None:
+            return
+
+        if process.is_alive() and timeout:
+            process.terminate()
+            process.join(timeout)
+
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+        # The counters of the process are kept, it won't report anymore
+        if worker.snapshot is not None:
+            self.retired.merge(worker.snapshot, gauges=False)
+
+        worker.process = None
+        worker.snapshot = None
+
+    def receive(self, timeout):
+        """ Read the reports of the workers during ``timeout`` seconds
+
+        :param timeout: seconds to wait for the first report.
+        :type timeout: float
+        """
+        try:
+            report = self.reports.get(timeout=timeout)
+
+            while True:
+                index, pid, snapshot = report
+                worker = self.workers[index]
+
+                # Reports of a replaced process are ignored
+                if worker.process is not None and \
+                        worker.process.pid == pid:
+                    worker.last_report = time.monotonic()
+                    worker.snapshot = snapshot
+
+                report = self.reports.get_nowait()
+        except queue.Empty:
+            pass
+
+    def check(self, worker):
+        """ Restart a worker if it's dead or stuck
+
+        :param worker: worker to check.
+        :type worker: Worker
+        """
+        now = time.monotonic()
+
+        if worker.restart_at is not None:
+            if now >= worker.restart_at:
+                self.start(worker)
+
+            return
+
+        alive = worker.process.is_alive()
+
+        if alive and now - worker.last_report < self.health_timeout:
+            # Healthy for a while: the restarts in a row are over
+            if now - worker.started > self.health_timeout:
+                worker.restarts = 0
+
+            return
+
+        reason = 'stuck' if alive else \
+            f'dead (exit code {worker.process.exitcode})'
+
+        # A stuck loop won't save its windows: don't wait for it
+        self.stop(worker, timeout=0)
+
+        delay = min(RESTART_DELAY_CAP, RESTART_DELAY * 2 ** worker.restarts)
+        worker.restarts = worker.restarts + 1
+        worker.restart_at = now + delay
+
+        self.retired.increment('worker_restarts_total')
+
+        print(
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            f'- Worker {worker.index} is {reason}, restarting in {delay:g} s'
+        )
+
+    def aggregate(self):
+        """ Update ``metrics`` with the values of all the workers """
+        aggregated = Metrics(enabled=True)
+        aggregated.merge(self.retired.snapshot())
+
+        for worker in self.workers:
+            if worker.snapshot is not None:
+                aggregated.merge(worker.snapshot)
+
+        aggregated.set_gauge('workers', len(self.workers))
+        aggregated.set_gauge('workers_alive', sum(
+            worker.process is not None and worker.process.is_alive()
+            for worker in self.workers
+        ))
+
+        # New dicts, never changed in place: the exporter may be reading
+        self.metrics.histograms = aggregated.histograms
+        self.metrics.counters = aggregated.counters
+        self.metrics.gauges = aggregated.gauges
+
+    async def run(self, metrics_file=None, metrics_port=None):
+        """ Start the workers and keep them running, until cancelled
+
+        :param metrics_file: save the aggregated metrics to this file every
+            few seconds.
+            Default: not saved
+        :type metrics_file: str
+
+        :param metrics_port: serve the aggregated metrics at
+            ``http://127.0.0.1:<metrics_port>/metrics``.
+            Default: not served
+        :type metrics_port: int
+        """
+        loop = asyncio.get_running_loop()
+        exporter = None
+        metrics_server = None
+
+        for worker in self.workers:
+            self.start(worker)
+
+        if metrics_file:
+            exporter = asyncio.create_task(
+                export_metrics(self.metrics, metrics_file)
+            )
+
+        if metrics_port:
+            metrics_server = await start_metrics_server(
+                self.metrics, port=metrics_port
+            )
+
+        try:
+            while True:
+                await loop.run_in_executor(None, self.receive, 1.0)
+
+                for worker in self.workers:
+                    self.check(worker)
+
+                self.aggregate()
+        finally:
+            await loop.run_in_executor(None, self.stop_all)
+
+            self.aggregate()
+
+            if exporter is not None:
+                exporter.cancel()
+                await asyncio.gather(exporter, return_exceptions=True)
+
+            if metrics_server is not None:
+                await metrics_server.cleanup()
+
+    def stop_all(self):
+        """ Stop all the workers, in parallel """
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.process.terminate()
+
+        # Their last reports
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join(STOP_TIMEOUT)
+
+        self.receive(0.1)
+
+        for worker in self.workers:
+            self.stop(worker)
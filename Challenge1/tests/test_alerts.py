@@ -0,0 +1,108 @@
+""" Spread alert rules: threshold index, hysteresis and new rules
+
+Usage: python -m pytest tests
+"""
+import os
+import sys
+from datetime import datetime, timezone
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from alerts import (BELOW, RESOLVED, TRIGGERED,  # noqa: E402
+                    AlertEngine)
+
+TIMESTAMP = datetime(2023, 10, 1, tzinfo=timezone.utc)
+
+
+def create_engine(thresholds, direction='above', hysteresis=0.01):
+    """ Engine with the rules of btc_mxn, and the alerts it sends """
+    alerts = []
+    engine = AlertEngine([alerts.append], hysteresis=hysteresis)
+
+    for threshold in thresholds:
+        engine.add_rule('btc_mxn', threshold, direction)
+
+    return engine, alerts
+
+
+def states(alerts):
+    return [(alert.state, alert.rule.threshold) for alert in alerts]
+
+
+def test_rules_fire_in_order_of_threshold():
+    engine, alerts = create_engine([1.0, 0.1, 0.5])
+
+    engine.evaluate('btc_mxn', 0.05, TIMESTAMP)
+    engine.evaluate('btc_mxn', 0.6, TIMESTAMP)
+
+    assert states(alerts) == [(TRIGGERED, 0.1), (TRIGGERED, 0.5)]
+
+    # Another book has its own rules
+    engine.evaluate('usd_mxn', 2.0, TIMESTAMP)
+    engine.evaluate('btc_mxn', 2.0, TIMESTAMP)
+
+    assert states(alerts[2:]) == [(TRIGGERED, 1.0)]
+
+    engine.evaluate('btc_mxn', 0.0, TIMESTAMP)
+
+    assert states(alerts[3:]) == [
+        (RESOLVED, 0.1), (RESOLVED, 0.5), (RESOLVED, 1.0)
+    ]
+
+
+def test_removed_rules_do_not_fire():
+    engine, alerts = create_engine([0.1])
+    rule = engine.add_rule('btc_mxn', 0.5)
+    engine.add_rule('btc_mxn', 1.0)
+
+    engine.remove_rule(rule.rule_id)
+    engine.evaluate('btc_mxn', 0.7, TIMESTAMP)
+
+    assert states(alerts) == [(TRIGGERED, 0.1)]
+
+
+def test_alerts_resolve_past_the_hysteresis():
+    engine, alerts = create_engine([0.5], hysteresis=0.1)
+
+    engine.evaluate('btc_mxn', 0.6, TIMESTAMP)
+
+    # Inside the band under the threshold
+    engine.evaluate('btc_mxn', 0.45, TIMESTAMP)
+    engine.evaluate('btc_mxn', 0.55, TIMESTAMP)
+
+    assert states(alerts) == [(TRIGGERED, 0.5)]
+
+    engine.evaluate('btc_mxn', 0.35, TIMESTAMP)
+
+    assert states(alerts) == [(TRIGGERED, 0.5), (RESOLVED, 0.5)]
+
+
+def test_below_rules_fire_under_the_threshold():
+    engine, alerts = create_engine([0.1, 0.05], BELOW)
+
+    engine.evaluate('btc_mxn', 0.07, TIMESTAMP)
+    engine.evaluate('btc_mxn', 0.2, TIMESTAMP)
+
+    assert states(alerts) == [(TRIGGERED, 0.1), (RESOLVED, 0.1)]
+
+
+def test_a_new_rule_already_crossed_fires():
+    engine, alerts = create_engine([0.5])
+
+    engine.evaluate('btc_mxn', 0.6, TIMESTAMP)
+
+    # Under a triggered rule, and crossed by the last spread
+    engine.add_rule('btc_mxn', 0.3)
+    engine.add_rule('btc_mxn', 0.55)
+
+    assert states(alerts) == [
+        (TRIGGERED, 0.5), (TRIGGERED, 0.3), (TRIGGERED, 0.55)
+    ]
+    assert alerts[-1].spread == 0.6
+
+    # Not crossed
+    engine.add_rule('btc_mxn', 1.0)
+    engine.evaluate('btc_mxn', 0.0, TIMESTAMP)
+
+    assert states(alerts[3:]) == [
+        (RESOLVED, 0.3), (RESOLVED, 0.5), (RESOLVED, 0.55)
+    ]
@@ -0,0 +1,75 @@
+""" Archive of the closed days
+
+Usage: python -m pytest tests
+"""
+import os
+import shutil
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from archive import (archive_data_lake, get_archive_path,  # noqa: E402
+                     read_blocks, read_index)
+from window_writer import WindowWriter  # noqa: E402
+
+START = datetime(2023, 10, 1, 3, tzinfo=timezone.utc)
+
+
+def save_quiet_book(ticks, size):
+    """ Save the ticks of an unchanged book in windows of ``size`` rows,
+    return the paths of the files
+    """
+    writer = WindowWriter(size=size)
+    files = []
+
+    for tick in range(ticks):
+        for window in writer.add(
+            'btc_mxn', START, 100.0, 101.0, 1.0,
+            tick_time=START + timedelta(seconds=tick)
+        ):
+            files.append(window.flush())
+
+    return files
+
+
+def read_archived_rows():
+    path_to_archive = get_archive_path('btc_mxn', START)
+    index = read_index(path_to_archive)
+
+    return read_blocks(path_to_archive, index['blocks'])[1]
+
+
+def test_quiet_book_split_across_windows_is_archived(tmp_path,
+                                                     monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    files = save_quiet_book(40, 10)
+
+    assert len(files) == 4
+
+    archive_data_lake()
+
+    assert len(read_archived_rows()) == 40
+
+
+def test_files_left_by_a_crash_are_archived_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    files = save_quiet_book(40, 10)
+    copy = str(tmp_path / 'copy.csv')
+
+    shutil.copy(files[0], copy)
+
+    archive_data_lake()
+
+    # A crash before its hour was removed: the file is found again
+    os.makedirs(os.path.dirname(files[0]))
+    shutil.copy(copy, files[0])
+
+    archive_data_lake()
+
+    rows = read_archived_rows()
+
+    assert len(rows) == 40
+    assert len({row[5] for row in rows}) == 40
+    assert not os.path.exists(files[0])
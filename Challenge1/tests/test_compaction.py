@@ -0,0 +1,91 @@
+""" Merge of the part files of an hour
+
+Usage: python -m pytest tests
+"""
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from compaction import merge_rows  # noqa: E402
+from window_writer import SpreadWindow  # noqa: E402
+
+START = datetime(2023, 10, 1, tzinfo=timezone.utc)
+
+
+def save_window(folder, name, observations):
+    """ Save ``(tick, second, bid, ask)`` observations in a CSV file, the
+    tick and the order book timestamp in seconds from ``START``
+    """
+    window = SpreadWindow('btc_mxn', len(observations))
+
+    for tick, second, bid, ask in observations:
+        window.append(
+            START + timedelta(seconds=second), bid, ask, 1.0,
+            tick_time=None if tick is None else START + timedelta(seconds=tick)
+        )
+
+    path_to_file = os.path.join(folder, name)
+
+    with open(path_to_file, 'w') as file:
+        file.write(window.to_csv())
+
+    return path_to_file
+
+
+def quiet_book(first_tick, ticks):
+    """ Ticks of an unchanged book: the same timestamp, bid and ask """
+    return [
+        (tick, 0, 100.0, 101.0)
+        for tick in range(first_tick, first_tick + ticks)
+    ]
+
+
+def test_identical_ticks_of_a_file_are_kept(tmp_path):
+    path_to_file = save_window(
+        str(tmp_path), 'part-0.csv', quiet_book(0, 3) + [(3, 3, 100.0, 102.0)]
+    )
+
+    _, rows = merge_rows([path_to_file])
+
+    assert len(rows) == 4
+
+
+def test_quiet_book_split_across_windows_is_kept(tmp_path):
+    first = save_window(str(tmp_path), 'part-0.csv', quiet_book(0, 10))
+    second = save_window(str(tmp_path), 'part-1.csv', quiet_book(10, 30))
+
+    _, rows = merge_rows([first, second])
+
+    assert len(rows) == 40
+    assert [row[5] for row in rows] == [
+        START + timedelta(seconds=tick) for tick in range(40)
+    ]
+
+
+def test_ticks_saved_again_are_removed(tmp_path):
+    first = save_window(
+        str(tmp_path), 'part-0.csv', quiet_book(0, 2) + [(2, 2, 100.0, 102.0)]
+    )
+
+    # A replay of the journal saved the window again, and the next tick
+    second = save_window(
+        str(tmp_path), 'part-1.csv',
+        quiet_book(0, 2) + [(2, 2, 100.0, 102.0), (3, 3, 100.0, 103.0)]
+    )
+
+    _, rows = merge_rows([first, second])
+
+    assert [(row[5].second, row[3]) for row in rows] == [
+        (0, 101.0), (1, 101.0), (2, 102.0), (3, 103.0),
+    ]
+
+
+def test_rows_without_tick_time_are_kept(tmp_path):
+    observations = [(None, 0, 100.0, 101.0)] * 3
+    first = save_window(str(tmp_path), 'part-0.csv', observations)
+    second = save_window(str(tmp_path), 'part-1.csv', observations)
+
+    _, rows = merge_rows([first, second])
+
+    assert len(rows) == 6
@@ -0,0 +1,84 @@
+""" Depth metrics of the order books
+
+Usage: python -m pytest tests
+"""
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from depth import DepthEngine  # noqa: E402
+
+
+def order_book(bids, asks):
+    """ Raw ``order_book`` response with ``(price, amount)`` orders """
+    def orders(side):
+        return [
+            {'book': 'btc_mxn', 'price': str(price), 'amount': str(amount)}
+            for price, amount in side
+        ]
+
+    return json.dumps({
+        'success': True,
+        'payload': {
+            'asks': orders(asks),
+            'bids': orders(bids),
+            'updated_at': '2023-10-01T00:00:00+00:00',
+            'sequence': '1',
+        },
+    }).encode()
+
+
+def test_metrics_of_the_levels():
+    engine = DepthEngine(levels=(1, 2), notionals=(100.0, 1000.0))
+
+    metrics = engine.compute(
+        np.array([100.0, 99.0]), np.array([1.0, 2.0]),
+        np.array([101.0, 102.0]), np.array([1.0, 1.0])
+    )
+
+    assert engine.columns == [
+        'spread_l1', 'spread_l2', 'imbalance_l1', 'imbalance_l2',
+        'effective_spread_100', 'effective_spread_1000',
+    ]
+    np.testing.assert_allclose(metrics[:5], [
+        100 / 101, 300 / 102, 0.0, 0.2, 100 / 101
+    ])
+
+    # Not enough depth to fill the notional
+    assert np.isnan(metrics[5])
+
+
+def test_the_effective_spread_walks_the_levels():
+    engine = DepthEngine(levels=(1,), notionals=(300.0,))
+
+    # Sell 300 at 100 then 99, buy 300 at 101 then 102
+    metrics = engine.compute(
+        np.array([100.0, 99.0]), np.array([2.0, 5.0]),
+        np.array([101.0, 102.0]), np.array([1.0, 5.0])
+    )
+
+    sell_price = 300 / (2 + 100 / 99)
+    buy_price = 300 / (1 + 199 / 102)
+
+    np.testing.assert_allclose(
+        metrics[-1], (buy_price - sell_price) * 100 / buy_price
+    )
+
+
+def test_metrics_are_read_from_the_response():
+    engine = DepthEngine(levels=(1, 3), notionals=(100.0,), max_levels=2)
+
+    top = engine.read(order_book(
+        bids=[(100, 1), (99, 1), (98, 1)],
+        asks=[(101, 1), (102, 1), (103, 1)]
+    ))
+
+    assert (top.bid, top.ask) == (100.0, 101.0)
+    np.testing.assert_allclose(top.metrics[0], 100 / 101)
+
+    # Only max_levels are parsed: the third level is missing
+    assert np.isnan(top.metrics[1])
+    assert np.isnan(top.metrics[3])
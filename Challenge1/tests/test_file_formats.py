@@ -0,0 +1,91 @@
+""" Round trip of the windows through the file formats
+
+Usage: python -m pytest tests
+"""
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from file_formats import FILE_FORMATS, read_csv  # noqa: E402
+from window_writer import SpreadWindow  # noqa: E402
+
+START = datetime(2023, 10, 1, tzinfo=timezone.utc)
+
+
+def create_window(file_format):
+    """ Window with depth metrics, a gap and a row without tick time """
+    window = SpreadWindow(
+        'btc_mxn', 3, file_format, metric_columns=['imbalance']
+    )
+
+    window.append(START, 100.0, 101.0, 1.0, [0.25], tick_time=START)
+    window.append_gap(START + timedelta(seconds=1))
+    window.append(START + timedelta(seconds=2), 100.5, 101.5, 0.99)
+
+    return window
+
+
+def without_nan(rows):
+    """ Rows with None for NaN, which is not equal to itself """
+    return [
+        tuple(None if value != value else value for value in row)
+        for row in rows
+    ]
+
+
+@pytest.mark.parametrize('file_format', ['csv', 'parquet', 'arrow'])
+def test_windows_are_read_back(tmp_path, file_format):
+    if file_format != 'csv':
+        pytest.importorskip('pyarrow')
+
+    window = create_window(file_format)
+    spread_format = FILE_FORMATS[file_format]
+
+    path_to_file = str(tmp_path / f'part-0{spread_format.extension}')
+
+    with open(path_to_file, spread_format.mode) as file:
+        file.write(spread_format.render(window))
+
+    gap = START + timedelta(seconds=1)
+    rows = [
+        (START, 'btc_mxn', 100.0, 101.0, 1.0, START, 0.25),
+        (gap, 'btc_mxn', None, None, None, gap, None),
+        (START + timedelta(seconds=2), 'btc_mxn', 100.5, 101.5, 0.99,
+         None, None),
+    ]
+
+    metric_columns, read_rows = spread_format.read_with_metrics(
+        path_to_file
+    )
+
+    assert metric_columns == ['imbalance']
+    assert without_nan(read_rows) == rows
+    assert without_nan(spread_format.read(path_to_file)) == [
+        row[:6] for row in rows
+    ]
+
+
+def test_csv_files_without_tick_times_are_read(tmp_path):
+    path_to_file = tmp_path / 'part-0.csv'
+    path_to_file.write_text(
+        'timestamp,book,bid,ask,spread\n'
+        '"2023-10-01 00:00:00+00:00","btc_mxn",100.0,101.0,1.0\n'
+    )
+
+    assert read_csv(str(path_to_file)) == [
+        (START, 'btc_mxn', 100.0, 101.0, 1.0, None)
+    ]
+
+
+def test_csv_files_without_headers_are_read(tmp_path):
+    path_to_file = tmp_path / 'part-0.csv'
+    path_to_file.write_text(
+        '"2023-10-01 00:00:00+00:00","btc_mxn",100.0,101.0,1.0\n'
+    )
+
+    assert read_csv(str(path_to_file)) == [
+        (START, 'btc_mxn', 100.0, 101.0, 1.0, None)
+    ]
@@ -0,0 +1,147 @@
+""" Recovery of the journal of the windows in progress
+
+Usage: python -m pytest tests
+"""
+import json
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from journal import (Journal, JournalSegment, decode_records,  # noqa: E402
+                     encode_record)
+from window_writer import WindowWriter  # noqa: E402
+
+START = datetime(2023, 10, 1, tzinfo=timezone.utc)
+
+
+def add_observations(writer, count):
+    """ Add an observation per second from ``START``, return the windows
+    closed meanwhile
+    """
+    closed_windows = []
+
+    for second in range(count):
+        timestamp = START + timedelta(seconds=second)
+        closed_windows.extend(writer.add(
+            'btc_mxn', timestamp, 100.0 + second, 101.0 + second, 1.0,
+            tick_time=timestamp
+        ))
+
+    return closed_windows
+
+
+def test_full_window_keeps_the_journal_of_the_next_one(tmp_path,
+                                                       monkeypatch):
+    # Flushed windows are saved to the Data Lake of the working directory
+    monkeypatch.chdir(tmp_path)
+    folder = str(tmp_path / 'journal')
+
+    journal = Journal(folder)
+    writer = WindowWriter(size=5, journal=journal)
+
+    # The first window fills before its 10 minutes: the next one has the
+    # same start
+    closed_windows = add_observations(writer, 8)
+
+    assert len(closed_windows) == 1
+    assert len(os.listdir(folder)) == 2
+
+    closed_windows[0].flush()
+    journal.close()
+
+    # A crash: the rows of the window in progress are recovered
+    recovered = WindowWriter(size=5, journal=Journal(folder)).recover(
+        now=START + timedelta(hours=1)
+    )
+
+    assert len(recovered) == 1
+    assert recovered[0].start == START
+    assert list(recovered[0].bids) == [105.0, 106.0, 107.0]
+
+
+def test_window_in_progress_is_restored(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    folder = str(tmp_path / 'journal')
+
+    journal = Journal(folder)
+    writer = WindowWriter(size=5, journal=journal)
+
+    add_observations(writer, 8)[0].flush()
+    journal.close()
+
+    writer = WindowWriter(size=5, journal=Journal(folder))
+
+    assert writer.recover(now=START) == []
+    assert len(writer.windows['btc_mxn']) == 3
+
+    # The restored window goes on in its own segment, until it's full
+    closed_windows = add_observations(writer, 2)
+
+    assert len(closed_windows) == 1
+
+    closed_windows[0].flush()
+    writer.journal.close()
+
+    assert os.listdir(folder) == []
+
+
+def test_torn_records_are_cut(tmp_path):
+    folder = str(tmp_path)
+    journal = Journal(folder)
+
+    segment = journal.open_segment('btc_mxn', START)
+    segment.append([1.0, 100.0, 101.0, 1.0, 1.0])
+    segment.append([2.0, 100.0, 101.0, 1.0, 2.0])
+    journal.close()
+
+    # A crash in the middle of the second row
+    with open(segment.path, 'rb') as file:
+        content = file.read()
+
+    with open(segment.path, 'wb') as file:
+        file.write(content[:-5])
+
+    [(header, rows, path)] = Journal(folder).read_segments()
+
+    assert header['book'] == 'btc_mxn'
+    assert rows == [[1.0, 100.0, 101.0, 1.0, 1.0]]
+    assert os.path.getsize(path) == len(
+        encode_record(json.dumps(header)) +
+        encode_record('1.0,100.0,101.0,1.0,1.0')
+    )
+
+
+def test_corrupt_records_end_the_segment():
+    first = encode_record('1.0')
+    corrupt = b'00000000 2.0\n'
+
+    assert decode_records(first + corrupt + encode_record('3.0')) == ['1.0']
+
+
+def test_commits_sync_every_segment_written_once(tmp_path, monkeypatch):
+    synced = []
+    journal = Journal(str(tmp_path))
+
+    first = journal.open_segment('btc_mxn', START)
+    second = journal.open_segment('usd_mxn', START)
+    journal.close()
+
+    monkeypatch.setattr(
+        JournalSegment, 'sync', lambda segment: synced.append(segment)
+    )
+
+    for _ in range(3):
+        first.append([1.0])
+
+    second.append([1.0])
+    journal.commit()
+
+    assert sorted(segment.path for segment in synced) == [
+        first.path, second.path
+    ]
+
+    # Nothing written since
+    journal.commit()
+
+    assert len(synced) == 2
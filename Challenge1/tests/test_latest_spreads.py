@@ -0,0 +1,142 @@
+""" Queries of the last observations kept in memory, and their limits
+
+Usage: python -m pytest tests
+"""
+import asyncio
+import json
+import math
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import aiohttp
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from latest_spreads import (LatestSpreads, SpreadRing,  # noqa: E402
+                            downsample, query_spreads, render_spreads,
+                            start_query_server)
+
+START = datetime(2023, 10, 1, tzinfo=timezone.utc)
+
+
+def create_latest_spreads(spreads, size=10):
+    """ Rings with a btc_mxn observation per second from ``START``, None
+    for a gap
+    """
+    latest_spreads = LatestSpreads(size)
+
+    for second, spread in enumerate(spreads):
+        timestamp = START + timedelta(seconds=second)
+
+        if spread is None:
+            latest_spreads.add_gap('btc_mxn', timestamp)
+        else:
+            latest_spreads.add('btc_mxn', timestamp, 100.0, 101.0, spread)
+
+    return latest_spreads
+
+
+def test_the_ring_keeps_the_last_observations():
+    ring = SpreadRing(4)
+
+    for second in range(6):
+        ring.append(float(second), 100.0, 101.0, float(second))
+
+    timestamps, values = ring.select()
+
+    assert len(ring) == 4
+    assert timestamps.tolist() == [2.0, 3.0, 4.0, 5.0]
+    assert values[2].tolist() == [2.0, 3.0, 4.0, 5.0]
+
+    # A range over the end of the arrays
+    assert ring.select(3.0, 5.0)[0].tolist() == [3.0, 4.0]
+
+
+def test_the_latest_observation_is_not_a_gap():
+    ring = create_latest_spreads([0.5, 0.4, None, None]).rings['btc_mxn']
+
+    timestamp, values = ring.latest()
+
+    assert timestamp == (START + timedelta(seconds=1)).timestamp()
+    assert values[2] == 0.4
+    assert SpreadRing(4).latest() is None
+
+
+def test_downsampled_intervals_leave_the_gaps_out():
+    ring = create_latest_spreads([0.1, 0.3, None, None]).rings['btc_mxn']
+
+    intervals, aggregates = downsample(*ring.select(), step=2.0)
+
+    assert intervals.tolist() == [
+        START.timestamp(), START.timestamp() + 2
+    ]
+    assert aggregates['count'].tolist() == [2, 0]
+    assert aggregates['mean'][0] == pytest.approx(0.2)
+    assert aggregates['last'][0] == 0.3
+    assert math.isnan(aggregates['max'][1])
+
+
+@pytest.mark.parametrize('step', ['0.5', 'inf', 'nan'])
+def test_steps_out_of_the_limits_are_rejected(step):
+    latest_spreads = create_latest_spreads([0.1])
+
+    with pytest.raises(ValueError):
+        query_spreads(latest_spreads, 'btc_mxn', {'step': step})
+
+
+def test_queries_of_too_many_intervals_are_rejected():
+    timestamps = np.array([0.0, 100.0])
+    values = np.zeros((3, 2))
+
+    with pytest.raises(ValueError):
+        downsample(timestamps, values, 1.0, max_intervals=100)
+
+    assert len(downsample(timestamps, values, 1.0, max_intervals=101)[0]) == 2
+
+
+def test_rendered_queries_match_the_formatted_ones():
+    latest_spreads = create_latest_spreads([0.1, None, 0.3])
+    query = {'start': START.isoformat(), 'end': '1696118402'}
+
+    response = query_spreads(latest_spreads, 'btc_mxn', query)
+    ring = latest_spreads.rings['btc_mxn']
+
+    assert response['spread'] == [0.1, None]
+    assert json.loads(render_spreads('btc_mxn', *ring.select(
+        START.timestamp(), START.timestamp() + 2
+    ))) == response
+
+
+def test_the_service_answers_bad_queries_with_400(tmp_path):
+    latest_spreads = create_latest_spreads([0.1, 0.2])
+    path = str(tmp_path / 'spreads.sock')
+
+    async def get(session, url):
+        async with session.get(url) as response:
+            return response.status, await response.text()
+
+    async def run():
+        runner = await start_query_server(latest_spreads, path=path)
+
+        try:
+            async with aiohttp.ClientSession(
+                connector=aiohttp.UnixConnector(path=path)
+            ) as session:
+                return [
+                    await get(session, f'http://localhost{url}')
+                    for url in [
+                        '/spreads/btc_mxn?step=0.1',
+                        '/spreads/usd_mxn',
+                        '/spreads/btc_mxn/latest',
+                    ]
+                ]
+        finally:
+            await runner.cleanup()
+
+    bad_step, unknown_book, latest = asyncio.run(run())
+
+    assert bad_step[0] == 400
+    assert unknown_book[0] == 404
+    assert json.loads(latest[1])['spread'] == 0.2
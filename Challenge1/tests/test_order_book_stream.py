@@ -0,0 +1,118 @@
+""" Sync of the local order books of the diff-orders stream
+
+Usage: python -m pytest tests
+"""
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import order_book_stream  # noqa: E402
+from order_book_stream import (BUY, DIFF_ORDERS, SELL,  # noqa: E402
+                               LocalOrderBook, OrderBookStream, SequenceGap)
+
+
+def snapshot(sequence, bid=100.0, ask=101.0):
+    """ Payload of an ``order_book`` response with one order per side """
+    return {
+        'bids': [{'oid': 'b', 'price': str(bid), 'amount': '1'}],
+        'asks': [{'oid': 'a', 'price': str(ask), 'amount': '1'}],
+        'updated_at': '2023-10-01T00:00:00+00:00',
+        'sequence': str(sequence),
+    }
+
+
+def diff(sequence, oid='c', side=BUY, price=100.5, amount='1'):
+    """ ``diff-orders`` message with one change """
+    return {
+        'type': DIFF_ORDERS,
+        'book': 'btc_mxn',
+        'sequence': str(sequence),
+        'payload': [
+            {'o': oid, 't': side, 'r': str(price), 'a': amount, 's': 'open'}
+        ],
+    }
+
+
+class SnapshotFetcher:
+    """ Hand out the given snapshots, one per request """
+
+    def __init__(self, snapshots):
+        self.snapshots = list(snapshots)
+
+    async def fetch_raw(self, path):
+        return json.dumps({'payload': self.snapshots.pop(0)})
+
+
+async def ignore(book, data, tick_time):
+    pass
+
+
+def test_a_missing_sequence_is_a_gap():
+    order_book = LocalOrderBook('btc_mxn')
+    order_book.load_snapshot(snapshot(10))
+
+    # Already in the snapshot
+    assert not order_book.apply(diff(9))
+    assert order_book.apply(diff(11))
+    assert order_book.bids.highest() == 100.5
+
+    with pytest.raises(SequenceGap):
+        order_book.apply(diff(13))
+
+    assert order_book.sequence == 11
+
+
+def test_a_gap_syncs_the_book_again(monkeypatch):
+    delays = []
+    monkeypatch.setattr(
+        order_book_stream, 'reconnect_delay',
+        lambda attempt: delays.append(attempt) or 0
+    )
+
+    # The first snapshot is older than the first diff kept
+    stream = OrderBookStream(
+        ['btc_mxn'], SnapshotFetcher([snapshot(10), snapshot(13)]), ignore
+    )
+    order_book = stream.order_books['btc_mxn']
+
+    async def run():
+        order_book.load_snapshot(snapshot(10))
+
+        await stream.handle_message(diff(12))
+
+        assert not order_book.synced
+        assert stream.pending['btc_mxn'] == [diff(12)]
+
+        await stream.handle_message(diff(13, oid='d', side=SELL,
+                                         price=100.8))
+        await stream.handle_message(diff(14))
+
+        await stream.syncs['btc_mxn']
+
+    asyncio.run(run())
+
+    # The second snapshot has the 13th diff, the 14th is applied on it
+    assert order_book.sequence == 14
+    assert order_book.asks.lowest() == 101.0
+    assert order_book.bids.highest() == 100.5
+    assert 'btc_mxn' not in stream.pending
+    assert 'btc_mxn' not in stream.syncs
+
+    # It waited before loading a newer snapshot
+    assert delays == [0]
+
+
+def test_the_diffs_kept_for_the_sync_are_bounded():
+    stream = OrderBookStream(
+        ['btc_mxn'], SnapshotFetcher([]), ignore, max_pending=3
+    )
+
+    for sequence in range(1, 5):
+        stream.keep_pending('btc_mxn', diff(sequence))
+
+    # The kept ones were dropped, the sync waits for a newer snapshot
+    assert stream.pending['btc_mxn'] == [diff(4)]
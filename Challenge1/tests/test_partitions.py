@@ -0,0 +1,89 @@
+""" Partition numbers of the hour folders
+
+Usage: python -m pytest tests
+"""
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from partitions import (MANIFEST_FILE_NAME, RESERVED_PARTITIONS,  # noqa: E402
+                        PartitionAllocator)
+
+
+def test_numbers_are_never_handed_out_twice(tmp_path, monkeypatch):
+    folder = str(tmp_path)
+    saves = []
+
+    allocator = PartitionAllocator()
+    save_manifest = allocator.save_manifest
+
+    monkeypatch.setattr(
+        allocator, 'save_manifest',
+        lambda folder: saves.append(folder) or save_manifest(folder)
+    )
+
+    numbers = [
+        allocator.next_partition(folder, 'part-') for _ in range(20)
+    ]
+
+    assert numbers == list(range(20))
+    assert len(saves) == 2
+
+    # A restart skips the reserved numbers not handed out
+    restarted = PartitionAllocator()
+
+    assert restarted.next_partition(folder, 'part-') == (
+        2 * RESERVED_PARTITIONS
+    )
+
+
+def test_least_recently_used_folders_are_evicted(tmp_path):
+    allocator = PartitionAllocator(cached_folders=2)
+    folders = []
+
+    for hour in range(3):
+        folder = tmp_path / f'{hour:02d}'
+        folder.mkdir()
+        folders.append(str(folder))
+
+        allocator.next_partition(str(folder), 'part-')
+
+    assert list(allocator.manifests) == folders[1:]
+    assert os.path.exists(os.path.join(folders[0], MANIFEST_FILE_NAME))
+
+    # Read again from its manifest
+    assert allocator.next_partition(folders[0], 'part-') == (
+        RESERVED_PARTITIONS
+    )
+
+
+def test_last_partition_after_a_restart_is_the_last_file(tmp_path):
+    folder = str(tmp_path)
+    allocator = PartitionAllocator()
+
+    for _ in range(3):
+        partition = allocator.next_partition(folder, 'part-')
+        (tmp_path / f'part-{partition}.csv').write_text('')
+
+    assert allocator.last_partition(folder, 'part-') == 2
+
+    # Not the end of the reserved block, which has no file
+    restarted = PartitionAllocator()
+
+    assert restarted.last_partition(folder, 'part-') == 2
+    assert restarted.next_partition(folder, 'part-') == RESERVED_PARTITIONS
+    assert restarted.last_partition(folder, 'part-') == RESERVED_PARTITIONS
+
+
+def test_last_partition_of_an_evicted_folder_is_the_last_file(tmp_path):
+    allocator = PartitionAllocator(cached_folders=1)
+    first = tmp_path / '00'
+    second = tmp_path / '01'
+    first.mkdir()
+    second.mkdir()
+
+    allocator.next_partition(str(first), 'part-')
+    (first / 'part-0.csv').write_text('')
+    allocator.next_partition(str(second), 'part-')
+
+    assert allocator.last_partition(str(first), 'part-') == 0
@@ -0,0 +1,57 @@
+""" Pruning of the hours read by the reader
+
+Usage: python -m pytest tests
+"""
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from reader import list_spread_files, read_spread_rows  # noqa: E402
+from window_writer import WindowWriter  # noqa: E402
+
+START = datetime(2023, 10, 1, 1, tzinfo=timezone.utc)
+
+
+def save_quiet_book(updated_at, first_tick, ticks):
+    """ Save the ticks of a book last updated at ``updated_at`` """
+    writer = WindowWriter(size=ticks)
+
+    for second in range(first_tick, first_tick + ticks):
+        for window in writer.add(
+            'btc_mxn', updated_at, 100.0 + second, 101.0, 1.0,
+            tick_time=START + timedelta(seconds=second)
+        ):
+            window.flush()
+
+
+def test_rows_are_read_by_their_tick_time(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    # Ticks of the 01 hour of a book quiet for a day
+    save_quiet_book(START - timedelta(days=1), 0, 2)
+
+    rows = list(read_spread_rows('btc_mxn', START,
+                                 START + timedelta(hours=1)))
+
+    assert [row.bid for row in rows] == [100.0, 101.0]
+    assert rows[0].orderbook_timestamp == START - timedelta(days=1)
+    assert list(read_spread_rows(
+        'btc_mxn', START - timedelta(days=1), START
+    )) == []
+
+
+def test_only_the_hours_of_the_range_are_listed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    # A file in the 00, 01 and 02 hours
+    for hour in [-1, 0, 1]:
+        save_quiet_book(START, hour * 3600, 1)
+
+    files = list(list_spread_files(
+        'btc_mxn', START, START + timedelta(hours=1)
+    ))
+
+    assert [os.path.basename(path) for path in files] == [
+        'bid_ask_spread-btc_mxn-20231001-01-part-0.csv'
+    ]
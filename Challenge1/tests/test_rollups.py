@@ -0,0 +1,109 @@
+""" Rollups of the spread in intervals of every tier
+
+Usage: python -m pytest tests
+"""
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from rollups import RollupWriter, read_rollups  # noqa: E402
+
+START = datetime(2023, 10, 1, tzinfo=timezone.utc)
+
+
+def add_spreads(writer, spreads, first_second=0):
+    """ Add a spread per second from ``START``, and save the files of the
+    closed rollups
+    """
+    for second, spread in enumerate(spreads, first_second):
+        for rollup_file in writer.add(
+            'btc_mxn', START + timedelta(seconds=second), spread
+        ):
+            rollup_file.flush()
+
+
+def stop(writer):
+    for rollup_file in writer.pop_all():
+        rollup_file.flush()
+
+
+def test_an_interval_saved_by_two_runs_is_merged(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    # Stopped in the middle of the first minute
+    writer = RollupWriter(['1m'])
+    add_spreads(writer, [0.1, 0.3])
+    stop(writer)
+
+    writer = RollupWriter(['1m'])
+    add_spreads(writer, [0.5, 0.7], first_second=30)
+    stop(writer)
+
+    rollups = list(read_rollups(
+        'btc_mxn', '1m', START, START + timedelta(hours=1)
+    ))
+
+    assert len(rollups) == 1
+    assert rollups[0].count == 4
+    assert rollups[0].mean == pytest.approx(0.4)
+    assert (rollups[0].min, rollups[0].max) == (0.1, 0.7)
+    assert rollups[0].last == 0.7
+
+    # The biggest p99 of the parts, the one of [0.5, 0.7]
+    assert rollups[0].p99 == pytest.approx(0.5, rel=0.01)
+
+
+def test_rollups_are_closed_on_the_interval_boundaries(tmp_path,
+                                                       monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    writer = RollupWriter(['1m', '10m'])
+
+    # A late observation stays in the interval in progress
+    add_spreads(writer, [0.1, 0.2])
+    add_spreads(writer, [0.4, 0.3], first_second=60)
+    writer.add('btc_mxn', START + timedelta(seconds=59), 0.5)
+
+    assert writer.current('btc_mxn', '1m').count == 3
+    assert writer.current('btc_mxn', '10m').count == 5
+
+    stop(writer)
+
+    rollups = list(read_rollups(
+        'btc_mxn', '1m', START, START + timedelta(hours=1)
+    ))
+
+    assert [rollup.timestamp for rollup in rollups] == [
+        START, START + timedelta(minutes=1)
+    ]
+    assert [rollup.count for rollup in rollups] == [2, 3]
+    assert rollups[1].last == 0.5
+    assert rollups[1].max == 0.5
+
+    ten_minutes = list(read_rollups(
+        'btc_mxn', '10m', START, START + timedelta(days=1)
+    ))
+
+    assert len(ten_minutes) == 1
+    assert ten_minutes[0].mean == pytest.approx(0.3)
+
+
+def test_only_the_range_is_read(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    writer = RollupWriter(['1m'])
+
+    add_spreads(writer, [0.1] * 3 * 60)
+    stop(writer)
+
+    rollups = list(read_rollups(
+        'btc_mxn', '1m', START + timedelta(minutes=1),
+        START + timedelta(minutes=2)
+    ))
+
+    assert [rollup.timestamp for rollup in rollups] == [
+        START + timedelta(minutes=1)
+    ]
+    assert rollups[0].count == 60
+    assert rollups[0].p50 == pytest.approx(0.1, rel=0.01)
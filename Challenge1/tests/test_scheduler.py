@@ -0,0 +1,105 @@
+""" Ticks on the wall clock, and the gaps of the ticks missed
+
+Usage: python -m pytest tests
+"""
+import math
+import os
+import sys
+from datetime import datetime, timezone
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import scheduler  # noqa: E402
+from scheduler import TickScheduler  # noqa: E402
+from window_writer import WindowWriter  # noqa: E402
+
+
+class FakeClock:
+    """ Wall and monotonic clocks that only move when slept """
+
+    def __init__(self, wall_time, monotonic_time):
+        self.wall_time = wall_time
+        self.monotonic_time = monotonic_time
+
+    def time(self):
+        return self.wall_time
+
+    def monotonic(self):
+        return self.monotonic_time
+
+    def sleep(self, seconds):
+        self.wall_time = self.wall_time + seconds
+        self.monotonic_time = self.monotonic_time + seconds
+
+
+def create_scheduler(monkeypatch, wall_time=1696118400.3, interval=1.0):
+    clock = FakeClock(wall_time, 50.0)
+    monkeypatch.setattr(scheduler, 'time', clock)
+
+    return TickScheduler(interval), clock
+
+
+def test_ticks_are_on_the_whole_seconds(monkeypatch):
+    tick_scheduler, clock = create_scheduler(monkeypatch)
+
+    # 2023-10-01 00:00:00.3: tick 0 is the next second
+    assert tick_scheduler.tick_time(0) == datetime(
+        2023, 10, 1, 0, 0, 1, tzinfo=timezone.utc
+    )
+    assert math.isclose(tick_scheduler.due_time(3), 53.7)
+
+    # Work done in a tick doesn't delay the next one
+    tick_scheduler.wait_sync(0)
+    clock.sleep(0.4)
+    tick_scheduler.wait_sync(1)
+
+    assert math.isclose(clock.monotonic(), 51.7)
+
+
+def test_the_first_tick_is_aligned(monkeypatch):
+    tick_scheduler, _ = create_scheduler(monkeypatch)
+
+    tick = tick_scheduler.first_tick(alignment=600)
+
+    assert tick_scheduler.tick_time(tick) == datetime(
+        2023, 10, 1, 0, 10, tzinfo=timezone.utc
+    )
+
+
+def test_ticks_over_are_skipped(monkeypatch):
+    tick_scheduler, clock = create_scheduler(monkeypatch)
+
+    tick_scheduler.wait_sync(1)
+
+    assert tick_scheduler.next_tick(1) == (2, [])
+
+    # Tick 1 took 3.5 seconds: ticks 2 and 3 are over, 4 is in progress
+    clock.sleep(3.5)
+
+    assert tick_scheduler.next_tick(1) == (4, [2, 3])
+
+
+def test_ticks_over_are_saved_as_gaps(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tick_scheduler, clock = create_scheduler(monkeypatch)
+    writer = WindowWriter(size=5)
+
+    tick = tick_scheduler.first_tick()
+    tick_scheduler.wait_sync(tick)
+    tick_time = tick_scheduler.tick_time(tick)
+    writer.add('btc_mxn', tick_time, 100.0, 101.0, 1.0, tick_time=tick_time)
+
+    clock.sleep(3.5)
+    tick, skipped_ticks = tick_scheduler.next_tick(tick)
+
+    for skipped in skipped_ticks:
+        writer.add_gap('btc_mxn', tick_scheduler.tick_time(skipped))
+
+    window = writer.windows['btc_mxn']
+
+    # One row per second of the wall clock, with or without observation
+    assert [window.get_tick_time(index) for index in range(3)] == [
+        tick_scheduler.tick_time(skipped) for skipped in range(3)
+    ]
+    assert window.bids[0] == 100.0
+    assert all(math.isnan(bid) for bid in window.bids[1:])
+    assert tick == 3
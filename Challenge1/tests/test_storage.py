@@ -0,0 +1,107 @@
+""" Spool of the files uploaded to S3, and the delayed removals
+
+Usage: python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from storage import (REMOVAL_DELAY, REMOVAL_SUFFIX,  # noqa: E402
+                     S3Storage)
+
+KEY = os.path.join('btc_mxn', '20231001', '00', 'part-0.csv')
+
+
+def create_storage(tmp_path):
+    """ Storage of a Data Lake in ``tmp_path`` that records its requests
+    instead of sending them
+    """
+    storage = S3Storage('http://localhost:5000', 'data-lake',
+                        directory=str(tmp_path))
+    storage.requests = []
+
+    async def request(session, method, url, content=b'', headers=None):
+        storage.requests.append((method, url, content))
+        return {}, b''
+
+    storage.request = request
+
+    return storage
+
+
+def save(storage, tmp_path, content):
+    path_to_file = os.path.join(str(tmp_path), 'data_lake', KEY)
+    os.makedirs(os.path.dirname(path_to_file), exist_ok=True)
+
+    storage.save(path_to_file, content)
+
+    return path_to_file
+
+
+def age(path_to_entry, seconds):
+    """ Make an entry of the spool older """
+    modified = time.time() - seconds
+    os.utime(path_to_entry, (modified, modified))
+
+
+def test_saved_files_are_uploaded_from_the_spool(tmp_path):
+    storage = create_storage(tmp_path)
+    path_to_file = save(storage, tmp_path, 'first')
+    save(storage, tmp_path, 'second')
+
+    # One entry per key, with the last content
+    assert storage.list_spool() == [
+        (storage.get_spool_entry(path_to_file), KEY)
+    ]
+
+    files, failed = asyncio.run(storage.upload_spool(None))
+
+    assert (files, failed) == (1, 0)
+    assert storage.requests == [
+        ('PUT', storage.get_url(KEY), b'second')
+    ]
+    assert storage.list_spool() == []
+
+    # The local Data Lake keeps the file
+    with open(path_to_file) as file:
+        assert file.read() == 'second'
+
+
+def test_removals_wait_in_the_spool(tmp_path):
+    storage = create_storage(tmp_path)
+    path_to_file = save(storage, tmp_path, 'content')
+
+    storage.remove(path_to_file)
+
+    path_to_removal = storage.get_spool_entry(path_to_file) + REMOVAL_SUFFIX
+
+    # The pending upload is dropped and the removal waits
+    assert not os.path.exists(path_to_file)
+    assert os.path.exists(path_to_removal)
+    assert storage.list_spool() == []
+
+    age(path_to_removal, REMOVAL_DELAY + 1)
+
+    assert storage.list_spool() == [(path_to_removal, KEY)]
+
+    asyncio.run(storage.upload_spool(None))
+
+    assert storage.requests == [('DELETE', storage.get_url(KEY), b'')]
+    assert not os.path.exists(path_to_removal)
+
+
+def test_a_file_saved_again_cancels_its_removal(tmp_path):
+    storage = create_storage(tmp_path)
+    path_to_file = save(storage, tmp_path, 'content')
+
+    storage.remove(path_to_file)
+    save(storage, tmp_path, 'merged')
+
+    path_to_removal = storage.get_spool_entry(path_to_file) + REMOVAL_SUFFIX
+
+    assert not os.path.exists(path_to_removal)
+    assert storage.list_spool() == [
+        (storage.get_spool_entry(path_to_file), KEY)
+    ]
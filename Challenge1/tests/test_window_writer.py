@@ -0,0 +1,101 @@
+""" Windows of 10 minutes of observations, one file each
+
+Usage: python -m pytest tests
+"""
+import math
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from journal import Journal  # noqa: E402
+from window_writer import WindowWriter  # noqa: E402
+
+START = datetime(2023, 10, 1, tzinfo=timezone.utc)
+
+
+def add_ticks(writer, seconds):
+    """ Add an observation per tick, seconds from ``START``. Return the
+    windows closed meanwhile
+    """
+    closed_windows = []
+
+    for second in seconds:
+        tick_time = START + timedelta(seconds=second)
+        closed_windows.extend(writer.add(
+            'btc_mxn', tick_time, 100.0, 101.0, 1.0, tick_time=tick_time
+        ))
+
+    return closed_windows
+
+
+def read_lines(path_to_file):
+    with open(path_to_file) as file:
+        return file.read().splitlines()
+
+
+def test_windows_are_cut_on_the_boundaries(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    writer = WindowWriter()
+
+    # Ticks missed at the end of the first window
+    closed_windows = add_ticks(writer, [0, 1, 2, 600])
+
+    assert len(closed_windows) == 1
+    assert closed_windows[0].start == START
+    assert len(closed_windows[0]) == 3
+    assert writer.windows['btc_mxn'].start == START + timedelta(minutes=10)
+
+    # A late tick stays in the window in progress
+    assert add_ticks(writer, [599]) == []
+    assert len(writer.windows['btc_mxn']) == 2
+
+
+def test_a_window_is_saved_in_one_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    writer = WindowWriter(size=2)
+
+    paths = [window.flush() for window in add_ticks(writer, [0, 1, 2, 3])]
+    writer.add_gap('btc_mxn', START + timedelta(seconds=4))
+
+    # The windows of the same hour get the next partitions
+    assert [os.path.basename(path) for path in paths] == [
+        'bid_ask_spread-btc_mxn-20231001-00-part-0.csv',
+        'bid_ask_spread-btc_mxn-20231001-00-part-1.csv',
+    ]
+    assert read_lines(paths[1]) == [
+        'timestamp,book,bid,ask,spread,tick_time',
+        '"2023-10-01 00:00:02+00:00","btc_mxn",100.0,101.0,1.0,'
+        '"2023-10-01 00:00:02+00:00"',
+        '"2023-10-01 00:00:03+00:00","btc_mxn",100.0,101.0,1.0,'
+        '"2023-10-01 00:00:03+00:00"',
+    ]
+
+    # The window not full yet, with its gap
+    windows = writer.pop_all()
+
+    assert len(windows) == 1
+    assert math.isnan(windows[0].spreads[0])
+    assert writer.windows == {}
+
+
+def test_windows_over_are_recovered_and_saved(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    folder = str(tmp_path / 'journal')
+
+    journal = Journal(folder)
+    add_ticks(WindowWriter(journal=journal), [0, 1, 2])
+    journal.close()
+
+    # A crash: the window was not saved
+    writer = WindowWriter(journal=Journal(folder))
+    windows = writer.recover(now=START + timedelta(hours=1))
+
+    assert len(windows) == 1
+    assert writer.windows == {}
+
+    path_to_file = windows[0].flush()
+    writer.journal.close()
+
+    assert len(read_lines(path_to_file)) == 4
+    assert os.listdir(folder) == []
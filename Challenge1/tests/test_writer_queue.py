@@ -0,0 +1,110 @@
+""" Bounded queue of the single writer of every book
+
+Usage: python -m pytest tests
+"""
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from writer_queue import (BLOCK, DROP_NEWEST, DROP_OLDEST,  # noqa: E402
+                          BookWriter, BookWriters)
+
+
+class BlockedWrites:
+    """ ``write_batch`` that waits to be released, and keeps the batches
+    written """
+
+    def __init__(self):
+        self.batches = []
+        self.writing = threading.Event()
+        self.released = threading.Event()
+
+    def __call__(self, book, observations):
+        self.writing.set()
+        self.released.wait(5)
+        self.batches.append(list(observations))
+
+
+def blocked_writer(policy, queue_size=2, batch_size=60):
+    """ Writer busy with the observation 0, with a full queue of
+    ``queue_size`` more
+    """
+    writes = BlockedWrites()
+    writer = BookWriter('btc_mxn', writes, queue_size, batch_size, policy)
+
+    writer.put(0)
+    assert writes.writing.wait(5)
+
+    for observation in range(1, queue_size + 1):
+        assert writer.put(observation)
+
+    return writer, writes
+
+
+@pytest.mark.parametrize('policy, written', [
+    (DROP_NEWEST, [[0], [1, 2]]),
+    (DROP_OLDEST, [[0], [2, 3]]),
+])
+def test_a_full_queue_drops_observations(policy, written):
+    writer, writes = blocked_writer(policy)
+
+    assert not writer.put(3)
+    assert writer.dropped == 1
+
+    writes.released.set()
+    writer.close()
+
+    assert writes.batches == written
+
+
+def test_a_full_queue_blocks_the_producer():
+    writer, writes = blocked_writer(BLOCK)
+
+    producer = threading.Thread(target=writer.put, args=(3,))
+    producer.start()
+    producer.join(0.2)
+
+    # Waiting for room in the queue
+    assert producer.is_alive()
+
+    writes.released.set()
+    producer.join(5)
+    writer.close()
+
+    assert not producer.is_alive()
+    assert sum(writes.batches, []) == [0, 1, 2, 3]
+    assert writer.dropped == 0
+
+
+def test_batches_are_bounded():
+    writer, writes = blocked_writer(BLOCK, queue_size=5, batch_size=2)
+
+    writes.released.set()
+    writer.close()
+
+    assert writes.batches == [[0], [1, 2], [3, 4], [5]]
+
+
+def test_every_book_has_its_writer():
+    batches = []
+    writers = BookWriters(
+        lambda book, observations: batches.append((book, observations))
+    )
+
+    writers.put('btc_mxn', 1)
+    writers.put('usd_mxn', 2)
+
+    assert set(writers.writers) == {'btc_mxn', 'usd_mxn'}
+
+    writers.close_all()
+
+    assert sorted(batches) == [('btc_mxn', [1]), ('usd_mxn', [2])]
+    assert writers.writers == {}
+
+
+def test_unknown_policies_are_rejected():
+    with pytest.raises(ValueError):
+        BookWriter('btc_mxn', print, policy='drop_all')
@@ -0,0 +1,92 @@
+""" Statistics of the spread files, and the files they prune
+
+Usage: python -m pytest tests
+"""
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from reader import read_spread_file  # noqa: E402
+from window_writer import SpreadWindow  # noqa: E402
+from zone_maps import (may_have_rows, read_statistics,  # noqa: E402
+                       window_statistics)
+
+START = datetime(2023, 10, 1, tzinfo=timezone.utc)
+END = START + timedelta(hours=1)
+
+
+def create_window(spreads):
+    """ Window with a tick per second from ``START``, None for a gap """
+    window = SpreadWindow('btc_mxn', len(spreads))
+
+    for second, spread in enumerate(spreads):
+        tick_time = START + timedelta(seconds=second)
+
+        if spread is None:
+            window.append_gap(tick_time)
+        else:
+            window.append(START, 100.0, 101.0 + second, spread,
+                          tick_time=tick_time)
+
+    return window
+
+
+def test_gaps_are_left_out_of_the_statistics():
+    statistics = window_statistics(create_window([0.5, None, 0.2]))
+
+    assert statistics['rows'] == 3
+    assert (statistics['min_spread'], statistics['max_spread']) == (0.2, 0.5)
+    assert (statistics['min_ask'], statistics['max_ask']) == (101.0, 103.0)
+    assert statistics['min_tick_time'] == str(START)
+    assert statistics['max_tick_time'] == str(START + timedelta(seconds=2))
+
+    gaps = window_statistics(create_window([None]))
+
+    assert gaps['max_spread'] is None
+    assert window_statistics(SpreadWindow('btc_mxn')) == {'rows': 0}
+
+
+def test_files_outside_the_filters_are_skipped():
+    statistics = window_statistics(create_window([0.5, 0.2]))
+
+    assert may_have_rows(statistics, START, END)
+    assert not may_have_rows(statistics, END, END + timedelta(hours=1))
+    assert not may_have_rows(statistics, START - timedelta(hours=1), START)
+    assert may_have_rows(statistics, START, END, min_spread=0.4)
+    assert not may_have_rows(statistics, START, END, min_spread=0.6)
+    assert not may_have_rows(statistics, START, END, max_spread=0.1)
+
+    # Without statistics the file is read, with only gaps no spread matches
+    assert may_have_rows(None, START, END, min_spread=0.6)
+    assert not may_have_rows(
+        window_statistics(create_window([None])), START, END, min_spread=0
+    )
+
+
+def test_statistics_without_tick_times_use_the_timestamps():
+    statistics = {
+        'rows': 1,
+        'min_timestamp': str(START),
+        'max_timestamp': str(START),
+        'min_spread': 0.5,
+        'max_spread': 0.5,
+    }
+
+    assert may_have_rows(statistics, START, END)
+    assert not may_have_rows(statistics, END, END + timedelta(hours=1))
+
+
+def test_pruned_files_are_not_opened(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    path_to_file = create_window([0.5, 0.2]).flush()
+
+    assert read_statistics(path_to_file)['rows'] == 2
+
+    # Unreadable: only its statistics can be read
+    with open(path_to_file, 'w') as file:
+        file.write('not a spread file')
+
+    assert read_spread_file(path_to_file, START, END, min_spread=0.6) == []
+    assert read_spread_file(path_to_file, END, END + timedelta(hours=1)) == []
@@ -0,0 +1,137 @@
+import json
+import re
+from collections import namedtuple
+
+# metrics: depth metrics of the book, see depth.DepthEngine
+TopOfBook = namedtuple(
+    'TopOfBook', ['updated_at', 'sequence', 'bid', 'ask', 'metrics'],
+    defaults=[None]
+)
+
+UPDATED_AT_PATTERN = re.compile(rb'"updated_at"\s*:\s*"([^"]+)"')
+SEQUENCE_PATTERN = re.compile(rb'"sequence"\s*:\s*"?(\d+)')
+
+# Key of the side that starts at the end of the searched range
+SIDE_KEY_PATTERN = re.compile(rb'"(bids|asks)"\s*:\s*\[$')
+
+# First order of a side (right after its "["), None if the side is empty
+FIRST_ORDER_PATTERN = re.compile(rb'\s*(\{[^}]*\})?')
+
+
+def get_top_price(orders):
+    """ Get the price of the first order of a side
+
+    The API sorts the bids from the highest price and the asks from the
+    lowest one, so the first order has the best price.
+
+    :param orders: bid or ask orders, as sorted by the API.
+    :type orders: list
+    """
+    return float(orders[0]['price']) if orders else None
+
+
+def locate_sides(content):
+    """ Get the ``[start, end]`` positions of the two sides of the response
+
+    The orders have no nested lists, so the brackets of the response are
+    only the ones of the sides. They are located with single byte searches,
+    which skip the depth of the book very fast.
+
+    :param content: raw response body.
+    :type content: bytes
+    """
+    first_start = content.find(b'[')
+    first_end = content.find(b']', first_start)
+    second_start = content.find(b'[', first_end)
+    second_end = content.find(b']', second_start)
+
+    if min(first_start, first_end, second_start, second_end) < 0:
+        raise ValueError('Order book sides not found')
+
+    return (first_start, first_end), (second_start, second_end)
+
+
+def locate_bids_and_asks(content):
+    """ Get the ``[start, end]`` positions of the bids and of the asks
+
+    :param content: raw response body.
+    :type content: bytes
+    """
+    first_side, second_side = locate_sides(content)
+
+    first_key = SIDE_KEY_PATTERN.search(content, 0, first_side[0] + 1)
+    second_key = SIDE_KEY_PATTERN.search(
+        content, first_side[1], second_side[0] + 1
+    )
+
+    if first_key is None or second_key is None:
+        raise ValueError('Order book sides not found')
+
+    sides = {
+        first_key.group(1): first_side,
+        second_key.group(1): second_side,
+    }
+
+    return sides[b'bids'], sides[b'asks']
+
+
+def read_top_price(content, side_start):
+    """ Get the price of the first order of the side that starts there
+
+    :param content: raw response body.
+    :type content: bytes
+
+    :param side_start: position of the ``[`` of the side.
+    :type side_start: int
+    """
+    first_order = FIRST_ORDER_PATTERN.match(content, side_start + 1).group(1)
+
+    if first_order is None:
+        return None
+
+    # Only the first order is parsed, the rest of the side is never read
+    return float(json.loads(first_order)['price'])
+
+
+def read_top_of_book(content):
+    """ Get the best bid and ask from the raw order book response
+
+    Only the fields needed for the spread are parsed, the depth of the book
+    is never read nor converted to Python objects. Responses with an
+    unexpected layout (for example errors) are fully parsed.
+
+    :param content: raw response body.
+    :type content: bytes
+    """
+    try:
+        bids, asks = locate_bids_and_asks(content)
+        first_side, second_side = sorted([bids, asks])
+
+        # Everything but the sides: a few hundred bytes
+        header = (
+            content[:first_side[0] + 1] +
+            content[first_side[1]:second_side[0] + 1] +
+            content[second_side[1]:]
+        )
+
+        updated_at = UPDATED_AT_PATTERN.search(header)
+        sequence = SEQUENCE_PATTERN.search(header)
+
+        if updated_at is None or sequence is None:
+            raise ValueError('Order book fields not found')
+
+        return TopOfBook(
+            updated_at.group(1).decode(),
+            sequence.group(1).decode(),
+            read_top_price(content, bids[0]),
+            read_top_price(content, asks[0])
+        )
+    except (ValueError, KeyError):
+        payload = json.loads(content)['payload']
+
+        return TopOfBook(
+            payload['updated_at'],
+            str(payload['sequence']),
+            get_top_price(payload['bids']),
+            get_top_price(payload['asks'])
+        )
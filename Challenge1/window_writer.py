@@ -0,0 +1,472 @@
+import math
+import os
+from array import array
+from datetime import datetime, timedelta, timezone
+
+from data_lake import generate_file_name, generate_path_to_folder
+from file_formats import FILE_FORMATS
+from partitions import partition_allocator
+from rollups import floor_timestamp
+from storage import save_file
+from zone_maps import window_statistics, write_statistics
+
+FILE_HEADERS = 'timestamp,book,bid,ask,spread,tick_time'
+
+# Observations per file: one per second during 10 minutes
+WINDOW_SIZE = 600
+
+# Windows are cut on the boundaries of this length of wall clock
+WINDOW_DURATION = timedelta(minutes=10)
+
+# Format of the files: csv, parquet or arrow
+FILE_FORMAT = 'csv'
+
+
+class SpreadWindow:
+    """ Observations of one order book that will be saved in the same file
+
+    The values are kept in typed arrays (8 bytes each) instead of a list of
+    rows, and the whole window is written at once by ``flush``.
+
+    :param book: name of the order book.
+    :type book: str
+
+    :param size: observations that fill the window.
+        Default: ``WINDOW_SIZE``
+    :type size: int
+
+    :param file_format: format of the file, a key of ``FILE_FORMATS``.
+        Default: ``FILE_FORMAT``
+    :type file_format: str
+
+    :param metric_columns: names of the extra metrics saved after the
+        spread, see ``depth.DepthEngine.columns``.
+        Default: no extra metrics
+    :type metric_columns: list
+
+    :param start: start of the window, names the file.
+        Default: the timestamp of the first observation
+    :type start: datetime
+
+    :param journal: segment where every observation is journaled, removed
+        once the window is saved.
+        Default: not journaled
+    :type journal: journal.JournalSegment
+    """
+
+    def __init__(self, book, size=WINDOW_SIZE, file_format=FILE_FORMAT,
+                 metric_columns=(), start=None, journal=None):
+        self.book = book
+        self.size = size
+        self.start = start
+        self.journal = journal
+        self.file_format = FILE_FORMATS[file_format]
+        self.metric_columns = list(metric_columns)
+        self.timestamps = array('d')
+        self.bids = array('d')
+        self.asks = array('d')
+        self.spreads = array('d')
+
+        # Seconds since the epoch of the tick of every observation, NaN if
+        # unknown (the rows saved before they were kept)
+        self.tick_times = array('d')
+
+        # One row of metrics per observation, one after the other
+        self.metrics = array('d')
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def is_full(self):
+        return len(self) >= self.size
+
+    def append(self, timestamp, bid, ask, spread, metrics=None,
+               tick_time=None):
+        """ Add an observation to the window
+
+        :param timestamp: order book timestamp.
+        :type timestamp: datetime
+
+        :param bid: best bid price.
+        :type bid: float
+
+        :param ask: best ask price.
+        :type ask: float
+
+        :param spread: bid-ask spread in percent.
+        :type spread: float
+
+        :param metrics: values of the ``metric_columns``. NaN if None.
+        :type metrics: list
+
+        :param tick_time: wall clock time of the tick, the identity of the
+            observation.
+            Default: unknown
+        :type tick_time: datetime
+        """
+        self.append_values([
+            timestamp.timestamp(), bid, ask, spread,
+            math.nan if tick_time is None else tick_time.timestamp()
+        ], metrics)
+
+    def append_values(self, values, metrics=None):
+        """ Add an observation as numbers: the timestamp, bid, ask, spread
+        and tick time (seconds since the epoch, NaN if unknown)
+
+        :param values: numbers of the observation.
+        :type values: list
+
+        :param metrics: values of the ``metric_columns``. NaN if None.
+        :type metrics: list
+        """
+        timestamp, bid, ask, spread, tick_time = values
+
+        self.timestamps.append(timestamp)
+        self.bids.append(bid)
+        self.asks.append(ask)
+        self.spreads.append(spread)
+        self.tick_times.append(tick_time)
+
+        if self.metric_columns:
+            if metrics is None:
+                metrics = [math.nan] * len(self.metric_columns)
+
+            self.metrics.extend(metrics)
+
+        if self.journal is not None:
+            if metrics is not None:
+                values = list(values) + [float(value) for value in metrics]
+
+            self.journal.append(values)
+
+    def append_gap(self, timestamp):
+        """ Add a tick without observation: NaN bid, ask, spread and metrics
+
+        :param timestamp: time of the tick.
+        :type timestamp: datetime
+        """
+        self.append(timestamp, math.nan, math.nan, math.nan,
+                    tick_time=timestamp)
+
+    def get_timestamp(self, index):
+        """ Get the timestamp of an observation as an UTC datetime
+
+        :param index: position of the observation in the window.
+        :type index: int
+        """
+        return datetime.fromtimestamp(self.timestamps[index], timezone.utc)
+
+    def get_tick_time(self, index):
+        """ Get the tick time of an observation as an UTC datetime, None if
+        unknown
+
+        :param index: position of the observation in the window.
+        :type index: int
+        """
+        tick_time = self.tick_times[index]
+
+        if math.isnan(tick_time):
+            return None
+
+        return datetime.fromtimestamp(tick_time, timezone.utc)
+
+    def get_metric(self, column):
+        """ Get the values of an extra metric, one per observation
+
+        :param column: position of the metric in ``metric_columns``.
+        :type column: int
+        """
+        return self.metrics[column::len(self.metric_columns)]
+
+    def to_csv(self):
+        """ Render the whole window as the content of a CSV file """
+        rows = [','.join([FILE_HEADERS] + self.metric_columns)]
+        columns = len(self.metric_columns)
+
+        for index in range(len(self)):
+            tick_time = self.get_tick_time(index)
+
+            row = (
+                f'"{self.get_timestamp(index)}","{self.book}",'
+                f'{self.bids[index]},{self.asks[index]},{self.spreads[index]},'
+                f'"{"" if tick_time is None else tick_time}"'
+            )
+
+            if columns:
+                metrics = self.metrics[index * columns:(index + 1) * columns]
+                row = ','.join([row] + [str(value) for value in metrics])
+
+            rows.append(row)
+
+        return '\n'.join(rows) + '\n'
+
+    def flush(self):
+        """ Save the window to a new partition file in the Data Lake
+
+        The file is written once and atomically, so a reader never finds a
+        partial window.
+        """
+        timestamp = self.start or self.get_timestamp(0)
+
+        path_to_folder = generate_path_to_folder(self.book, timestamp)
+
+        os.makedirs(path_to_folder, exist_ok=True)
+
+        file_name = generate_file_name(
+            timestamp, f'bid_ask_spread-{self.book}-'
+        )
+
+        file_partition = partition_allocator.next_partition(
+            path_to_folder, file_name
+        )
+
+        full_file_name = (
+            file_name + str(file_partition) + self.file_format.extension
+        )
+
+        path_to_file = os.path.join(path_to_folder, full_file_name)
+
+        # Journaled windows are durable before their journal is removed
+        save_file(
+            path_to_file,
+            self.file_format.render(self),
+            self.file_format.mode,
+            durable=self.journal is not None
+        )
+
+        # After the file: a file without statistics is always read
+        write_statistics(path_to_file, window_statistics(self))
+
+        if self.journal is not None:
+            self.journal.remove()
+            self.journal = None
+
+        print(
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            f'- Saved {len(self)} {self.book} observations. File:',
+            full_file_name)
+
+        return path_to_file
+
+
+class WindowWriter:
+    """ Accumulate the observations of every order book in windows
+
+    A window is closed when it's full or when a tick falls in the next
+    ``duration`` of wall clock, so the files start on exact boundaries
+    (every 10 minutes by default) whatever the ticks missed.
+
+    :param size: observations per window (and per file).
+        Default: ``WINDOW_SIZE``
+    :type size: int
+
+    :param file_format: format of the files, a key of ``FILE_FORMATS``.
+        Default: ``FILE_FORMAT``
+    :type file_format: str
+
+    :param metric_columns: names of the extra metrics saved after the
+        spread, see ``depth.DepthEngine.columns``.
+        Default: no extra metrics
+    :type metric_columns: list
+
+    :param duration: length of wall clock of a window.
+        Default: ``WINDOW_DURATION``
+    :type duration: timedelta
+
+    :param journal: journal of the windows in progress, see ``recover``.
+        Default: not journaled
+    :type journal: journal.Journal
+    """
+
+    def __init__(self, size=WINDOW_SIZE, file_format=FILE_FORMAT,
+                 metric_columns=(), duration=WINDOW_DURATION, journal=None):
+        self.size = size
+        self.file_format = file_format
+        self.metric_columns = metric_columns
+        self.duration = duration
+        self.journal = journal
+        self.windows = {}
+
+    def create_window(self, book, start):
+        segment = None
+
+        if self.journal is not None:
+            segment = self.journal.open_segment(
+                book, start, self.metric_columns
+            )
+
+        window = SpreadWindow(
+            book, self.size, self.file_format, self.metric_columns, start,
+            segment
+        )
+        self.windows[book] = window
+
+        return window
+
+    def get_window(self, book, tick_time):
+        """ Get the window of a tick. Return it and the closed window, if
+        the tick starts a new one
+
+        :param book: name of the order book.
+        :type book: str
+
+        :param tick_time: wall clock time of the tick, aware.
+        :type tick_time: datetime
+        """
+        start = floor_timestamp(tick_time, self.duration)
+        window = self.windows.get(book)
+        closed_window = None
+
+        # Late ticks stay in the window in progress
+        if window is not None and start > window.start:
+            closed_window = window
+            window = None
+
+        if window is None:
+            window = self.create_window(book, start)
+
+        return window, closed_window
+
+    def close_if_full(self, book, window, closed_windows):
+        if window.is_full():
+            del self.windows[book]
+            closed_windows.append(window)
+
+        return closed_windows
+
+    def add(self, book, timestamp, bid, ask, spread, metrics=None,
+            tick_time=None):
+        """ Add an observation. Return the windows closed by it
+
+        A closed window is detached, the next observation of the book
+        starts a new one. The caller is in charge of the ``flush``.
+
+        :param book: name of the order book.
+        :type book: str
+
+        :param timestamp: order book timestamp, aware.
+        :type timestamp: datetime
+
+        :param bid: best bid price.
+        :type bid: float
+
+        :param ask: best ask price.
+        :type ask: float
+
+        :param spread: bid-ask spread in percent.
+        :type spread: float
+
+        :param metrics: values of the ``metric_columns``.
+        :type metrics: list
+
+        :param tick_time: wall clock time of the tick, picks the window
+            and identifies the observation.
+            Default: ``timestamp`` picks the window, the tick is unknown
+        :type tick_time: datetime
+        """
+        window, closed_window = self.get_window(book, tick_time or timestamp)
+
+        window.append(timestamp, bid, ask, spread, metrics, tick_time)
+
+        return self.close_if_full(
+            book, window, [closed_window] if closed_window is not None else []
+        )
+
+    def add_gap(self, book, tick_time):
+        """ Add a tick without observation. Return the windows closed by it
+
+        :param book: name of the order book.
+        :type book: str
+
+        :param tick_time: wall clock time of the tick, aware.
+        :type tick_time: datetime
+        """
+        window, closed_window = self.get_window(book, tick_time)
+
+        window.append_gap(tick_time)
+
+        return self.close_if_full(
+            book, window, [closed_window] if closed_window is not None else []
+        )
+
+    def recover(self, books=None, now=None):
+        """ Rebuild the windows left in the journal by a crash. Return the
+        ones that are over, to ``flush``
+
+        The window in progress of a book (the one of ``now``) is restored
+        and goes on with the next observations.
+
+        :param books: only the windows of these books.
+            Default: all of them
+        :type books: list
+
+        :param now: current time, aware.
+            Default: now
+        :type now: datetime
+        """
+        if self.journal is None:
+            return []
+
+        if now is None:
+            now = datetime.now(timezone.utc)
+
+        current_start = floor_timestamp(now, self.duration)
+        closed_windows = []
+
+        for header, rows, path in self.journal.read_segments(books):
+            book = header['book']
+            start = datetime.fromisoformat(header['start'])
+            metric_columns = header['metric_columns']
+            columns = len(metric_columns)
+
+            # The segments journaled before the tick times have 4 values
+            values = 5 if header.get('tick_time') else 4
+
+            # Rebuilt without journaling again the same rows
+            window = SpreadWindow(
+                book, max(self.size, len(rows)), self.file_format,
+                metric_columns, start
+            )
+
+            for row in rows:
+                window.append_values(
+                    (row[:values] + [math.nan])[:5],
+                    row[values:values + columns] or None
+                )
+
+            print(
+                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                f'- Recovered {len(window)} {book} observations from',
+                os.path.basename(path)
+            )
+
+            restore = (
+                start == current_start and book not in self.windows and
+                metric_columns == list(self.metric_columns) and
+                not window.is_full() and values == 5
+            )
+
+            if restore:
+                window.size = self.size
+                window.journal = self.journal.open_segment(
+                    book, start, path=path
+                )
+                self.windows[book] = window
+            elif len(window):
+                # Removed once the window is saved
+                window.journal = self.journal.open_segment(
+                    book, start, path=path
+                )
+                closed_windows.append(window)
+            else:
+                os.remove(path)
+
+        return closed_windows
+
+    def pop_all(self):
+        """ Detach the windows that are not full yet, for example at exit """
+        windows = [window for window in self.windows.values() if len(window)]
+
+        self.windows = {}
+
+        return windows
@@ -0,0 +1,216 @@
+import queue
+import threading
+from datetime import datetime
+
+from metrics import collector_metrics
+
+# Observations waiting to be written, per book
+QUEUE_SIZE = 600
+
+# Maximum observations written at once
+BATCH_SIZE = 60
+
+# What to do when the queue of a book is full:
+# - block: wait for the writer (backpressure on the fetcher)
+# - drop_newest: discard the new observation
+# - drop_oldest: discard the oldest waiting observation
+BLOCK = 'block'
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+FULL_QUEUE_POLICIES = (BLOCK, DROP_NEWEST, DROP_OLDEST)
+
+# Put in the queue to stop the writer once the queue is drained
+STOP = object()
+
+
+class BookWriter:
+    """ Single writer thread of an order book, fed by a bounded queue
+
+    The producers ``put`` observations and the writer drains them in
+    batches, so the memory and the threads don't grow with the load, and
+    the files of the book are only written by one thread.
+
+    :param book: name of the order book.
+    :type book: str
+
+    :param write_batch: function ``write_batch(book, observations)`` that
+        saves a list of observations, in order.
+    :type write_batch: callable
+
+    :param queue_size: observations waiting to be written.
+        Default: ``QUEUE_SIZE``
+    :type queue_size: int
+
+    :param batch_size: maximum observations written at once.
+        Default: ``BATCH_SIZE``
+    :type batch_size: int
+
+    :param policy: what to do when the queue is full, one of
+        ``FULL_QUEUE_POLICIES``.
+        Default: ``BLOCK``
+    :type policy: str
+    """
+
+    def __init__(self, book, write_batch, queue_size=QUEUE_SIZE,
+                 batch_size=BATCH_SIZE, policy=BLOCK):
+        if policy not in FULL_QUEUE_POLICIES:
+            raise ValueError(f'Unknown full queue policy: {policy}')
+
+        self.book = book
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.policy = policy
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+        self.thread = threading.Thread(
+            target=self.run, name=f'writer-{book}', daemon=True
+        )
+        self.thread.start()
+
+    def put(self, observation):
+        """ Queue an observation, applying the policy if the queue is full
+
+        Return False if an observation was dropped.
+
+        :param observation: anything ``write_batch`` accepts.
+        :type observation: object
+        """
+        if self.policy == BLOCK:
+            self.queue.put(observation)
+            return True
+
+        dropped = False
+
+        while True:
+            try:
+                self.queue.put_nowait(observation)
+                return not dropped
+            except queue.Full:
+                self.dropped = self.dropped + 1
+                collector_metrics.increment('observations_dropped_total')
+
+                if self.policy == DROP_NEWEST:
+                    return False
+
+            # DROP_OLDEST: make room and try again
+            dropped = True
+
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+
+    def take_batch(self):
+        """ Wait for an observation and take the ones already waiting """
+        batch = [self.queue.get()]
+
+        while len(batch) < self.batch_size and batch[-1] is not STOP:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def run(self):
+        stopped = False
+
+        while not stopped:
+            batch = self.take_batch()
+
+            if batch[-1] is STOP:
+                stopped = True
+                batch.pop()
+
+            collector_metrics.set_gauge(
+                f'writer_queue_depth{{book="{self.book}"}}',
+                self.queue.qsize()
+            )
+
+            try:
+                if batch:
+                    self.write_batch(self.book, batch)
+            except Exception as error:
+                # A failing write must not stop the writer
+                print(
+                    datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    f'- Error writing {len(batch)} {self.book} observations:',
+                    error
+                )
+
+    def close(self):
+        """ Write the waiting observations and stop the thread """
+        self.queue.put(STOP)
+        self.thread.join()
+
+
+class BookWriters:
+    """ One ``BookWriter`` per order book, created on the first put
+
+    :param write_batch: function ``write_batch(book, observations)``.
+    :type write_batch: callable
+
+    :param queue_size: observations waiting per book.
+        Default: ``QUEUE_SIZE``
+    :type queue_size: int
+
+    :param batch_size: maximum observations written at once.
+        Default: ``BATCH_SIZE``
+    :type batch_size: int
+
+    :param policy: what to do when a queue is full, one of
+        ``FULL_QUEUE_POLICIES``.
+        Default: ``BLOCK``
+    :type policy: str
+    """
+
+    def __init__(self, write_batch, queue_size=QUEUE_SIZE,
+                 batch_size=BATCH_SIZE, policy=BLOCK):
+        self.write_batch = write_batch
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.writers = {}
+
+    def put(self, book, observation):
+        """ Queue an observation of a book. Return False if one was dropped
+
+        :param book: name of the order book.
+        :type book: str
+
+        :param observation: anything ``write_batch`` accepts.
+        :type observation: object
+        """
+        writer = self.writers.get(book)
+
+        if writer is None:
+            with self.lock:
+                writer = self.writers.get(book)
+
+                if writer is None:
+                    writer = BookWriter(
+                        book, self.write_batch, self.queue_size,
+                        self.batch_size, self.policy
+                    )
+                    self.writers[book] = writer
+
+        return writer.put(observation)
+
+    def close(self, book):
+        """ Write the waiting observations of a book and stop its writer
+
+        :param book: name of the order book.
+        :type book: str
+        """
+        with self.lock:
+            writer = self.writers.pop(book, None)
+
+        if writer is not None:
+            writer.close()
+
+    def close_all(self):
+        """ Write the waiting observations and stop all the writers """
+        for book in list(self.writers):
+            self.close(book)
@@ -0,0 +1,167 @@
+import json
+import math
+import os
+from datetime import datetime, timezone
+
+from storage import remove_file, save_file
+
+# Statistics of a spread file, kept next to it as a small hidden file:
+# .<file name>.stats.json
+STATISTICS_SUFFIX = '.stats.json'
+
+
+def get_statistics_path(path_to_file):
+    """ Get the path of the statistics of a spread file
+
+    :param path_to_file: path of the spread file.
+    :type path_to_file: str
+    """
+    folder, file_name = os.path.split(path_to_file)
+
+    return os.path.join(folder, f'.{file_name}{STATISTICS_SUFFIX}')
+
+
+def value_range(values):
+    """ Get the min and max of the values that are not NaN (gaps)
+
+    :param values: values of a column.
+    :type values: array.array
+    """
+    values = [value for value in values if not math.isnan(value)]
+
+    if not values:
+        return None, None
+
+    return min(values), max(values)
+
+
+def window_statistics(window):
+    """ Get the row count and the min/max of the columns of a window
+
+    The gaps (NaN values) are left out of the min/max, a column with only
+    gaps has None.
+
+    :param window: observations of one order book.
+    :type window: window_writer.SpreadWindow
+    """
+    if not len(window):
+        return {'rows': 0}
+
+    # The time of the rows: the tick, or the order book timestamp of the
+    # rows saved without it
+    times = [
+        timestamp if math.isnan(tick_time) else tick_time
+        for timestamp, tick_time in zip(window.timestamps, window.tick_times)
+    ]
+
+    min_bid, max_bid = value_range(window.bids)
+    min_ask, max_ask = value_range(window.asks)
+    min_spread, max_spread = value_range(window.spreads)
+
+    return {
+        'rows': len(window),
+        'min_timestamp': str(
+            datetime.fromtimestamp(min(window.timestamps), timezone.utc)
+        ),
+        'max_timestamp': str(
+            datetime.fromtimestamp(max(window.timestamps), timezone.utc)
+        ),
+        'min_tick_time': str(
+            datetime.fromtimestamp(min(times), timezone.utc)
+        ),
+        'max_tick_time': str(
+            datetime.fromtimestamp(max(times), timezone.utc)
+        ),
+        'min_bid': min_bid,
+        'max_bid': max_bid,
+        'min_ask': min_ask,
+        'max_ask': max_ask,
+        'min_spread': min_spread,
+        'max_spread': max_spread,
+    }
+
+
+def write_statistics(path_to_file, statistics):
+    """ Save the statistics of a spread file
+
+    :param path_to_file: path of the spread file.
+    :type path_to_file: str
+
+    :param statistics: statistics, see ``window_statistics``.
+    :type statistics: dict
+    """
+    save_file(get_statistics_path(path_to_file), json.dumps(statistics))
+
+
+def read_statistics(path_to_file):
+    """ Get the statistics of a spread file, None if it has none
+
+    :param path_to_file: path of the spread file.
+    :type path_to_file: str
+    """
+    try:
+        with open(get_statistics_path(path_to_file)) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def remove_statistics(path_to_file):
+    """ Remove the statistics of a spread file, if any
+
+    :param path_to_file: path of the spread file.
+    :type path_to_file: str
+    """
+    try:
+        remove_file(get_statistics_path(path_to_file))
+    except FileNotFoundError:
+        pass
+
+
+def may_have_rows(statistics, start, end, min_spread=None, max_spread=None):
+    """ Check if a file may have rows that match the filters
+
+    Without statistics the file must be read.
+
+    :param statistics: statistics of the file, or None.
+    :type statistics: dict
+
+    :param start: start of the range (included), in UTC.
+    :type start: datetime
+
+    :param end: end of the range (excluded), in UTC.
+    :type end: datetime
+
+    :param min_spread: rows with a spread bigger or equal.
+    :type min_spread: float
+
+    :param max_spread: rows with a spread lower or equal.
+    :type max_spread: float
+    """
+    if statistics is None:
+        return True
+
+    if not statistics['rows']:
+        return False
+
+    # The range is of the tick times. The statistics saved before them have
+    # the order book timestamps, the time of the rows without tick time
+    min_time = statistics.get('min_tick_time', statistics['min_timestamp'])
+    max_time = statistics.get('max_tick_time', statistics['max_timestamp'])
+
+    if (datetime.fromisoformat(max_time) < start or
+            datetime.fromisoformat(min_time) >= end):
+        return False
+
+    # A file with only gaps has no spread to match
+    if min_spread is not None or max_spread is not None:
+        if statistics['max_spread'] is None:
+            return False
+
+    if min_spread is not None and statistics['max_spread'] < min_spread:
+        return False
+
+    if max_spread is not None and statistics['min_spread'] > max_spread:
+        return False
+
+    return True
@@ -22,6 +22,7 @@ DROP TABLE IF EXISTS public."DimUsers";
 DROP TABLE IF EXISTS public."FactWithdrawals";
 DROP TABLE IF EXISTS public."FactEvents";
 DROP TABLE IF EXISTS public."FactDeposits";
+DROP TABLE IF EXISTS public."LoadWatermarks";
 DROP TABLE IF EXISTS stage."DimInterfaces";
 DROP TABLE IF EXISTS stage."DimStatuses";
 DROP TABLE IF EXISTS stage."DimEvents";
@@ -103,6 +104,24 @@ CREATE TABLE public."FactDeposits"(
   create_at TIMESTAMP DEFAULT NOW()
 );
 
+/* Last row loaded of every fact table: the next runs load only the rows
+   after its (event_timestamp, id) */
+CREATE TABLE public."LoadWatermarks"(
+  table_name VARCHAR(50) PRIMARY KEY,
+  event_timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+  id BIGINT NOT NULL,
+  update_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX "FactWithdrawals_event_timestamp_id_idx"
+  ON public."FactWithdrawals"(event_timestamp, id);
+
+CREATE INDEX "FactEvents_event_timestamp_id_idx"
+  ON public."FactEvents"(event_timestamp, id);
+
+CREATE INDEX "FactDeposits_event_timestamp_id_idx"
+  ON public."FactDeposits"(event_timestamp, id);
+
 
 /* stage tables */
 CREATE TABLE stage."DimInterfaces"(
@@ -133,7 +152,7 @@ CREATE TABLE stage."DimUsers"(
 CREATE TABLE stage."FactWithdrawals"(
   index BIGINT,
   id BIGINT NULL,
-  event_timestamp TIMESTAMP NULL,
+  event_timestamp TIMESTAMP WITH TIME ZONE NULL,
   user_id VARCHAR(50) NULL,
   amount DECIMAL(36,18) NULL,
   interface VARCHAR(16) NULL,
@@ -144,7 +163,7 @@ CREATE TABLE stage."FactWithdrawals"(
 CREATE TABLE stage."FactEvents"(
   index BIGINT,
   id BIGINT NULL,
-  event_timestamp TIMESTAMP NOT NULL,
+  event_timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
   user_id VARCHAR(40) NOT NULL,
   event_name VARCHAR(50)
 );
@@ -152,7 +171,7 @@ CREATE TABLE stage."FactEvents"(
 CREATE TABLE stage."FactDeposits"(
   index BIGINT,
   id BIGINT NULL,
-  event_timestamp TIMESTAMP NULL,
+  event_timestamp TIMESTAMP WITH TIME ZONE NULL,
   user_id VARCHAR(50) NULL,
   amount DECIMAL(36,18) NULL,
   currency CHAR(5) NULL,
@@ -282,6 +301,19 @@ LEFT JOIN public."DimCurrencies" AS currencies
 
 LEFT JOIN public."DimStatuses" AS statuses
 	ON withdrawals.tx_status = statuses.status_name
+WHERE NOT EXISTS(
+	SELECT 1 FROM public."LoadWatermarks" AS watermarks
+	WHERE watermarks.table_name = 'FactWithdrawals'
+	AND (watermarks.event_timestamp, watermarks.id) >= (CAST(withdrawals.event_timestamp AS TIMESTAMP WITH TIME ZONE), withdrawals.id)
+);
+
+INSERT INTO public."LoadWatermarks"(table_name, event_timestamp, id)
+SELECT 'FactWithdrawals', event_timestamp, id
+FROM public."FactWithdrawals"
+ORDER BY event_timestamp DESC, id DESC
+LIMIT 1
+ON CONFLICT (table_name) DO UPDATE
+SET event_timestamp = EXCLUDED.event_timestamp, id = EXCLUDED.id, update_at = NOW();
 $$;
 
 CREATE OR REPLACE PROCEDURE stage.load_fact_events()
@@ -308,6 +340,19 @@ LEFT JOIN public."DimUsers" AS users
 	
 LEFT JOIN public."DimEvents" AS events_dim
 	ON events.event_name = events_dim.event_name
+WHERE NOT EXISTS(
+	SELECT 1 FROM public."LoadWatermarks" AS watermarks
+	WHERE watermarks.table_name = 'FactEvents'
+	AND (watermarks.event_timestamp, watermarks.id) >= (CAST(events.event_timestamp AS TIMESTAMP WITH TIME ZONE), events.id)
+);
+
+INSERT INTO public."LoadWatermarks"(table_name, event_timestamp, id)
+SELECT 'FactEvents', event_timestamp, id
+FROM public."FactEvents"
+ORDER BY event_timestamp DESC, id DESC
+LIMIT 1
+ON CONFLICT (table_name) DO UPDATE
+SET event_timestamp = EXCLUDED.event_timestamp, id = EXCLUDED.id, update_at = NOW();
 $$;
 
 CREATE OR REPLACE PROCEDURE stage.load_fact_deposits()
@@ -342,6 +387,19 @@ LEFT JOIN public."DimCurrencies" AS currencies
 
 LEFT JOIN public."DimStatuses" AS statuses
 	ON deposits.tx_status = statuses.status_name
+WHERE NOT EXISTS(
+	SELECT 1 FROM public."LoadWatermarks" AS watermarks
+	WHERE watermarks.table_name = 'FactDeposits'
+	AND (watermarks.event_timestamp, watermarks.id) >= (CAST(deposits.event_timestamp AS TIMESTAMP WITH TIME ZONE), deposits.id)
+);
+
+INSERT INTO public."LoadWatermarks"(table_name, event_timestamp, id)
+SELECT 'FactDeposits', event_timestamp, id
+FROM public."FactDeposits"
+ORDER BY event_timestamp DESC, id DESC
+LIMIT 1
+ON CONFLICT (table_name) DO UPDATE
+SET event_timestamp = EXCLUDED.event_timestamp, id = EXCLUDED.id, update_at = NOW();
 $$;
 
 CREATE OR REPLACE PROCEDURE stage.clean_stage_tables()
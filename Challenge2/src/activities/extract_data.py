@@ -6,6 +6,7 @@ import numpy as np
 
 sys.path.append('../../opt/airflow/')
 from src.utils import *
+from src.database import get_connection_postgres, get_watermark
 
 
 def run():
@@ -14,6 +15,10 @@ def run():
 
     clean_stage_files()
 
+    # The sources are full snapshots: every run reads them whole, but only
+    # the fact rows after the watermark of their table are staged
+    conn = get_connection_postgres()
+
     data_types_deposits = {
         'id': np.int64,
         'event_timestamp': np.datetime64,
@@ -22,11 +27,14 @@ def run():
         'currency': np.str_,
         'tx_status': np.str_
     }
-    df_deposits = extract_from_file_to_df(
+    chunks_deposits = extract_from_file_to_chunks(
         path=get_file_from(file='deposit', zone='temp'),
         headers=data_types_deposits.keys(),
         data_types=data_types_deposits
     )
+    chunks_deposits = filter_new_chunks(
+        chunks_deposits, get_watermark(conn, 'FactDeposits')
+    )
 
     data_types_events = {
         'id': np.int64,
@@ -34,16 +42,19 @@ def run():
         'user_id': np.str_,
         'event_name': np.str_
     }
-    df_events = extract_from_file_to_df(
+    chunks_events = extract_from_file_to_chunks(
         path=get_file_from(file='event', zone='temp'),
         headers=data_types_events.keys(),
         data_types=data_types_events
     )
+    chunks_events = filter_new_chunks(
+        chunks_events, get_watermark(conn, 'FactEvents')
+    )
 
     data_types_users = {
         'user_id': np.str_
     }
-    df_users = extract_from_file_to_df(
+    chunks_users = extract_from_file_to_chunks(
         path=get_file_from(file='user_id', zone='temp'),
         headers=data_types_users.keys(),
         data_types=data_types_users
@@ -58,13 +69,27 @@ def run():
         'currency': np.str_,
         'tx_status': np.str_
     }
-    df_withdrawals = extract_from_file_to_df(
+    chunks_withdrawals = extract_from_file_to_chunks(
         path=get_file_from(file='withdrawals', zone='temp'),
         headers=data_types_withdrawals.keys(),
         data_types=data_types_withdrawals
     )
+    chunks_withdrawals = filter_new_chunks(
+        chunks_withdrawals, get_watermark(conn, 'FactWithdrawals')
+    )
 
-    load_df_to_file(df_deposits, 'stage', 'deposits')
-    load_df_to_file(df_events, 'stage', 'events')
-    load_df_to_file(df_users, 'stage', 'users')
-    load_df_to_file(df_withdrawals, 'stage', 'withdrawals')
+    # The chunks are read while they are written: one file at a time, one
+    # chunk at a time
+    load_chunks_to_file(
+        chunks_deposits, 'stage', 'deposits', data_types_deposits.keys()
+    )
+    load_chunks_to_file(
+        chunks_events, 'stage', 'events', data_types_events.keys()
+    )
+    load_chunks_to_file(
+        chunks_users, 'stage', 'users', data_types_users.keys()
+    )
+    load_chunks_to_file(
+        chunks_withdrawals, 'stage', 'withdrawals',
+        data_types_withdrawals.keys()
+    )
@@ -5,7 +5,8 @@ import numpy as np
 
 sys.path.append('../../opt/airflow/')
 from src.utils import *
-from src.database import get_dataframe_postgres, get_connection_postgres
+from src.database import (get_dataframe_postgres, get_connection_postgres,
+                          copy_df_to_postgres, get_watermark)
 
 
 def process_dim_users(conn):
@@ -13,25 +14,46 @@ def process_dim_users(conn):
         'user_id': np.str_
     }
 
-    df_users = extract_from_file_to_df(
+    chunks_users = extract_from_file_to_chunks(
         path=get_file_from(file='users', zone='stage'),
         headers=data_types_users.keys(),
         data_types=data_types_users
     )
 
-    df_dim_users = get_dataframe_postgres('SELECT user_id FROM public."DimUsers"' ,conn)
+    df_dim_users = get_dataframe_postgres(
+        'SELECT user_id FROM public."DimUsers"', conn
+    )
 
-    df_new_users = pd.merge(df_users, df_dim_users, how='left', on='user_id', suffixes=('_l', '_r'))
+    if_exists = 'replace'
 
-    if df_new_users.shape[0] > 0:
-        result = df_new_users.to_sql(
-            name='DimUsers',
-            con=conn,
-            schema='stage',
-            if_exists='replace',
+    for df_users in chunks_users:
+        df_new_users = pd.merge(
+            df_users, df_dim_users, how='left', on='user_id',
+            suffixes=('_l', '_r')
         )
 
-        print('process_dim_users', result)
+        if df_new_users.shape[0] > 0:
+            result = copy_df_to_postgres(
+                df=df_new_users,
+                name='DimUsers',
+                conn=conn,
+                schema='stage',
+                if_exists=if_exists
+            )
+
+            # The first chunk replaces the stage table, the rest append
+            if_exists = 'append'
+
+            print('process_dim_users', result)
+
+
+def add_unique_values(df_unique, df, column):
+    df_values = df[column].drop_duplicates().to_frame()
+
+    if df_unique is None:
+        return df_values
+
+    return pd.concat([df_unique, df_values]).drop_duplicates()
 
 
 def process_dim_statuses(conn, df, if_exists='replace'):
@@ -39,14 +61,18 @@ def process_dim_statuses(conn, df, if_exists='replace'):
         'SELECT status_name FROM public."DimStatuses"', conn
     )
 
-    df_new_statuses = pd.merge(df, df_dim_statuses, how='left', left_on='tx_status', right_on='status_name')
+    df_new_statuses = pd.merge(
+        df, df_dim_statuses, how='left', left_on='tx_status',
+        right_on='status_name'
+    )
 
     if df_new_statuses.shape[0] > 0:
         df_new_statuses = df_new_statuses.drop(['status_name'], axis = 1)
 
-        result = df_new_statuses.to_sql(
+        result = copy_df_to_postgres(
+            df=df_new_statuses,
             name='DimStatuses',
-            con=conn,
+            conn=conn,
             schema='stage',
             if_exists=if_exists
         )
@@ -59,14 +85,18 @@ def process_dim_currencies(conn, df, if_exists='replace'):
         'SELECT currency_name FROM public."DimCurrencies"', conn
     )
 
-    df_new_currencies = pd.merge(df, df_dim_currencies, how='left', left_on='currency', right_on='currency_name')
+    df_new_currencies = pd.merge(
+        df, df_dim_currencies, how='left', left_on='currency',
+        right_on='currency_name'
+    )
 
     if df_new_currencies.shape[0] > 0:
         df_new_currencies = df_new_currencies.drop(['currency_name'], axis = 1)
 
-        result = df_new_currencies.to_sql(
+        result = copy_df_to_postgres(
+            df=df_new_currencies,
             name='DimCurrencies',
-            con=conn,
+            conn=conn,
             schema='stage',
             if_exists=if_exists
         )
@@ -79,14 +109,20 @@ def process_dim_interfaces(conn, df, if_exists='replace'):
         'SELECT interface_name FROM public."DimInterfaces"', conn
     )
 
-    df_new_interfaces = pd.merge(df, df_dim_interfaces, how='left', left_on='interface', right_on='interface_name')
+    df_new_interfaces = pd.merge(
+        df, df_dim_interfaces, how='left', left_on='interface',
+        right_on='interface_name'
+    )
 
     if df_new_interfaces.shape[0] > 0:
-        df_new_interfaces = df_new_interfaces.drop(['interface_name'], axis = 1)
+        df_new_interfaces = df_new_interfaces.drop(
+            ['interface_name'], axis=1
+        )
 
-        result = df_new_interfaces.to_sql(
+        result = copy_df_to_postgres(
+            df=df_new_interfaces,
             name='DimInterfaces',
-            con=conn,
+            conn=conn,
             schema='stage',
             if_exists=if_exists
         )
@@ -102,9 +138,10 @@ def process_dim_events(conn, df, if_exists='replace'):
     df_new_events = pd.merge(df, df_dim_events, how='left', on='event_name')
 
     if df_new_events.shape[0] > 0:
-        result = df_new_events.to_sql(
+        result = copy_df_to_postgres(
+            df=df_new_events,
             name='DimEvents',
-            con=conn,
+            conn=conn,
             schema='stage',
             if_exists=if_exists
         )
@@ -122,30 +159,56 @@ def process_fact_withdrawals(conn):
         'currency': np.str_,
         'tx_status': np.str_
     }
-    df_withdrawals = extract_from_file_to_df(
+    chunks_withdrawals = extract_from_file_to_chunks(
         path=get_file_from(file='withdrawals', zone='stage'),
         headers=data_types_withdrawals.keys(),
         data_types=data_types_withdrawals
     )
 
-    if df_withdrawals.shape[0] > 0:
-        df_dim_statuses = df_withdrawals['tx_status'].drop_duplicates().to_frame()
-        df_dim_interfaces = df_withdrawals['interface'].drop_duplicates().to_frame()
-        df_dim_currencies = df_withdrawals['currency'].drop_duplicates().to_frame()
+    # extract_data stages only the new rows, but the stage files may
+    # come from somewhere else
+    watermark = get_watermark(conn, 'FactWithdrawals')
 
-        process_dim_statuses(conn, df_dim_statuses, 'append')
-        process_dim_interfaces(conn, df_dim_interfaces, 'append')
-        process_dim_currencies(conn, df_dim_currencies, 'append')
+    df_dim_statuses = None
+    df_dim_interfaces = None
+    df_dim_currencies = None
+
+    if_exists = 'replace'
+
+    for df_withdrawals in chunks_withdrawals:
+        df_withdrawals = filter_new_rows(df_withdrawals, watermark)
 
-        result = df_withdrawals.to_sql(
+        if df_withdrawals.shape[0] == 0:
+            continue
+
+        # Only the unique values of the dimensions are kept between chunks
+        df_dim_statuses = add_unique_values(
+            df_dim_statuses, df_withdrawals, 'tx_status'
+        )
+        df_dim_interfaces = add_unique_values(
+            df_dim_interfaces, df_withdrawals, 'interface'
+        )
+        df_dim_currencies = add_unique_values(
+            df_dim_currencies, df_withdrawals, 'currency'
+        )
+
+        result = copy_df_to_postgres(
+            df=df_withdrawals,
             name='FactWithdrawals',
-            con=conn,
+            conn=conn,
             schema='stage',
-            if_exists='replace'
+            if_exists=if_exists
         )
 
+        if_exists = 'append'
+
         print('process_fact_withdrawals', result)
 
+    if df_dim_statuses is not None:
+        process_dim_statuses(conn, df_dim_statuses, 'append')
+        process_dim_interfaces(conn, df_dim_interfaces, 'append')
+        process_dim_currencies(conn, df_dim_currencies, 'append')
+
 
 def process_fact_events(conn):
     data_types_events = {
@@ -154,26 +217,43 @@ def process_fact_events(conn):
         'user_id': np.str_,
         'event_name': np.str_
     }
-    df_events = extract_from_file_to_df(
+    chunks_events = extract_from_file_to_chunks(
         path=get_file_from(file='events', zone='stage'),
         headers=data_types_events.keys(),
         data_types=data_types_events
     )
 
-    if df_events.shape[0] > 0:
-        df_dim_events = df_events['event_name'].drop_duplicates().to_frame()
+    watermark = get_watermark(conn, 'FactEvents')
 
-        process_dim_events(conn, df_dim_events, 'append')
+    df_dim_events = None
+
+    if_exists = 'replace'
 
-        result = df_events.to_sql(
+    for df_events in chunks_events:
+        df_events = filter_new_rows(df_events, watermark)
+
+        if df_events.shape[0] == 0:
+            continue
+
+        df_dim_events = add_unique_values(
+            df_dim_events, df_events, 'event_name'
+        )
+
+        result = copy_df_to_postgres(
+            df=df_events,
             name='FactEvents',
-            con=conn,
+            conn=conn,
             schema='stage',
-            if_exists='replace'
+            if_exists=if_exists
         )
 
+        if_exists = 'append'
+
         print('process_fact_events', result)
 
+    if df_dim_events is not None:
+        process_dim_events(conn, df_dim_events, 'append')
+
 
 def process_fact_deposits(conn):
     data_types_deposits = {
@@ -184,28 +264,48 @@ def process_fact_deposits(conn):
         'currency': np.str_,
         'tx_status': np.str_
     }
-    df_deposits = extract_from_file_to_df(
+    chunks_deposits = extract_from_file_to_chunks(
         path=get_file_from(file='deposits', zone='stage'),
         headers=data_types_deposits.keys(),
         data_types=data_types_deposits
     )
 
-    if df_deposits.shape[0] > 0:
-        df_dim_statuses = df_deposits['tx_status'].drop_duplicates().to_frame()
-        df_dim_currencies = df_deposits['currency'].drop_duplicates().to_frame()
+    watermark = get_watermark(conn, 'FactDeposits')
 
-        process_dim_statuses(conn, df_dim_statuses, 'append')
-        process_dim_currencies(conn, df_dim_currencies, 'append')
+    df_dim_statuses = None
+    df_dim_currencies = None
+
+    if_exists = 'replace'
+
+    for df_deposits in chunks_deposits:
+        df_deposits = filter_new_rows(df_deposits, watermark)
+
+        if df_deposits.shape[0] == 0:
+            continue
+
+        df_dim_statuses = add_unique_values(
+            df_dim_statuses, df_deposits, 'tx_status'
+        )
+        df_dim_currencies = add_unique_values(
+            df_dim_currencies, df_deposits, 'currency'
+        )
 
-        result = df_deposits.to_sql(
+        result = copy_df_to_postgres(
+            df=df_deposits,
             name='FactDeposits',
-            con=conn,
+            conn=conn,
             schema='stage',
-            if_exists='replace'
+            if_exists=if_exists
         )
 
+        if_exists = 'append'
+
         print('process_fact_deposits', result)
 
+    if df_dim_statuses is not None:
+        process_dim_statuses(conn, df_dim_statuses, 'append')
+        process_dim_currencies(conn, df_dim_currencies, 'append')
+
 
 def run():
     warnings.filterwarnings('ignore')
@@ -1,2 +1,13 @@
+import os
+
 FLOAT_FORMAT = '{:.18f}'.format
 DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f%z'
+
+# Columns written with FLOAT_FORMAT by the COPY of the stage tables, the
+# DECIMAL ones
+FLOAT_COLUMNS = ['amount']
+
+# Memory ceiling (bytes) of a chunk of rows read from a snapshot CSV. The
+# rows per chunk are estimated from a sample of the file
+CHUNK_MEMORY_LIMIT = int(os.environ.get('CHUNK_MEMORY_LIMIT', 64 * 1024 * 1024))
+CHUNK_SAMPLE_ROWS = 1000
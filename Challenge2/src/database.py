@@ -1,3 +1,4 @@
+import io
 import time
 import pandas as pd
 from sqlalchemy import create_engine
@@ -5,6 +6,7 @@ import sys
 
 sys.path.append('../../opt/airflow/')
 import src.config_env as env
+from src.constants import FLOAT_FORMAT, DATE_FORMAT, FLOAT_COLUMNS
 
 
 def get_connection_postgres():
@@ -21,11 +23,100 @@ def get_connection_postgres():
     return conn
 
 
-def get_dataframe_postgres(query, conn=None):
+def get_dataframe_postgres(query, conn=None, params=None):
     _conn = get_connection_postgres()
     
     _conn = conn if bool(conn) else _conn
 
-    df = pd.read_sql(query, _conn)
+    # The values go apart from the query, as %(name)s parameters
+    df = pd.read_sql(query, _conn, params=params)
     
-    return df
\ No newline at end of file
+    return df
+
+
+def get_watermark(conn, table_name):
+    # (event_timestamp, id) of the last row loaded in the fact table, None
+    # before the first load
+    df_watermark = get_dataframe_postgres(
+        'SELECT event_timestamp, id FROM public."LoadWatermarks" '
+        'WHERE table_name = %(table_name)s',
+        conn,
+        params={'table_name': table_name}
+    )
+
+    if df_watermark.shape[0] == 0:
+        return None
+
+    return (
+        pd.Timestamp(df_watermark['event_timestamp'].iloc[0])
+        .tz_convert('UTC'),
+        int(df_watermark['id'].iloc[0])
+    )
+
+
+def format_copy_columns(df):
+    # Only the amounts are written with FLOAT_FORMAT. The integer columns
+    # read as float (a chunk with a missing id) go as integers:
+    # 123.000000000000000000 is not a valid BIGINT
+    columns = {}
+
+    for column in df.columns:
+        values = df[column]
+
+        if column in FLOAT_COLUMNS:
+            columns[column] = values.map(
+                lambda value: None if pd.isna(value) else FLOAT_FORMAT(value)
+            )
+        elif (pd.api.types.is_float_dtype(values) and
+                (values.dropna() % 1 == 0).all()):
+            columns[column] = values.astype('Int64')
+
+    return df.assign(**columns) if columns else df
+
+
+def copy_df_to_postgres(df, name, conn, schema='stage', if_exists='append'):
+    # COPY instead of the row by row INSERTs of DataFrame.to_sql. The rows
+    # go as CSV with the index in the "index" column, like to_sql, and
+    # Postgres parses them to the types of the columns (NaN and None as NULL)
+    table = f'"{schema}"."{name}"'
+    columns = ', '.join(f'"{column}"' for column in ['index', *df.columns])
+
+    start = time.perf_counter()
+
+    buffer = io.StringIO()
+    format_copy_columns(df).to_csv(
+        buffer,
+        header=False,
+        index=True,
+        date_format=DATE_FORMAT
+    )
+    buffer.seek(0)
+
+    # The psycopg2 connection under the SQLAlchemy one: the TRUNCATE and
+    # the COPY are committed together
+    dbapi_conn = conn.connection
+
+    try:
+        with dbapi_conn.cursor() as cursor:
+            if if_exists == 'replace':
+                cursor.execute(f'TRUNCATE TABLE {table}')
+
+            cursor.copy_expert(
+                f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)',
+                buffer
+            )
+
+        dbapi_conn.commit()
+    except Exception:
+        dbapi_conn.rollback()
+        raise
+
+    seconds = time.perf_counter() - start
+    rows = df.shape[0]
+
+    print(
+        'copy_df_to_postgres', table, rows, 'rows',
+        f'{rows / seconds if seconds > 0 else 0:.0f} rows/s'
+    )
+
+    return rows
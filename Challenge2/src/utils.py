@@ -6,7 +6,8 @@ import numpy as np
 import pandas as pd
 
 sys.path.append('../../opt/airflow/')
-from src.constants import FLOAT_FORMAT, DATE_FORMAT
+from src.constants import (FLOAT_FORMAT, DATE_FORMAT, CHUNK_MEMORY_LIMIT,
+                           CHUNK_SAMPLE_ROWS)
 
 DATA_LAKE_ROOT_PATH = os.path.join(os.getcwd(), 'datalake')
 DATA_LAKE_TEMP = os.path.join(DATA_LAKE_ROOT_PATH, 'temp')
@@ -33,8 +34,7 @@ def get_file_from(file, zone='stage'):
     return os.path.join(source, f'{file}{sufix}.csv')
 
 
-def extract_from_file_to_df(path, headers, data_types={}):
-    print('extract_from_file_to_df')
+def get_read_options(path, headers, data_types={}):
     options = {
         'filepath_or_buffer': path,
         'usecols': headers,
@@ -47,7 +47,67 @@ def extract_from_file_to_df(path, headers, data_types={}):
     if data_types and isinstance(data_types, dict) and len(data_types) > 1:
         options.pop("dtype")
 
-    return pd.read_csv(**options)
+    return options
+
+
+def extract_from_file_to_df(path, headers, data_types={}):
+    print('extract_from_file_to_df')
+
+    return pd.read_csv(**get_read_options(path, headers, data_types))
+
+
+def get_chunk_size(path, headers, data_types={},
+                   memory_limit=CHUNK_MEMORY_LIMIT):
+    print('get_chunk_size')
+    options = get_read_options(path, headers, data_types)
+
+    sample = pd.read_csv(nrows=CHUNK_SAMPLE_ROWS, **options)
+
+    if sample.shape[0] == 0:
+        return CHUNK_SAMPLE_ROWS
+
+    row_size = (
+        sample.memory_usage(index=True, deep=True).sum() / sample.shape[0]
+    )
+
+    # The parser holds about as much memory again while it builds a chunk
+    return max(1, int(memory_limit / (2 * row_size)))
+
+
+def extract_from_file_to_chunks(path, headers, data_types={},
+                                memory_limit=CHUNK_MEMORY_LIMIT):
+    print('extract_from_file_to_chunks')
+    chunk_size = get_chunk_size(path, headers, data_types, memory_limit)
+
+    options = get_read_options(path, headers, data_types)
+
+    # Only one chunk of the file is in memory at a time
+    with pd.read_csv(chunksize=chunk_size, **options) as reader:
+        for chunk in reader:
+            yield chunk
+
+
+def filter_new_rows(df, watermark):
+    # Only the rows after the last one loaded in a previous run
+    if watermark is None or df.shape[0] == 0:
+        return df
+
+    event_timestamp, id_ = watermark
+
+    timestamps = pd.to_datetime(
+        df['event_timestamp'], utc=True, format='mixed'
+    )
+
+    is_new = (timestamps > event_timestamp) | (
+        (timestamps == event_timestamp) & (df['id'] > id_)
+    )
+
+    return df[is_new.values]
+
+
+def filter_new_chunks(chunks, watermark):
+    for chunk in chunks:
+        yield filter_new_rows(chunk, watermark)
 
 
 def load_df_to_file(df, to_, filename):
@@ -66,6 +126,45 @@ def load_df_to_file(df, to_, filename):
         index=False
     )
 
+
+def load_chunks_to_file(chunks, to_, filename, headers=None):
+    print('load_chunks_to_file', filename)
+    zone = get_path_by_zone(zone=to_)
+
+    path_to_filename = os.path.join(zone, filename + '.csv')
+
+    if os.path.exists(path_to_filename):
+        os.remove(path_to_filename)
+
+    rows = 0
+    header = True
+
+    # The first chunk creates the file with the headers, the rest are
+    # appended
+    for chunk in chunks:
+        chunk.to_csv(
+            path_to_filename,
+            mode='w' if header else 'a',
+            header=header,
+            float_format=FLOAT_FORMAT,
+            date_format=DATE_FORMAT,
+            index=False
+        )
+
+        header = False
+        rows += chunk.shape[0]
+
+    # Without rows the file is still created, with only the headers, so
+    # the next steps read an empty snapshot instead of a missing file
+    if header:
+        pd.DataFrame(columns=list(headers or [])).to_csv(
+            path_to_filename,
+            index=False
+        )
+
+    return rows
+
+
 def clean_stage_files():
     print('clean_stage_files')
     directory_path = get_path_by_zone(zone='stage')